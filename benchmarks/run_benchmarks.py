@@ -0,0 +1,161 @@
+"""
+Per-stage benchmarks of the pipeline on synthetic families.
+
+For every family size, a synthetic family is generated (see synthetic_family.py)
+and the pipeline stages are run one after another in dependency order, with the
+stand-in TMalign and mkdssp from benchmarks/tools, so no data or external
+binaries are needed. The first member is the TM-align reference unless
+--all-vs-all is given, since the all-vs-all reference selection is quadratic in the
+family size and dominates everything else on large families. Each stage runs in a forked child process, which isolates
+its peak memory. The child's own peak RSS and that of its worker processes are
+both recorded, together with wall time and the item counts. Results are written
+as JSON, one record per (family size, stage).
+
+Usage:
+    python benchmarks/run_benchmarks.py --sizes 10 100 1000 --length 150 --output results.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+TOOLS_DIR = os.path.join(BENCHMARK_DIR, "tools")
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+
+import main_pipeline  # noqa: E402
+from extract_ChainA import chain_output_name  # noqa: E402
+from scheduler import Stage, run_stages, topological_order  # noqa: E402
+import structure_store  # noqa: E402
+import tool_executor  # noqa: E402
+from synthetic_family import generate_family  # noqa: E402
+
+
+def _peak_rss_mb(who):
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _run_stage_child(stage, workers, connection):
+    start = time.perf_counter()
+    try:
+        summary = run_stages([stage], workers=workers)[stage.name]
+        error = None
+    except Exception as e:
+        summary, error = {'items': 0, 'cached': 0, 'failed': 0}, repr(e)
+    connection.send({
+        'seconds': time.perf_counter() - start,
+        'peak_rss_mb': _peak_rss_mb(resource.RUSAGE_SELF),
+        'peak_worker_rss_mb': _peak_rss_mb(resource.RUSAGE_CHILDREN),
+        'items': summary['items'],
+        'failed': summary['failed'],
+        'error': error,
+    })
+    connection.close()
+
+
+def benchmark_stages(stages, workers):
+    """Run each stage alone, in dependency order, in a forked child; return one measurement per stage."""
+    by_name = {stage.name: stage for stage in stages}
+    context = multiprocessing.get_context('fork')
+    results = []
+    for name in topological_order(stages):
+        stage = by_name[name]
+        # Dependencies already ran in earlier children
+        isolated = Stage(stage.name, stage.func, stage.items, deps=(), inputs=stage.inputs,
+                         outputs=stage.outputs, params=stage.params, shared_outputs=stage.shared_outputs)
+        receiver, sender = context.Pipe(duplex=False)
+        child = context.Process(target=_run_stage_child, args=(isolated, workers, sender))
+        child.start()
+        sender.close()
+        measurement = receiver.recv() if receiver.poll(None) else None
+        child.join()
+        if measurement is None:
+            measurement = {'error': f"exit code {child.exitcode}"}
+        results.append({'stage': name, **measurement})
+        print(f"[benchmark] {name}: {measurement.get('seconds', float('nan')):.3f} s, "
+              f"{measurement.get('peak_worker_rss_mb', float('nan')):.1f} MB peak worker RSS")
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True,
+                              timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmarks(sizes, length=150, workers=None, compress=False, seed=0, work_dir=None, keep=False,
+                   all_vs_all=False):
+    """Generate one family per size, benchmark every stage and return the records."""
+    records = []
+    base_dir = work_dir or tempfile.mkdtemp(prefix="pipeline_benchmark_")
+    try:
+        for size in sizes:
+            family_dir = os.path.join(base_dir, f"family_{size}")
+            input_dir = os.path.join(family_dir, "input")
+            output_dir = os.path.join(family_dir, "output")
+            shutil.rmtree(family_dir, ignore_errors=True)
+            start = time.perf_counter()
+            paths = generate_family(input_dir, n_members=size, length=length, compress=compress, seed=seed)
+            print(f"[benchmark] Generated {size} structure(s) of length {length} in {time.perf_counter() - start:.2f} s")
+
+            structure_store.set_cache_dir(os.path.join(output_dir, "structure_cache"))
+            tool_executor.set_budget(os.path.join(output_dir, ".tool_slots"), workers)
+            reference = None if all_vs_all else chain_output_name(os.path.basename(paths[0]), 'A')
+            stages = main_pipeline.build_stages(input_dir, output_dir, reference,
+                                                os.path.join(TOOLS_DIR, "mkdssp"),
+                                                os.path.join(TOOLS_DIR, "TMalign"),
+                                                family=f"synthetic{size}", workers=workers, all_vs_all=all_vs_all)
+            for result in benchmark_stages(stages, workers):
+                records.append({'family_size': size, 'length': length, 'compressed': compress,
+                                'all_vs_all': all_vs_all, **result})
+    finally:
+        if not keep and work_dir is None:
+            shutil.rmtree(base_dir, ignore_errors=True)
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic families.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100])
+    parser.add_argument("--length", type=int, default=150)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--gz", action="store_true", help="Write the synthetic structures gzipped")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--all-vs-all", action="store_true",
+                        help="Select the reference by all-vs-all TM-align instead of using the first member")
+    parser.add_argument("--work-dir", default=None, help="Keep generated families and outputs here")
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args(argv)
+
+    records = run_benchmarks(args.sizes, args.length, args.workers, args.gz, args.seed, args.work_dir,
+                             all_vs_all=args.all_vs_all)
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'config': {'sizes': args.sizes, 'length': args.length, 'workers': args.workers,
+                   'compressed': args.gz, 'seed': args.seed, 'all_vs_all': args.all_vs_all},
+        'results': records,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"[benchmark] Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
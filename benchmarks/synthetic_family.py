@@ -0,0 +1,144 @@
+"""
+Synthetic protein families for benchmarking.
+
+A family is one backbone (N, CA, C, O) built with NeRF from a phi/psi profile of
+helix, strand and loop segments. Every member is a copy of it with Gaussian atom
+displacements, larger in loops than in secondary structure, placed with a random
+rigid-body rotation and translation. Perturbing coordinates rather than torsions
+keeps the member-to-reference RMSD controlled (torsion noise accumulates along the
+chain) while still varying every phi/psi. Members may lose a few residues at
+either terminus, keeping the family's residue numbering, so alignments have gaps.
+"""
+import os
+import gzip
+import argparse
+import numpy as np
+
+RESIDUE_NAMES = np.array(['ALA', 'ARG', 'ASN', 'ASP', 'CYS', 'GLN', 'GLU', 'GLY', 'HIS', 'ILE',
+                          'LEU', 'LYS', 'MET', 'PHE', 'PRO', 'SER', 'THR', 'TRP', 'TYR', 'VAL'])
+
+# (phi, psi) of the segment types of the family profile
+SEGMENT_TORSIONS = {'helix': (-63.0, -42.0), 'strand': (-120.0, 130.0), 'loop': (-80.0, 150.0)}
+
+def place_atoms(a, b, c, bond, angle, torsion):
+    """NeRF: positions of the atoms bonded to `c` given the three previous atoms, for a batch of chains."""
+    bc = c - b
+    bc /= np.linalg.norm(bc, axis=1, keepdims=True)
+    normal = np.cross(b - a, bc)
+    normal /= np.linalg.norm(normal, axis=1, keepdims=True)
+    in_plane = np.cross(normal, bc)
+    angle = np.radians(angle)
+    torsion = np.radians(torsion)
+    return (c - bond * np.cos(angle) * bc
+            + (bond * np.sin(angle) * np.cos(torsion))[:, None] * in_plane
+            + (bond * np.sin(angle) * np.sin(torsion))[:, None] * normal)
+
+def build_backbones(phi, psi):
+    """
+    Backbone coordinates from torsions.
+
+    Parameters:
+    - phi, psi (ndarray): (n_members, n_residues) torsions in degrees.
+
+    Returns:
+    - ndarray: (n_members, n_residues, 4, 3) coordinates of N, CA, C and O.
+    """
+    n_members, n_residues = phi.shape
+    coords = np.zeros((n_members, n_residues, 4, 3))
+    coords[:, 0, 0] = [-0.5, 1.36, 0.0]
+    coords[:, 0, 2] = [1.525, 0.0, 0.0]
+    omega = np.full(n_members, 180.0)
+    for i in range(1, n_residues):
+        previous_n, previous_ca, previous_c = coords[:, i - 1, 0], coords[:, i - 1, 1], coords[:, i - 1, 2]
+        coords[:, i, 0] = place_atoms(previous_n, previous_ca, previous_c, 1.33, 116.0, psi[:, i - 1])
+        coords[:, i, 1] = place_atoms(previous_ca, previous_c, coords[:, i, 0], 1.458, 122.0, omega)
+        coords[:, i, 2] = place_atoms(previous_c, coords[:, i, 0], coords[:, i, 1], 1.525, 111.0, phi[:, i])
+    # Carbonyl oxygen in the peptide plane
+    coords[:, :, 3] = place_atoms(coords[:, :, 0].reshape(-1, 3), coords[:, :, 1].reshape(-1, 3),
+                                  coords[:, :, 2].reshape(-1, 3), 1.23, 120.0,
+                                  (psi + 180.0).reshape(-1)).reshape(n_members, n_residues, 3)
+    return coords
+
+def family_profile(length, rng):
+    """Reference phi/psi, per-residue segment type and sequence of a family."""
+    kinds, position = [], 0
+    while position < length:
+        kind = rng.choice(['helix', 'strand', 'loop'], p=[0.4, 0.3, 0.3])
+        size = int(rng.integers(8, 16) if kind == 'helix' else rng.integers(4, 9))
+        kinds.extend([kind] * size)
+        position += size
+    kinds = np.array(kinds[:length])
+    phi = np.array([SEGMENT_TORSIONS[kind][0] for kind in kinds])
+    psi = np.array([SEGMENT_TORSIONS[kind][1] for kind in kinds])
+    sequence = RESIDUE_NAMES[rng.integers(0, len(RESIDUE_NAMES), length)]
+    return phi, psi, kinds, sequence
+
+def pdb_lines(coords, sequence, first, last, bfactors, chain='A'):
+    """ATOM records of residues `first:last` of one member."""
+    lines, serial = [], 1
+    for i in range(first, last):
+        for atom, (name, element) in enumerate((('N', 'N'), ('CA', 'C'), ('C', 'C'), ('O', 'O'))):
+            x, y, z = coords[i, atom]
+            lines.append(f"ATOM  {serial:5d}  {name:<3s} {sequence[i]} {chain}{i + 1:4d}    "
+                         f"{x:8.3f}{y:8.3f}{z:8.3f}{1.0:6.2f}{bfactors[i]:6.2f}           {element}\n")
+            serial += 1
+    lines.append(f"TER   {serial:5d}      {sequence[last - 1]} {chain}{last:4d}\n")
+    lines.append("END\n")
+    return lines
+
+def random_rotations(n, rng):
+    """Uniformly distributed rotation matrices, from normalized random quaternions."""
+    q = rng.normal(size=(n, 4))
+    q /= np.linalg.norm(q, axis=1, keepdims=True)
+    w, x, y, z = q.T
+    return np.stack([
+        np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)], axis=1),
+        np.stack([2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)], axis=1),
+        np.stack([2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)], axis=1),
+    ], axis=1)
+
+def generate_family(output_dir, n_members=10, length=150, noise=0.15, loop_noise=0.5, max_trim=5,
+                    compress=False, seed=0, prefix='member'):
+    """
+    Write a synthetic family of `n_members` single-chain structures and return their paths.
+
+    Atoms are displaced by `noise` Angstrom of Gaussian noise per axis (`loop_noise` in
+    loops); up to `max_trim` residues are removed from each terminus. Files are
+    `<prefix>_<i>.pdb`, or `.pdb.gz` with `compress`.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    phi, psi, kinds, sequence = family_profile(length, rng)
+    base = build_backbones(phi[None, :], psi[None, :])[0]
+    base -= base[:, 1].mean(axis=0)
+    sigma = np.where(kinds == 'loop', loop_noise, noise)[:, None, None]
+    # B-factors rise in loops and towards the termini
+    termini = np.minimum(np.arange(length), length - 1 - np.arange(length))
+    profile = 15.0 + 20.0 * (kinds == 'loop') + 10.0 * np.exp(-termini / 5.0)
+    trims = rng.integers(0, max_trim + 1, size=(n_members, 2)) if max_trim else np.zeros((n_members, 2), dtype=int)
+
+    paths = []
+    width = len(str(n_members - 1))
+    for member, rotation in enumerate(random_rotations(n_members, rng)):
+        coords = (base + rng.normal(size=base.shape) * sigma) @ rotation.T + rng.uniform(-20, 20, size=3)
+        bfactors = np.clip(profile + rng.normal(size=length) * 3.0, 1.0, 999.0)
+        lines = pdb_lines(coords, sequence, trims[member, 0], length - trims[member, 1], bfactors)
+        path = os.path.join(output_dir, f"{prefix}_{member:0{width}d}.pdb" + ('.gz' if compress else ''))
+        with (gzip.open(path, 'wt') if compress else open(path, 'w')) as f:
+            f.writelines(lines)
+        paths.append(path)
+    return paths
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic protein family as PDB files.")
+    parser.add_argument("output_dir")
+    parser.add_argument("--members", type=int, default=10)
+    parser.add_argument("--length", type=int, default=150)
+    parser.add_argument("--noise", type=float, default=0.15, help="Atom displacement (Angstrom) in helices and strands")
+    parser.add_argument("--loop-noise", type=float, default=0.5, help="Atom displacement (Angstrom) in loops")
+    parser.add_argument("--max-trim", type=int, default=5)
+    parser.add_argument("--gz", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generate_family(args.output_dir, args.members, args.length, args.noise, args.loop_noise, args.max_trim,
+                    args.gz, args.seed)
@@ -0,0 +1,268 @@
+"""
+Command-line interface of the pipeline.
+
+`run` executes the whole pipeline; every other subcommand runs one stage on a
+directory, as the stage modules' own batch functions do. A stage module is only
+imported once its subcommand is chosen, so `--help` and single-stage runs do not
+pay for the imports of the other stages.
+
+Usage:
+    python cli.py run input_dir output_dir --workers 8 --trace trace.json
+    python cli.py dssp pdb_chainA dssp_analysis --dssp-executable /usr/local/bin/mkdssp
+"""
+import os
+import sys
+import logging
+import argparse
+import importlib
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(REPO_DIR, "src"))
+sys.path.insert(0, REPO_DIR)
+
+
+def add_command(subparsers, name, module, call, help):
+    """Subcommand `name` that imports `module` and passes it, with the parsed arguments, to `call`."""
+    parser = subparsers.add_parser(name, help=help, description=help)
+    parser.set_defaults(module=module, call=call)
+    return parser
+
+
+def tool_limit(text):
+    tool, separator, limit = text.partition('=')
+    if not separator or not limit.isdigit() or int(limit) < 1:
+        raise argparse.ArgumentTypeError(f"expected TOOL=N, got '{text}'")
+    return tool, int(limit)
+
+
+def entropy_options(main_pipeline, args):
+    sweep = main_pipeline.entropy_calculation.BIN_SWEEP if args.entropy_sweep is None else args.entropy_sweep
+    return {'entropy_bins': args.entropy_bins, 'entropy_sweep': tuple(sweep), 'entropy_bootstrap': args.entropy_bootstrap}
+
+
+def family_reference(text):
+    family, separator, reference = text.partition('=')
+    if not separator or not family or not reference:
+        raise argparse.ArgumentTypeError(f"expected FAMILY=CHAIN_FILE, got '{text}'")
+    return family, reference
+
+
+def store_filters(family_store, args):
+    filters = {}
+    if args.structure:
+        filters['Structure'] = args.structure
+    if args.residues:
+        column = family_store.residue_column(args.store_file)
+        if column is None:
+            raise SystemExit(f"{args.store_file} has no residue number column")
+        filters[column] = tuple(args.residues)
+    return filters
+
+
+def screen_margin(module, args):
+    # `module` is main_pipeline or run_tm_align, which both import rmsd_prescreen
+    if args.no_screen:
+        return None
+    return module.rmsd_prescreen.SCREEN_MARGIN if args.screen_margin is None else args.screen_margin
+
+
+def print_queue_status(work_queue, queue_dir):
+    for row in work_queue.status(queue_dir):
+        state = "finished" if row['finished'] else f"{row['claimed']} running"
+        print(f"{row['family']:<20} {row['stage']:<18} {row['done']:>6}/{row['tasks']:<6} {state}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Protein conformational analysis pipeline.")
+    subparsers = parser.add_subparsers(dest="command", required=True, metavar="command")
+
+    run = add_command(subparsers, "run", "main_pipeline", lambda m, a: m.main_pipeline(
+        a.input_dir, a.output_dir, a.reference, workers=a.workers,
+        dssp_executable=a.dssp_executable or "/usr/local/bin/mkdssp",
+        tm_align_path=a.tm_align_path or m.run_tm_align.tm_align_path, use_cache=not a.no_cache,
+        chain_policy=a.chain_policy, family=a.family, trace_file=a.trace, profile_stage=a.profile_stage,
+        sample_interval=a.sample_interval, tool_limits=dict(a.tool_limit), ensemble=a.ensemble,
+        screen_margin=screen_margin(m, a), screen_audit=a.screen_audit, all_vs_all=a.all_vs_all,
+        rmsd_trim_cutoff=a.rmsd_trim_cutoff, correlation_permutations=a.correlation_permutations,
+        **entropy_options(m, a)), "Run the whole pipeline")
+    run.add_argument("input_dir")
+    run.add_argument("output_dir")
+    reference = run.add_mutually_exclusive_group(required=True)
+    reference.add_argument("--reference", default=None, help="Chain file used as TM-align reference")
+    reference.add_argument("--all-vs-all", action="store_true",
+                           help="Use the medoid of an all-vs-all TM-align comparison as reference "
+                                "(quadratic in the family size)")
+    run.add_argument("--family", default=None, help="Family name (default: input directory name)")
+    run.add_argument("--no-cache", action="store_true", help="Rerun items whose inputs are unchanged")
+    run.add_argument("--trace", default=None, help="Write a Chrome trace of the run to this file")
+    run.add_argument("--profile-stage", default=None, help="Stack-sample this stage's items")
+    run.add_argument("--sample-interval", type=float, default=0.005)
+    run.add_argument("--tool-limit", type=tool_limit, action="append", default=[], metavar="TOOL=N",
+                     help="At most N running processes of TOOL (TMalign or mkdssp); repeatable")
+
+    extract = add_command(subparsers, "extract-chains", "extract_ChainA", lambda m, a: m.extract_chains(
+        a.input_dir, a.output_dir, a.chain_policy, a.workers), "Extract one chain per structure file")
+    extract.add_argument("input_dir")
+    extract.add_argument("output_dir")
+
+    phi_psi = add_command(subparsers, "phi-psi", "calculate_phi_psi", lambda m, a: m.process_structures_and_save_angles(
+        a.input_dir, a.output_dir), "Backbone phi/psi angles per chain")
+    phi_psi.add_argument("input_dir")
+    phi_psi.add_argument("output_dir")
+
+    all_vs_all = add_command(subparsers, "all-vs-all", "all_vs_all", lambda m, a: m.run_all_vs_all(
+        a.pdb_dir, a.output_dir, a.family, a.tm_align_path or m.run_tm_align.tm_align_path, a.workers),
+        "Pre-filtered all-vs-all TM-align and medoid selection")
+    all_vs_all.add_argument("pdb_dir")
+    all_vs_all.add_argument("output_dir")
+    all_vs_all.add_argument("--family", default=None)
+
+    tm_align = add_command(subparsers, "tm-align", "run_tm_align", lambda m, a: m.run_tm_align(
+        a.pdb_dir, a.output_dir, a.reference, a.tm_align_path or m.tm_align_path, a.family, a.workers,
+        screen_margin=screen_margin(m, a), screen_audit=a.screen_audit),
+        "Align every chain against a reference")
+    tm_align.add_argument("pdb_dir")
+    tm_align.add_argument("output_dir")
+    tm_align.add_argument("reference", help="Reference chain file name in pdb_dir")
+    tm_align.add_argument("--family", default=None)
+
+    mapping = add_command(subparsers, "residue-mapping", "residue_mapping", lambda m, a: m.build_family_mappings(
+        a.results, a.pdb_dir, a.output_dir, a.family), "Residue mappings of the pairs that passed TM-align")
+    mapping.add_argument("results", help="<family>_tm_align.csv")
+    mapping.add_argument("pdb_dir")
+    mapping.add_argument("output_dir")
+    mapping.add_argument("family")
+
+    delta = add_command(subparsers, "delta", "delta_phi_psi", lambda m, a: m.process_family(
+        a.mapping, a.angles_dir, a.output_dir, a.family), "Delta phi/psi of every mapped pair")
+    delta.add_argument("mapping", help="Per-family residue mapping file")
+    delta.add_argument("angles_dir")
+    delta.add_argument("output_dir")
+    delta.add_argument("family")
+
+    entropy = add_command(subparsers, "entropy", "entropy_calculation", lambda m, a: m.process_files(
+        a.input_dir, a.output_dir, m.MAX_RESIDUE_NUMBER_DICT, a.bins,
+        m.BIN_SWEEP if a.sweep is None else a.sweep, a.bootstrap), "Per-residue entropies of agg_*.csv tables")
+    entropy.add_argument("input_dir")
+    entropy.add_argument("output_dir")
+    entropy.add_argument("--bins", type=int, default=60)
+    entropy.add_argument("--sweep", type=int, nargs="*", default=None, help="Extra bin counts (default: 12 36 60 120)")
+    entropy.add_argument("--bootstrap", type=int, default=0, help="Bootstrap replicates for confidence intervals")
+
+    dssp = add_command(subparsers, "dssp", "run_dssp", lambda m, a: m.process_pdb_files(
+        a.input_dir, a.output_dir, a.dssp_executable or "/usr/local/bin/mkdssp", a.workers, a.timeout),
+        "Secondary structure and per-residue DSSP tables")
+    dssp.add_argument("input_dir")
+    dssp.add_argument("output_dir")
+    dssp.add_argument("--timeout", type=float, default=300)
+
+    b_factors = add_command(subparsers, "b-factors", "b_factor_extraction", lambda m, a: m.process_pdb_files(
+        a.input_dir, a.output_dir, a.family, a.workers), "Per-residue B-factors")
+    b_factors.add_argument("input_dir")
+    b_factors.add_argument("output_dir")
+    b_factors.add_argument("--family", default=None, help="Also write the <family>_b_factors.csv table")
+
+    rmsd = add_command(subparsers, "rmsd", "rmsd_calculation", lambda m, a: m.process_family(
+        a.mapping, a.pdb_dir, a.output_dir, a.family, a.trim_cutoff), "Per-residue RMSD after superposition")
+    rmsd.add_argument("mapping", help="Per-family residue mapping file")
+    rmsd.add_argument("pdb_dir")
+    rmsd.add_argument("output_dir")
+    rmsd.add_argument("family")
+    rmsd.add_argument("--trim-cutoff", type=float, default=None, help="Refit on residues within this distance")
+
+    asa = add_command(subparsers, "asa", "asa_extraction", lambda m, a: m.process_dssp_files(
+        a.dssp_dir, a.output_dir, a.chain), "Per-residue ASA from .dssp files")
+    asa.add_argument("dssp_dir")
+    asa.add_argument("output_dir")
+    asa.add_argument("--chain", default=None)
+
+    correlation = add_command(subparsers, "correlation", "correlation_analysis", lambda m, a: m.process_families(
+        a.metrics_dir, a.output_file, a.permutations, a.workers, a.seed), "Correlation summary over family metrics")
+    correlation.add_argument("metrics_dir", help="Directory with <family>_metrics.csv files")
+    correlation.add_argument("output_file")
+    correlation.add_argument("--permutations", type=int, default=1000)
+    correlation.add_argument("--seed", type=int, default=0, help="Seed of the permutations")
+
+    export = add_command(subparsers, "export", "family_store", lambda m, a: m.export_csv(
+        a.store_file, a.csv_file, a.columns, store_filters(m, a)), "Export a family store table as CSV")
+    export.add_argument("store_file", help="<family>_<table>.fstore in <output_dir>/family_store")
+    export.add_argument("csv_file")
+    export.add_argument("--columns", nargs="+", default=None)
+    export.add_argument("--structure", action="append", default=[], help="Only rows of this structure; repeatable")
+    export.add_argument("--residues", type=int, nargs=2, default=None, metavar=("FIRST", "LAST"),
+                        help="Only this inclusive residue number range")
+
+    compact = add_command(subparsers, "compact", "family_store", lambda m, a: [m.compact(path) for path in a.store_files],
+                          "Drop superseded rows from family store tables and merge their chunks")
+    compact.add_argument("store_files", nargs="+")
+
+    queue_init = add_command(subparsers, "queue-init", "main_pipeline", lambda m, a: m.enqueue_families(
+        a.queue_dir, a.input_dirs, a.output_root, a.dssp_executable or "/usr/local/bin/mkdssp",
+        a.tm_align_path or m.run_tm_align.tm_align_path, a.chain_policy, a.workers, a.ensemble,
+        screen_margin(m, a), a.screen_audit, dict(a.reference), a.all_vs_all, rmsd_trim_cutoff=a.rmsd_trim_cutoff,
+        correlation_permutations=a.correlation_permutations, **entropy_options(m, a)),
+        "Add families to a work queue on a shared filesystem")
+    queue_init.add_argument("queue_dir")
+    queue_init.add_argument("input_dirs", nargs="+", help="One input directory per family")
+    queue_init.add_argument("--output-root", required=True, help="Outputs go to <output-root>/<family>")
+    queue_init.add_argument("--reference", type=family_reference, action="append", default=[],
+                            metavar="FAMILY=CHAIN_FILE", help="TM-align reference of a family; repeatable")
+    queue_init.add_argument("--all-vs-all", action="store_true",
+                            help="Families without --reference use the medoid of an all-vs-all TM-align "
+                                 "comparison, queued as one task per pair")
+
+    queue_work = add_command(subparsers, "queue-work", "main_pipeline", lambda m, a: m.run_queue_workers(
+        a.queue_dir, a.processes, lease_seconds=a.lease, poll_seconds=a.poll, max_tasks=a.max_tasks,
+        exit_when_idle=a.exit_when_idle), "Pull work from a queue until every family is finished")
+    queue_work.add_argument("queue_dir")
+    queue_work.add_argument("--processes", type=int, default=1, help="Worker processes on this host")
+    queue_work.add_argument("--lease", type=float, default=300, help="Seconds before an unrenewed claim expires")
+    queue_work.add_argument("--poll", type=float, default=2.0, help="Seconds between scans when idle")
+    queue_work.add_argument("--max-tasks", type=int, default=None, help="Stop after this many units of work")
+    queue_work.add_argument("--exit-when-idle", action="store_true",
+                            help="Stop once nothing can be claimed instead of waiting for other workers")
+
+    queue_status = add_command(subparsers, "queue-status", "work_queue", lambda m, a: print_queue_status(m, a.queue_dir),
+                               "Show the progress of a work queue")
+    queue_status.add_argument("queue_dir")
+
+    # Options shared by several stages
+    for command in (run, extract, all_vs_all, tm_align, dssp, b_factors, correlation, queue_init):
+        command.add_argument("--workers", type=int, default=None)
+    for command in (run, all_vs_all, tm_align, queue_init):
+        command.add_argument("--tm-align-path", default=None)
+    for command in (run, dssp, queue_init):
+        command.add_argument("--dssp-executable", default=None)
+    for command in (run, extract, queue_init):
+        command.add_argument("--chain-policy", default="first", help="'first', 'longest' or a chain ID")
+    for command in (run, queue_init):
+        command.add_argument("--ensemble", action="store_true",
+                             help="Analyse every model of NMR/MD ensembles as a conformer, not only the first")
+    for command in (run, tm_align, queue_init):
+        command.add_argument("--screen-margin", type=float, default=None,
+                             help="Skip TM-align for pairs whose estimated RMSD exceeds the cutoff by more than "
+                                  "this many Angstrom (default: 1.0)")
+        command.add_argument("--no-screen", action="store_true", help="Run TM-align on every pair")
+        command.add_argument("--screen-audit", type=float, default=0.0, metavar="FRACTION",
+                             help="Fraction of screened-out pairs aligned anyway to count false rejects")
+    for command in (run, queue_init):
+        command.add_argument("--entropy-bins", type=int, default=60)
+        command.add_argument("--entropy-sweep", type=int, nargs="*", default=None,
+                             help="Extra entropy bin counts (default: 12 36 60 120)")
+        command.add_argument("--entropy-bootstrap", type=int, default=0,
+                             help="Bootstrap replicates for entropy confidence intervals")
+        command.add_argument("--rmsd-trim-cutoff", type=float, default=None,
+                             help="Refit the RMSD superposition on residues within this distance")
+        command.add_argument("--correlation-permutations", type=int, default=1000,
+                             help="Permutations behind the correlation p-values")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    return args.call(importlib.import_module(args.module), args)
+
+
+if __name__ == "__main__":
+    main()
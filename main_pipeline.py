@@ -1,5 +1,11 @@
 import os
-import extract_chainA  # Code 1
+import sys
+import glob
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+import extract_ChainA  # Code 1
 import calculate_phi_psi  # Code 2
 import run_tm_align  # Code 3
 import residue_mapping  # Code 4
@@ -9,53 +15,361 @@ import run_dssp  # Code 7
 import b_factor_extraction  # Code 8
 import rmsd_calculation  # Code 9
 import asa_extraction  # Code 10
+import correlation_analysis  # Code 11
+import all_vs_all as pair_comparison
+import rmsd_prescreen
+import family_store
+from scheduler import Stage, run_stages
+from cache import Manifest, tool_version
+import structure_store
+import tool_executor
+import work_queue
+from tracing import Tracer
 
-def main_pipeline(input_dir, output_dir):
-    print("Starting the pipeline...")
+def list_files(directory, suffix, prefix=""):
+    """Sorted paths of the non-hidden files in `directory` matching prefix/suffix."""
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, f) for f in sorted(os.listdir(directory))
+            if f.startswith(prefix) and f.endswith(suffix) and not f.startswith('.')]
+
+def build_stages(input_dir, output_dir, reference_pdb_name, dssp_executable, tm_align_path, entropy_bins=60,
+                 entropy_sweep=entropy_calculation.BIN_SWEEP, entropy_bootstrap=0,
+                 rmsd_trim_cutoff=None, chain_policy='first', family=None, workers=None, sharded=False,
+                 ensemble=False, screen_margin=rmsd_prescreen.SCREEN_MARGIN, screen_audit=0.0, all_vs_all=False,
+                 correlation_permutations=1000):
+    """
+    Stage DAG of one family.
+
+    The TM-align reference is `reference_pdb_name` (a chain file name in `pdb_chainA`) or,
+    with `all_vs_all=True`, the medoid of a pre-filtered all-vs-all TM-align comparison of
+    the family, which is quadratic in the family size. Exactly one of the two must be given.
 
-    # Step 1: Extract Chain A from PDB files
+    With `sharded=True` (work queue runs), TM-align runs as one item per pair whose records
+    a separate `tm_align` stage merges into the family result file.
+
+    With `ensemble=True`, every model of multi-model (NMR or MD) inputs is analysed: the chain
+    is also extracted with all its models, and the angle, DSSP, B-factor and ASA stages stream
+    these files one model at a time with results keyed by Model. Reference selection, TM-align,
+    residue mapping and RMSD use the first model.
+
+    Pairs that the RMSD pre-screen rejects (see run_tm_align.align_screened_pair) skip
+    TM-align; `screen_margin=None` aligns every pair, and `screen_audit` is the fraction of
+    rejected pairs aligned anyway to count false rejects.
+
+    The correlation p-values are drawn from `correlation_permutations` permutations on up
+    to `workers` processes.
+    """
+    if bool(reference_pdb_name) == bool(all_vs_all):
+        raise ValueError("Give either a reference chain file or all_vs_all=True to select the reference")
     chainA_output_dir = os.path.join(output_dir, "pdb_chainA")
-    extract_chainA.process_structures_and_save_angles(input_dir, chainA_output_dir)
-    
-    # Step 2: Calculate phi/psi angles
-    dihedral_output_dir = os.path.join(output_dir, "dihedral")
-    calculate_phi_psi.process_structures_and_save_angles(chainA_output_dir, dihedral_output_dir)
-    
-    # Step 3: Run TM-align
+    ensemble_output_dir = os.path.join(output_dir, "pdb_ensemble")
     tm_output_dir = os.path.join(output_dir, "TM_output")
-    run_tm_align.run_tm_align(chainA_output_dir, tm_output_dir)
-    
-    # Step 4: Compare residue mappings
     residue_mapping_dir = os.path.join(output_dir, "residue_mapping")
-    residue_mapping.process_residue_mappings(tm_output_dir, chainA_output_dir, residue_mapping_dir)
-    
-    # Step 5: Calculate Delta Phi and Psi
     delta_output_dir = os.path.join(output_dir, "delta")
-    delta_phi_psi.process_alignment_pairs(residue_mapping_dir, dihedral_output_dir, delta_output_dir)
-    
-    # Step 6: Calculate entropy
     entropy_output_dir = os.path.join(output_dir, "entropy")
-    entropy_calculation.calculate_entropy(delta_output_dir, entropy_output_dir)
-    
-    # Step 7: Run DSSP for secondary structure analysis
     dssp_output_dir = os.path.join(output_dir, "dssp_analysis")
-    run_dssp.process_pdb_files(chainA_output_dir, dssp_output_dir)
-    
-    # Step 8: Extract B-factors
-    b_factor_output_dir = os.path.join(output_dir, "b_factors")
-    b_factor_extraction.process_pdb_files(chainA_output_dir, b_factor_output_dir)
-    
-    # Step 9: Calculate RMSD
     rmsd_output_dir = os.path.join(output_dir, "rmsd")
-    rmsd_calculation.process_rmsd_files(chainA_output_dir, rmsd_output_dir)
-    
-    # Step 10: Extract ASA
-    asa_output_dir = os.path.join(output_dir, "asa")
-    asa_extraction.process_dssp_files(dssp_output_dir, asa_output_dir)
+    correlation_output_dir = os.path.join(output_dir, "correlation")
+    # Per-structure tables (angles, DSSP, ASA, B-factors) go to one store file per family and table
+    store_dir = os.path.join(output_dir, "family_store")
+
+    for directory in (chainA_output_dir, ensemble_output_dir, tm_output_dir, residue_mapping_dir, delta_output_dir,
+                      entropy_output_dir, dssp_output_dir, rmsd_output_dir, correlation_output_dir,
+                      store_dir):
+        os.makedirs(directory, exist_ok=True)
+
+    family = family or os.path.basename(os.path.normpath(input_dir))
+    tm_results_path = os.path.join(tm_output_dir, run_tm_align.results_file_name(family))
+    pair_matrix_path = os.path.join(tm_output_dir, pair_comparison.matrix_file_name(family))
+    mapping_path = os.path.join(residue_mapping_dir, residue_mapping.mapping_file_name(family))
+    pair_record_dir = os.path.join(tm_output_dir, "pairs")
+    candidates_path = os.path.join(tm_output_dir, pair_comparison.candidates_file_name(family))
+    matrix_record_dir = os.path.join(tm_output_dir, "matrix_pairs")
+    agg_path = os.path.join(delta_output_dir, delta_phi_psi.agg_output_name(family))
+    entropy_path = os.path.join(entropy_output_dir, entropy_calculation.entropy_output_name(family))
+    angles_store = family_store.table_path(store_dir, family, calculate_phi_psi.STORE_TABLE)
+    dssp_store = family_store.table_path(store_dir, family, run_dssp.STORE_TABLE)
+    composition_store = family_store.table_path(store_dir, family, run_dssp.COMPOSITION_TABLE)
+    b_factor_store = family_store.table_path(store_dir, family, b_factor_extraction.STORE_TABLE)
+    asa_store = family_store.table_path(store_dir, family, asa_extraction.STORE_TABLE)
+
+    def reference_name():
+        # In all-vs-all mode the reference is the medoid of the comparison
+        return reference_pdb_name or pair_comparison.load_medoid(pair_matrix_path)
+
+    def chain_files():
+        return list_files(chainA_output_dir, ".pdb")
+
+    def model_files():
+        # Inputs of the per-model stages: the all-model chain files in ensemble mode
+        return list_files(ensemble_output_dir, ".pdb") if ensemble else chain_files()
+
+    def extracted_chains(path, out, policy, *all_models):
+        # The chain ID is only known once the file is read
+        return glob.glob(os.path.join(glob.escape(out), f"{glob.escape(extract_ChainA.structure_name(path))}_Chain?.pdb"))
+
+    def dssp_outputs(dssp_path):
+        # <name>.dssp is always written; the per-model files of an ensemble only exist once mkdssp ran
+        return [dssp_path] + [path for model, path in asa_extraction.model_dssp_files(dssp_path) if model]
+
+    def existing(*paths):
+        return [path for path in paths if os.path.exists(path)]
+
+    def correlation_inputs(name, reference):
+        return existing(entropy_path,
+                        os.path.join(rmsd_output_dir, rmsd_calculation.rmsd_output_name(name)),
+                        b_factor_store, asa_store)
+
+    # Versions of the external tools are part of the cache key of their stages
+    dssp_params = {'version': tool_version(dssp_executable)}
+    screen = (run_tm_align.MAX_RMSD, screen_margin, screen_audit)
+
+    if sharded:
+        # The all-vs-all comparison is split into one item per pre-filtered pair, merged into the
+        # pair matrix by `select_reference`
+        select_reference_stages = [
+            Stage("prefilter_pairs", pair_comparison.write_pair_candidates, deps=["extract_chainA"],
+                  items=lambda: [(chainA_output_dir, tm_output_dir, family)] if all_vs_all else [],
+                  inputs=lambda pdb_dir, out, name: chain_files(),
+                  outputs=lambda pdb_dir, out, name: [candidates_path]),
+            Stage("all_vs_all_pairs", pair_comparison.align_matrix_pair, deps=["prefilter_pairs"],
+                  items=lambda: [(chainA_output_dir, matrix_record_dir, name1, name2, tm_align_path,
+                                  run_tm_align.TM_ALIGN_TIMEOUT, run_tm_align.TM_ALIGN_RETRIES)
+                                 for name1, name2 in pair_comparison.pair_candidates(candidates_path)]
+                  if all_vs_all else [],
+                  outputs=lambda pdb_dir, out, name1, name2, *args: [
+                      os.path.join(out, pair_comparison.pair_record_name(name1, name2))]),
+            Stage("select_reference", pair_comparison.merge_matrix_records, deps=["all_vs_all_pairs"],
+                  items=lambda: [(chainA_output_dir, matrix_record_dir, tm_output_dir, family, tm_align_path)]
+                  if all_vs_all else [],
+                  outputs=lambda *args: [pair_matrix_path]),
+        ]
+        tm_align_stages = [
+            Stage("tm_align_pairs", run_tm_align.align_pair_record, deps=["select_reference"],
+                  items=lambda: [(chainA_output_dir, pair_record_dir, reference_name(), pdb_file, tm_align_path,
+                                  run_tm_align.TM_ALIGN_TIMEOUT, run_tm_align.TM_ALIGN_RETRIES, *screen)
+                                 for pdb_file in run_tm_align.pair_mobiles(chainA_output_dir, reference_name())]),
+            Stage("tm_align", run_tm_align.merge_pair_records, deps=["tm_align_pairs"],
+                  items=lambda: [(chainA_output_dir, pair_record_dir, tm_output_dir, reference_name(), family)]),
+        ]
+    else:
+        # All-vs-all comparison with pre-filtering, only needed to pick the medoid reference
+        select_reference_stages = [
+            Stage("select_reference", pair_comparison.run_all_vs_all, deps=["extract_chainA"],
+                  items=lambda: [(chainA_output_dir, tm_output_dir, family, tm_align_path, workers)] if all_vs_all else []),
+        ]
+        # One item per family: the runner keeps `workers` TM-align processes in flight and
+        # reuses the records of unchanged pairs from its own result file
+        tm_align_stages = [
+            Stage("tm_align", run_tm_align.run_tm_align, deps=["select_reference"],
+                  items=lambda: [(chainA_output_dir, tm_output_dir, reference_name(), tm_align_path, family, workers,
+                                  run_tm_align.TM_ALIGN_TIMEOUT, run_tm_align.TM_ALIGN_RETRIES, *screen)]),
+        ]
+
+    return [
+        # Step 1: Extract Chain A from PDB files
+        Stage("extract_chainA", extract_ChainA.extract_chain,
+              items=lambda: [(path, chainA_output_dir, chain_policy) for path in extract_ChainA.list_structure_files(input_dir)],
+              inputs=lambda path, out, policy: [path],
+              outputs=extracted_chains),
+        # The same chain with every model of the file, read by the per-model stages
+        Stage("extract_ensembles", extract_ChainA.extract_chain,
+              items=lambda: [(path, ensemble_output_dir, chain_policy, True)
+                             for path in extract_ChainA.list_structure_files(input_dir)] if ensemble else [],
+              inputs=lambda path, out, policy, all_models: [path],
+              outputs=extracted_chains),
+        # Step 2: Calculate phi/psi angles
+        Stage("phi_psi", calculate_phi_psi.store_structure_angles, deps=["extract_chainA", "extract_ensembles"],
+              items=lambda: [(path, angles_store, ensemble) for path in model_files()],
+              inputs=lambda path, store, ensemble: [path],
+              shared_outputs=lambda path, store, ensemble: [store]),
+        # Step 3: Run TM-align
+        *select_reference_stages,
+        *tm_align_stages,
+        # Step 4: Compare residue mappings
+        # The TM-align records already hold the input file hashes, so they are the only input
+        Stage("residue_mapping", residue_mapping.build_family_mappings, deps=["tm_align"],
+              items=lambda: [(tm_results_path, chainA_output_dir, residue_mapping_dir, family)],
+              inputs=lambda results, pdb_dir, out, name: [results],
+              outputs=lambda results, pdb_dir, out, name: [mapping_path]),
+        # Step 5: Calculate Delta Phi and Psi
+        # One long-format table per family, which is the agg_<family>.csv read by the entropy stage
+        Stage("delta_phi_psi", delta_phi_psi.process_family, deps=["residue_mapping", "phi_psi"],
+              items=lambda: [(mapping_path, None, delta_output_dir, family, angles_store)] if os.path.exists(mapping_path) else [],
+              inputs=lambda path, angles_dir, out, name, store: [path, *existing(store)],
+              outputs=lambda path, angles_dir, out, name, store: [os.path.join(out, delta_phi_psi.agg_output_name(name))]),
+        # Step 6: Calculate entropy
+        # The family name, not the file name, gives the residue number cutoff
+        Stage("entropy", entropy_calculation.process_file, deps=["delta_phi_psi"],
+              items=lambda: [(agg_path, entropy_path, entropy_calculation.MAX_RESIDUE_NUMBER_DICT.get(family),
+                              entropy_bins, tuple(entropy_sweep), entropy_bootstrap)] if os.path.exists(agg_path) else [],
+              inputs=lambda path, out, max_residue, bins, sweep, n_boot: [path],
+              outputs=lambda path, out, max_residue, bins, sweep, n_boot: [out]),
+        # Step 7: Run DSSP once per chain; the raw .dssp output also feeds the ASA stage
+        Stage("dssp", run_dssp.store_pdb_file, deps=["extract_chainA", "extract_ensembles"],
+              items=lambda: [(path, dssp_output_dir, dssp_store, composition_store, dssp_executable,
+                              run_dssp.DSSP_TIMEOUT, ensemble) for path in model_files()],
+              inputs=lambda path, out, *args: [path],
+              outputs=lambda path, out, *args: dssp_outputs(os.path.join(out, run_dssp.dssp_output_name(path))),
+              shared_outputs=lambda path, out, residues, composition, *args: [residues, composition],
+              params=dssp_params),
+        # Step 8: Extract B-factors
+        Stage("b_factors", b_factor_extraction.store_pdb_file, deps=["extract_chainA", "extract_ensembles"],
+              items=lambda: [(path, b_factor_store, ensemble) for path in model_files()],
+              inputs=lambda path, store, ensemble: [path],
+              shared_outputs=lambda path, store, ensemble: [store]),
+        # Step 9: Calculate RMSD
+        # Targets are superposed onto the reference through the residue mappings
+        Stage("rmsd", rmsd_calculation.process_family, deps=["residue_mapping"],
+              items=lambda: [(mapping_path, chainA_output_dir, rmsd_output_dir, family, rmsd_trim_cutoff)]
+              if os.path.exists(mapping_path) else [],
+              inputs=lambda path, pdb_dir, out, name, cutoff: [path, *chain_files()],
+              outputs=lambda path, pdb_dir, out, name, cutoff: [
+                  os.path.join(out, rmsd_calculation.rmsd_output_name(name)),
+                  os.path.join(out, rmsd_calculation.superposition_output_name(name))]),
+        # Step 10: Extract ASA
+        Stage("asa", asa_extraction.store_dssp_file, deps=["dssp"],
+              items=lambda: [(path, asa_store) for path in list_files(dssp_output_dir, ".dssp")],
+              inputs=lambda path, store: [path for _, path in asa_extraction.model_dssp_files(path)],
+              shared_outputs=lambda path, store: [store]),
+        # Step 11: Correlate entropy with RMSD, B-factors and relative SASA
+        Stage("correlation", correlation_analysis.process_family_store, deps=["entropy", "rmsd", "b_factors", "asa"],
+              items=lambda: [(family, reference_name(), entropy_output_dir, rmsd_output_dir, store_dir,
+                              correlation_output_dir, correlation_permutations, workers)]
+              if os.path.exists(entropy_path) else [],
+              inputs=lambda name, reference, *dirs: correlation_inputs(name, reference),
+              outputs=lambda name, reference, *dirs: [
+                  os.path.join(correlation_output_dir, correlation_analysis.metrics_output_name(name)),
+                  os.path.join(correlation_output_dir, correlation_analysis.summary_output_name(name))]),
+    ]
+
+def main_pipeline(input_dir, output_dir, reference_pdb_name=None, workers=None,
+                  dssp_executable="/usr/local/bin/mkdssp", tm_align_path=run_tm_align.tm_align_path,
+                  use_cache=True, chain_policy='first', family=None, trace_file=None, profile_stage=None,
+                  sample_interval=0.005, tool_limits=None, ensemble=False,
+                  screen_margin=rmsd_prescreen.SCREEN_MARGIN, screen_audit=0.0, all_vs_all=False, entropy_bins=60,
+                  entropy_sweep=entropy_calculation.BIN_SWEEP, entropy_bootstrap=0, rmsd_trim_cutoff=None,
+                  correlation_permutations=1000):
+    """
+    Run every stage on the structures in `input_dir`.
+
+    With `trace_file`, each work item is measured (wall and CPU time, peak RSS, I/O,
+    external tool time, cache hits) and the run is written there as a Chrome trace.
+    With `profile_stage`, the items of that stage are stack-sampled every
+    `sample_interval` seconds and the stacks written next to the trace as
+    `<trace>_<stage>.folded` for flame graph tools.
+
+    TM-align and mkdssp jobs of all stages share a budget of `workers` running tool
+    processes; `tool_limits` (e.g. {'TMalign': 4}) caps single tools further.
+
+    With `ensemble`, every model of multi-model inputs is analysed; see `build_stages` for
+    this, for the TM-align pre-screen options and for `all_vs_all` reference selection.
+    `entropy_bins`, `entropy_sweep` and `entropy_bootstrap` are the bin count, the extra bin
+    counts and the bootstrap replicates of the entropy stage (see entropy_calculation.process_file).
+    With `rmsd_trim_cutoff`, the RMSD superposition is refitted on the residues within that
+    distance (see rmsd_calculation.process_family). `correlation_permutations` is the number
+    of permutations behind the correlation p-values.
+    """
+    print("Starting the pipeline...")
+
+    # Every chain is parsed once; workers share the parsed arrays through this cache
+    structure_store.set_cache_dir(os.path.join(output_dir, "structure_cache"))
+    # External tool jobs of every worker draw from one budget, so TM-align and DSSP interleave
+    tool_executor.set_budget(os.path.join(output_dir, ".tool_slots"), workers, tool_limits)
+
+    stages = build_stages(input_dir, output_dir, reference_pdb_name, dssp_executable, tm_align_path,
+                          entropy_bins=entropy_bins, entropy_sweep=entropy_sweep, entropy_bootstrap=entropy_bootstrap,
+                          rmsd_trim_cutoff=rmsd_trim_cutoff, correlation_permutations=correlation_permutations,
+                          chain_policy=chain_policy, family=family, workers=workers, ensemble=ensemble,
+                          screen_margin=screen_margin, screen_audit=screen_audit, all_vs_all=all_vs_all)
+    # Items whose inputs and parameters are unchanged since the last run are skipped
+    manifest = Manifest(output_dir) if use_cache else None
+    tracer = None
+    if trace_file or profile_stage:
+        trace_file = trace_file or os.path.join(output_dir, "pipeline_trace.json")
+        tracer = Tracer(profile_stage, sample_interval)
+    summary = run_stages(stages, workers=workers, manifest=manifest, hooks=[tracer] if tracer else ())
+
+    if tracer is not None:
+        tracer.print_summary()
+        tracer.write_trace(trace_file)
+        if profile_stage:
+            tracer.write_folded(f"{os.path.splitext(trace_file)[0]}_{profile_stage}.folded")
 
     print("Pipeline completed!")
+    return summary
+
+def enqueue_families(queue_dir, input_dirs, output_root, dssp_executable="/usr/local/bin/mkdssp",
+                     tm_align_path=run_tm_align.tm_align_path, chain_policy='first', workers=None, ensemble=False,
+                     screen_margin=rmsd_prescreen.SCREEN_MARGIN, screen_audit=0.0, references=None, all_vs_all=False,
+                     entropy_bins=60, entropy_sweep=entropy_calculation.BIN_SWEEP, entropy_bootstrap=0,
+                     rmsd_trim_cutoff=None, correlation_permutations=1000):
+    """
+    Add one family per input directory to a work queue, with outputs in `output_root/<family>`.
+
+    The family name is the input directory name. `references` maps family names to their
+    TM-align reference chain file; with `all_vs_all=True` the other families use the
+    all-vs-all medoid, whose pairs are queued as separate tasks. Without it, every family
+    needs a reference.
+    """
+    references = references or {}
+    families = [os.path.basename(os.path.normpath(input_dir)) for input_dir in input_dirs]
+    unknown = sorted(set(references) - set(families))
+    if unknown:
+        raise ValueError(f"References given for families that are not queued: {', '.join(unknown)}")
+    missing = [family for family in families if family not in references]
+    if missing and not all_vs_all:
+        raise ValueError(f"No reference for {', '.join(missing)}; give one per family or use all_vs_all=True")
+    for input_dir, family in zip(input_dirs, families):
+        work_queue.add_family(queue_dir, family, {
+            'input_dir': os.path.abspath(input_dir), 'output_dir': os.path.abspath(os.path.join(output_root, family)),
+            'family': family, 'dssp_executable': dssp_executable, 'tm_align_path': tm_align_path,
+            'chain_policy': chain_policy, 'workers': workers, 'ensemble': ensemble,
+            'screen_margin': screen_margin, 'screen_audit': screen_audit,
+            'reference': references.get(family), 'all_vs_all': family not in references,
+            'entropy_bins': entropy_bins, 'entropy_sweep': list(entropy_sweep), 'entropy_bootstrap': entropy_bootstrap,
+            'rmsd_trim_cutoff': rmsd_trim_cutoff, 'correlation_permutations': correlation_permutations})
+
+def queue_stages(config):
+    """Sharded stage DAG of a queued family, with this process's structure cache pointed at the family."""
+    cache_dir = os.path.join(config['output_dir'], "structure_cache")
+    if os.environ.get(structure_store.STRUCTURE_CACHE_ENV) != cache_dir:
+        structure_store.set_cache_dir(cache_dir)
+    # Families queued before references could be given use the all-vs-all medoid
+    return build_stages(config['input_dir'], config['output_dir'], config.get('reference'), config['dssp_executable'],
+                        config['tm_align_path'], entropy_bins=config.get('entropy_bins', 60),
+                        entropy_sweep=config.get('entropy_sweep', entropy_calculation.BIN_SWEEP),
+                        entropy_bootstrap=config.get('entropy_bootstrap', 0),
+                        rmsd_trim_cutoff=config.get('rmsd_trim_cutoff'),
+                        correlation_permutations=config.get('correlation_permutations', 1000), chain_policy=config['chain_policy'], family=config['family'],
+                        workers=config['workers'], sharded=True, ensemble=config.get('ensemble', False),
+                        screen_margin=config.get('screen_margin', rmsd_prescreen.SCREEN_MARGIN),
+                        screen_audit=config.get('screen_audit', 0.0), all_vs_all=config.get('all_vs_all', True))
+
+def run_queue_worker(queue_dir, lease_seconds=work_queue.LEASE_SECONDS, poll_seconds=work_queue.POLL_SECONDS,
+                     max_tasks=None, exit_when_idle=False):
+    """Pull work from a queue until every queued family is finished; store appends go to this worker's shard."""
+    queue = work_queue.WorkQueue(queue_dir, queue_stages, lease_seconds=lease_seconds)
+    family_store.set_shard(queue.worker)
+    return queue.work(poll_seconds, max_tasks, exit_when_idle)
+
+def run_queue_workers(queue_dir, processes=1, **options):
+    """Run `processes` queue workers on this host and wait for them; see `run_queue_worker`."""
+    if processes <= 1:
+        return run_queue_worker(queue_dir, **options)
+    workers = [multiprocessing.Process(target=run_queue_worker, args=(queue_dir,), kwargs=options)
+               for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    failed = [worker.exitcode for worker in workers if worker.exitcode != 0]
+    if failed:
+        print(f"{len(failed)} worker(s) exited with errors: {failed}")
+    return len(workers) - len(failed)
 
 if __name__ == "__main__":
-    input_directory = "your/input/directory/path"  # Replace with your input directory
-    output_directory = "your/output/directory/path"  # Replace with your output directory
-    main_pipeline(input_directory, output_directory)
+    # Same as `python cli.py run ...`
+    import cli
+    cli.main(["run", *sys.argv[1:]])
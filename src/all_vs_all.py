@@ -0,0 +1,299 @@
+"""
+All-vs-all structural comparison within a family.
+
+Running TM-align on every pair is O(n^2) external calls, so pairs are first pruned
+with cheap vectorized filters computed from the structure store: chain length
+ratio, shared sequence k-mers and a CA distance-matrix fingerprint. Only the
+surviving pairs are sent to TM-align. Results go into a symmetric pair matrix
+stored as `<family>_pair_matrix.npz`, from which the medoid structure is picked
+as the reference for the rest of the pipeline. For work queues the comparison is
+split into a pre-filter item, one item per surviving pair and a merge item that
+builds the matrix and picks the medoid.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from cache import file_digest, tool_version
+from structure_store import get_structure
+import run_tm_align
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+# Bin edges (Angstrom) of the CA-CA distance histogram used as a shape fingerprint
+FINGERPRINT_BINS = np.arange(0.0, 42.0, 2.0)
+
+def structure_features(pdb_path):
+    """One-letter sequence and CA coordinates of the standard residues of the first model."""
+    structure = get_structure(pdb_path)
+    residues = structure.residue_mask(standard_only=True)
+    is_ca = (structure.atom_name == 'CA') & residues[structure.residue_index] & structure.occupancy_atom_mask()
+    ca = np.full((len(residues), 3), np.nan)
+    ca[structure.residue_index[is_ca]] = structure.coords[is_ca]
+    ca = ca[residues]
+    return ''.join(structure.res_code[residues]), ca[~np.isnan(ca).any(axis=1)]
+
+def kmer_profiles(sequences, k=3):
+    """(n_structures, 20**k) presence matrix of sequence k-mers."""
+    lookup = np.full(256, -1, dtype=np.int64)
+    lookup[np.frombuffer(AMINO_ACIDS.encode(), dtype=np.uint8)] = np.arange(len(AMINO_ACIDS))
+    profiles = np.zeros((len(sequences), len(AMINO_ACIDS) ** k), dtype=np.float32)
+    for row, sequence in enumerate(sequences):
+        codes = lookup[np.frombuffer(sequence.encode(), dtype=np.uint8)]
+        if len(codes) < k:
+            continue
+        windows = np.lib.stride_tricks.sliding_window_view(codes, k)
+        windows = windows[(windows >= 0).all(axis=1)]
+        profiles[row, windows @ (len(AMINO_ACIDS) ** np.arange(k)[::-1])] = 1
+    return profiles
+
+def ca_distance_fingerprint(ca, bins=FINGERPRINT_BINS):
+    """Normalized histogram of all CA-CA distances (distances beyond the last edge fall in the last bin)."""
+    if len(ca) < 2:
+        return np.zeros(len(bins) - 1)
+    i, j = np.triu_indices(len(ca), k=1)
+    distances = np.minimum(np.linalg.norm(ca[i] - ca[j], axis=1), bins[-1] - 1e-6)
+    histogram, _ = np.histogram(distances, bins=bins)
+    return histogram / histogram.sum()
+
+def prefilter_pairs(lengths, kmers, fingerprints, min_length_ratio=0.7, min_kmer_similarity=0.2,
+                    max_fingerprint_distance=0.6, block_size=1024):
+    """
+    Pairs (i < j) that pass all three cheap filters.
+
+    - Length ratio: shorter / longer chain length >= `min_length_ratio`.
+    - k-mer similarity: shared k-mers / k-mers of the sequence with fewer of them >= `min_kmer_similarity`.
+    - Fingerprint: L1 distance between CA distance histograms <= `max_fingerprint_distance`.
+
+    Pairs are evaluated in row blocks to bound memory on large families.
+
+    Returns:
+    - tuple: (i, j) index arrays of the surviving pairs, and the number of candidate pairs.
+    """
+    lengths = np.asarray(lengths, dtype=float)
+    kmer_counts = kmers.sum(axis=1)
+    n = len(lengths)
+    keep_i, keep_j = [], []
+    for start in range(0, n, block_size):
+        rows = np.arange(start, min(start + block_size, n))
+        cols = np.arange(n)
+        upper = cols[None, :] > rows[:, None]
+        ratio = np.minimum(lengths[rows, None], lengths[None, :]) / np.maximum(np.maximum(lengths[rows, None], lengths[None, :]), 1)
+        shared = kmers[rows] @ kmers.T
+        similarity = shared / np.maximum(np.minimum(kmer_counts[rows, None], kmer_counts[None, :]), 1)
+        # Accumulated bin by bin so memory stays at one (block x n) array
+        fingerprint_distance = np.zeros((len(rows), n))
+        for b in range(fingerprints.shape[1]):
+            fingerprint_distance += np.abs(fingerprints[rows, b, None] - fingerprints[None, :, b])
+        keep = upper & (ratio >= min_length_ratio) & (similarity >= min_kmer_similarity) & \
+            (fingerprint_distance <= max_fingerprint_distance)
+        i, j = np.nonzero(keep)
+        keep_i.append(rows[i])
+        keep_j.append(j)
+    candidates = n * (n - 1) // 2
+    if not keep_i:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int), candidates
+    return np.concatenate(keep_i), np.concatenate(keep_j), candidates
+
+def select_medoid(tm_score):
+    """Index of the structure with the highest summed TM-score to all others (pruned pairs count as 0)."""
+    return int(np.argmax(np.nan_to_num(tm_score, nan=0.0).sum(axis=1)))
+
+def matrix_file_name(family):
+    return f"{family}_pair_matrix.npz"
+
+def load_pair_matrix(matrix_path):
+    with np.load(matrix_path) as data:
+        return {key: data[key] for key in data.files}
+
+def load_medoid(matrix_path):
+    """File name of the medoid structure recorded in a pair matrix."""
+    return str(load_pair_matrix(matrix_path)['medoid'])
+
+def prefilter_chains(pdb_dir, min_length_ratio=0.7, min_kmer_similarity=0.2, max_fingerprint_distance=0.6):
+    """
+    Chain files of `pdb_dir` and the pairs among them that pass `prefilter_pairs`.
+
+    Returns:
+    - tuple: (names, paths, sha256 array, pair i indices, pair j indices, number of candidate pairs).
+    """
+    names = sorted(f for f in os.listdir(pdb_dir) if f.endswith('.pdb') and not f.startswith('.'))
+    paths = [os.path.join(pdb_dir, name) for name in names]
+    shas = np.array([file_digest(path) for path in paths])
+    features = [structure_features(path) for path in paths]
+    lengths = np.array([len(sequence) for sequence, _ in features])
+    kmers = kmer_profiles([sequence for sequence, _ in features])
+    fingerprints = np.array([ca_distance_fingerprint(ca) for _, ca in features])
+
+    pair_i, pair_j, candidates = prefilter_pairs(lengths, kmers, fingerprints, min_length_ratio,
+                                                 min_kmer_similarity, max_fingerprint_distance)
+    return names, paths, shas, pair_i, pair_j, candidates
+
+def empty_matrices(n):
+    """TM-score, RMSD, aligned length and evaluated matrices with only the diagonal filled in."""
+    tm_score = np.full((n, n), np.nan)
+    rmsd = np.full((n, n), np.nan)
+    aligned_length = np.zeros((n, n), dtype=np.int32)
+    evaluated = np.zeros((n, n), dtype=bool)
+    np.fill_diagonal(tm_score, 1.0)
+    np.fill_diagonal(rmsd, 0.0)
+    np.fill_diagonal(evaluated, True)
+    return tm_score, rmsd, aligned_length, evaluated
+
+def pair_values(record):
+    """Mean TM-score, RMSD and aligned length of a successful `run_tm_align.align_pair` record."""
+    scores = [score for score in (record['TMScore1'], record['TMScore2']) if score is not None]
+    return np.mean(scores) if scores else np.nan, record['RMSD'], record['AlignedLength'] or 0
+
+def save_pair_matrix(matrix_path, names, shas, tm_score, rmsd, aligned_length, evaluated, version):
+    """Pick the medoid and write the pair matrix file."""
+    medoid = names[select_medoid(tm_score)] if names else ''
+    tmp_path = matrix_path + '.tmp.npz'
+    np.savez(tmp_path, names=np.array(names), sha256=shas, tm_score=tm_score, rmsd=rmsd,
+             aligned_length=aligned_length, evaluated=evaluated, medoid=np.array(medoid),
+             tool_version=np.array(version))
+    os.replace(tmp_path, matrix_path)
+    print(f"Pair matrix saved to {matrix_path}; medoid reference: {medoid}")
+    return matrix_path
+
+def run_all_vs_all(pdb_dir, output_dir, family=None, tm_align_path=run_tm_align.tm_align_path, workers=None,
+                   timeout=run_tm_align.TM_ALIGN_TIMEOUT, retries=run_tm_align.TM_ALIGN_RETRIES, min_length_ratio=0.7,
+                   min_kmer_similarity=0.2, max_fingerprint_distance=0.6):
+    """
+    Compare every pair of chains in `pdb_dir` that survives the pre-filters and save the pair matrix.
+
+    The matrix file holds `names`, `sha256`, `tm_score` (mean of both TM-score normalizations),
+    `rmsd`, `aligned_length` and `evaluated` (pairs sent to TM-align), plus the `medoid` name.
+    Pair values from a previous matrix are reused when both files are unchanged.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    family = family or os.path.basename(os.path.normpath(pdb_dir))
+    matrix_path = os.path.join(output_dir, matrix_file_name(family))
+
+    names, paths, shas, pair_i, pair_j, candidates = prefilter_chains(pdb_dir, min_length_ratio, min_kmer_similarity,
+                                                                      max_fingerprint_distance)
+    print(f"All-vs-all for {family}: {len(pair_i)} of {candidates} pair(s) passed the pre-filters")
+    tm_score, rmsd, aligned_length, evaluated = empty_matrices(len(names))
+
+    # Reuse pairs whose two structures are unchanged since the previous run
+    version = tool_version(tm_align_path, args=()) or 'unknown'
+    previous = {}
+    if os.path.exists(matrix_path):
+        old = load_pair_matrix(matrix_path)
+        if str(old.get('tool_version', '')) == version:
+            index = {sha: k for k, sha in enumerate(old['sha256'])}
+            previous = {'index': index, **old}
+
+    to_align = []
+    for i, j in zip(pair_i, pair_j):
+        old_i = previous.get('index', {}).get(shas[i])
+        old_j = previous.get('index', {}).get(shas[j])
+        if old_i is not None and old_j is not None and previous['evaluated'][old_i, old_j]:
+            tm_score[i, j] = tm_score[j, i] = previous['tm_score'][old_i, old_j]
+            rmsd[i, j] = rmsd[j, i] = previous['rmsd'][old_i, old_j]
+            aligned_length[i, j] = aligned_length[j, i] = previous['aligned_length'][old_i, old_j]
+            evaluated[i, j] = evaluated[j, i] = True
+        else:
+            to_align.append((i, j))
+    print(f"Running TM-align for {len(to_align)} pair(s), {len(pair_i) - len(to_align)} reused")
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        futures = [(pool.submit(run_tm_align.align_pair, paths[i], paths[j], tm_align_path, timeout, retries), i, j)
+                   for i, j in to_align]
+        for future, i, j in futures:
+            record = future.result()
+            if record['Status'] != 'ok':
+                print(f"TM-align failed for {names[i]} vs {names[j]}: {record['Error']}")
+                continue
+            tm_score[i, j], rmsd[i, j], aligned_length[i, j] = pair_values(record)
+            tm_score[j, i], rmsd[j, i], aligned_length[j, i] = tm_score[i, j], rmsd[i, j], aligned_length[i, j]
+            evaluated[i, j] = evaluated[j, i] = True
+
+    return save_pair_matrix(matrix_path, names, shas, tm_score, rmsd, aligned_length, evaluated, version)
+
+# Work split into queue items: the pre-filter writes the candidate pairs, each pair is aligned
+# on its own into a record file, and the records are merged into the pair matrix
+
+def candidates_file_name(family):
+    return f"{family}_pair_candidates.csv"
+
+def pair_record_name(name1, name2):
+    return f"{os.path.splitext(name1)[0]}__{os.path.splitext(name2)[0]}.csv"
+
+def write_pair_candidates(pdb_dir, output_dir, family, min_length_ratio=0.7, min_kmer_similarity=0.2,
+                          max_fingerprint_distance=0.6):
+    """Save the chain pairs of `pdb_dir` that pass the pre-filters as `<family>_pair_candidates.csv`."""
+    os.makedirs(output_dir, exist_ok=True)
+    names, _, _, pair_i, pair_j, candidates = prefilter_chains(pdb_dir, min_length_ratio, min_kmer_similarity,
+                                                               max_fingerprint_distance)
+    print(f"All-vs-all for {family}: {len(pair_i)} of {candidates} pair(s) passed the pre-filters")
+    candidates_path = os.path.join(output_dir, candidates_file_name(family))
+    pd.DataFrame({'Name1': [names[i] for i in pair_i], 'Name2': [names[j] for j in pair_j]}).to_csv(
+        candidates_path + '.tmp', index=False)
+    os.replace(candidates_path + '.tmp', candidates_path)
+    return candidates_path
+
+def pair_candidates(candidates_path):
+    """(name1, name2) pairs of a candidates file; none if it does not exist yet."""
+    if not os.path.exists(candidates_path):
+        return []
+    candidates = pd.read_csv(candidates_path, dtype=str)
+    return list(zip(candidates['Name1'], candidates['Name2']))
+
+def align_matrix_pair(pdb_dir, record_dir, name1, name2, tm_align_path=run_tm_align.tm_align_path,
+                      timeout=run_tm_align.TM_ALIGN_TIMEOUT, retries=run_tm_align.TM_ALIGN_RETRIES):
+    """
+    Align one candidate pair and write its record to `record_dir`.
+
+    A successful record from an earlier run is kept when both files and the TM-align
+    version are unchanged.
+    """
+    os.makedirs(record_dir, exist_ok=True)
+    record_path = os.path.join(record_dir, pair_record_name(name1, name2))
+    path1, path2 = os.path.join(pdb_dir, name1), os.path.join(pdb_dir, name2)
+    key = {'Name1': name1, 'Name2': name2, 'SHA1': file_digest(path1), 'SHA2': file_digest(path2),
+           'ToolVersion': tool_version(tm_align_path, args=()) or 'unknown'}
+    if os.path.exists(record_path):
+        previous = pd.read_csv(record_path, dtype={k: str for k in key}, keep_default_na=False).to_dict('records')
+        if previous and previous[0]['Status'] == 'ok' and all(previous[0][k] == v for k, v in key.items()):
+            return record_path
+
+    record = run_tm_align.align_pair(path1, path2, tm_align_path, timeout, retries)
+    if record['Status'] == 'ok':
+        tm, pair_rmsd, length = pair_values(record)
+    else:
+        print(f"TM-align failed for {name1} vs {name2}: {record['Error']}")
+        tm, pair_rmsd, length = np.nan, np.nan, 0
+    pd.DataFrame([{**key, 'Status': record['Status'], 'Error': record['Error'], 'TMScore': tm, 'RMSD': pair_rmsd,
+                   'AlignedLength': length}]).to_csv(record_path + '.tmp', index=False)
+    os.replace(record_path + '.tmp', record_path)
+    return record_path
+
+def merge_matrix_records(pdb_dir, record_dir, output_dir, family, tm_align_path=run_tm_align.tm_align_path):
+    """Build the pair matrix and medoid from the records of the current candidate pairs."""
+    names = sorted(f for f in os.listdir(pdb_dir) if f.endswith('.pdb') and not f.startswith('.'))
+    index = {name: k for k, name in enumerate(names)}
+    shas = np.array([file_digest(os.path.join(pdb_dir, name)) for name in names])
+    tm_score, rmsd, aligned_length, evaluated = empty_matrices(len(names))
+    for name1, name2 in pair_candidates(os.path.join(output_dir, candidates_file_name(family))):
+        record_path = os.path.join(record_dir, pair_record_name(name1, name2))
+        if not os.path.exists(record_path):
+            continue
+        record = pd.read_csv(record_path, dtype={'SHA1': str, 'SHA2': str}).to_dict('records')[0]
+        i, j = index.get(name1), index.get(name2)
+        # Records of changed or removed chains are stale
+        if i is None or j is None or record['Status'] != 'ok' or (record['SHA1'], record['SHA2']) != (shas[i], shas[j]):
+            continue
+        tm_score[i, j] = tm_score[j, i] = record['TMScore']
+        rmsd[i, j] = rmsd[j, i] = record['RMSD']
+        aligned_length[i, j] = aligned_length[j, i] = record['AlignedLength']
+        evaluated[i, j] = evaluated[j, i] = True
+    version = tool_version(tm_align_path, args=()) or 'unknown'
+    return save_pair_matrix(os.path.join(output_dir, matrix_file_name(family)), names, shas, tm_score, rmsd,
+                            aligned_length, evaluated, version)
+
+if __name__ == "__main__":
+    pdb_dir = ""  # Directory with the chain PDB files of one family
+    output_dir = ""  # Directory for the pair matrix
+
+    run_all_vs_all(pdb_dir, output_dir)
@@ -1,42 +1,138 @@
-
 import os
+import numpy as np
 import pandas as pd
+import family_store
+
+# Family store table of the per-residue ASA of every chain
+STORE_TABLE = 'asa'
+
+# Theoretical maximum accessible surface areas (Tien et al. 2013), in square Angstrom
+MAX_ASA = {
+    'A': 129.0, 'R': 274.0, 'N': 195.0, 'D': 193.0, 'C': 167.0, 'Q': 225.0, 'E': 223.0,
+    'G': 104.0, 'H': 224.0, 'I': 197.0, 'L': 201.0, 'K': 236.0, 'M': 224.0, 'F': 240.0,
+    'P': 159.0, 'S': 155.0, 'T': 172.0, 'W': 285.0, 'Y': 263.0, 'V': 174.0,
+}
+
+DSSP_HEADER = '  #  RESIDUE'
+
+# Fixed (start, end) columns of a classic DSSP residue line
+DSSP_COLUMNS = {
+    'ResidueNumber': (5, 10), 'ASA': (34, 38),
+    'NH_O_1_Energy': (46, 50), 'O_HN_1_Energy': (57, 61), 'NH_O_2_Energy': (68, 72), 'O_HN_2_Energy': (79, 83),
+    'Phi': (103, 109), 'Psi': (109, 115),
+}
+DSSP_LINE_WIDTH = 136
+
+def _numeric_column(block, start, end):
+    """Float values of a fixed column of a (lines x width) byte block; blank or invalid fields are NaN."""
+    fields = np.ascontiguousarray(block[:, start:end]).view(f'S{end - start}').ravel()
+    fields = np.where(np.char.strip(fields) == b'', b'nan', fields)
+    try:
+        return fields.astype(float)
+    except ValueError:
+        return pd.to_numeric(pd.Series(fields.astype(str)), errors='coerce').to_numpy(dtype=float)
+
+def _char_column(block, column):
+    return block[:, column].view('S1').astype(str)
+
+def parse_dssp(dssp_file):
+    """
+    Residue records of a classic-format DSSP file, parsed by fixed columns.
+
+    All lines below the `  #  RESIDUE` header are padded into one byte array and every
+    field is sliced out as a whole column. Chain-break lines ('!') are dropped.
+
+    Returns:
+    - DataFrame: ResidueNumber, InsertionCode, Chain, AminoAcid, SecondaryStructure, ASA,
+      RelativeASA, H-bond energies, Phi and Psi; missing numbers are NaN.
+    """
+    with open(dssp_file, 'rb') as f:
+        lines = f.read().splitlines()
+    start = next((i + 1 for i, line in enumerate(lines) if line.startswith(DSSP_HEADER.encode())), None)
+    if start is None:
+        raise ValueError(f"No DSSP residue header found in {dssp_file}")
+    lines = lines[start:]
+    block = np.frombuffer(b''.join(line[:DSSP_LINE_WIDTH].ljust(DSSP_LINE_WIDTH) for line in lines),
+                          dtype=np.uint8).reshape(len(lines), DSSP_LINE_WIDTH)
+    block = block[block[:, 13] != ord('!')]
+
+    table = pd.DataFrame({name: _numeric_column(block, *columns) for name, columns in DSSP_COLUMNS.items()})
+    table['ResidueNumber'] = table['ResidueNumber'].astype('Int64')
+    table.insert(1, 'InsertionCode', np.char.strip(_char_column(block, 10)))
+    table.insert(2, 'Chain', _char_column(block, 11))
+    aa = _char_column(block, 13)
+    table.insert(3, 'AminoAcid', aa)
+    table.insert(4, 'SecondaryStructure', np.where(_char_column(block, 16) == ' ', '-', _char_column(block, 16)))
+    # Lowercase residue letters are cysteines in a disulfide bridge
+    max_asa = pd.Series(np.where(np.char.islower(aa), 'C', aa)).map(MAX_ASA).to_numpy(dtype=float)
+    table.insert(6, 'RelativeASA', table['ASA'].to_numpy() / max_asa)
+    return table
 
 def extract_asa_from_dssp(dssp_file, chain_id='A'):
-    asa_data = []
-    with open(dssp_file, 'r') as f:
-        for line in f:
-            columns = line.split()
-            if len(columns) >= 5 and columns[0] == chain_id:
-                resnum = int(columns[1].strip())
-                res_type = columns[2].strip()
-                asa_value = columns[4].strip()
-                
-                # Handle 'NA' or other invalid ASA values
-                try:
-                    asa = float(asa_value)
-                except ValueError:
-                    asa = 'NA'  # Or use 0.0, None, etc.
-                    print(f"Residue {resnum} has an ASA value of 'NA' in file {dssp_file}")
-
-                asa_data.append([resnum, res_type, asa])
-    
-    return pd.DataFrame(asa_data, columns=['Residue_Number', 'Residue_Type', 'ASA'])
+    """ASA and relative ASA per residue of one chain (all chains if `chain_id` is None)."""
+    table = parse_dssp(dssp_file)
+    if chain_id is not None:
+        table = table[table['Chain'] == chain_id]
+    return pd.DataFrame({'Residue_Number': table['ResidueNumber'].to_numpy(),
+                         'Residue_Type': table['AminoAcid'].to_numpy(),
+                         'ASA': table['ASA'].to_numpy(dtype=float),
+                         'Relative_ASA': table['RelativeASA'].to_numpy(dtype=float)})
+
+def asa_output_name(dssp_file_path):
+    return os.path.basename(dssp_file_path).replace('.dssp', '_asa.csv')
+
+def model_dssp_dir(dssp_file_path):
+    """Directory of the `<k>.dssp` outputs of models k > 0 of an ensemble, next to its `<name>.dssp`."""
+    return f"{dssp_file_path}.models"
+
+def model_dssp_files(dssp_file_path):
+    """(model ID, path) of `<name>.dssp` (model 0) and of the other model outputs of an ensemble, by model."""
+    files = [(0, dssp_file_path)] if os.path.exists(dssp_file_path) else []
+    model_dir = model_dssp_dir(dssp_file_path)
+    if os.path.isdir(model_dir):
+        files += [(int(file[:-5]), os.path.join(model_dir, file)) for file in os.listdir(model_dir)
+                  if file.endswith('.dssp') and file[:-5].isdigit()]
+    return sorted(files)
+
+def process_dssp_file(dssp_file_path, output_dir, chain_id=None):
+    file = os.path.basename(dssp_file_path)
+    print(f"Processing file: {file}")
+    asa_df = extract_asa_from_dssp(dssp_file_path, chain_id)
+    output_file_path = os.path.join(output_dir, asa_output_name(file))
+    asa_df.to_csv(output_file_path, index=False)
+    print(f"ASA data saved to: {output_file_path}")
+
+def store_dssp_file(dssp_file_path, store_path, chain_id=None):
+    """
+    Append the ASA table of one .dssp file to the family's ASA table, keyed by its Structure name.
+
+    The outputs of the other models of an ensemble (see `model_dssp_files`) are read as well;
+    rows carry the Model ID of their model.
+    """
+    name = os.path.splitext(os.path.basename(dssp_file_path))[0]
+    tables = []
+    try:
+        for model, path in model_dssp_files(dssp_file_path):
+            table = extract_asa_from_dssp(path, chain_id)
+            table.insert(0, 'Model', model)
+            tables.append(table)
+        asa_df = pd.concat(tables, ignore_index=True)
+    except Exception:
+        family_store.remove_source(store_path, name)
+        raise
+    asa_df.insert(0, 'Structure', name)
+    family_store.append_table(store_path, asa_df, source=name)
+    print(f"Stored ASA of {name} in {store_path}")
 
-def process_dssp_files(dssp_dir, output_dir, chain_id='A'):
+def process_dssp_files(dssp_dir, output_dir, chain_id=None):
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
     
     for file in os.listdir(dssp_dir):
         if file.endswith('.dssp'):
-            print(f"Processing file: {file}")
-            dssp_file_path = os.path.join(dssp_dir, file)
-            asa_df = extract_asa_from_dssp(dssp_file_path, chain_id)
-            output_file_path = os.path.join(output_dir, file.replace('.dssp', '_asa.csv'))
-            asa_df.to_csv(output_file_path, index=False)
-            print(f"ASA data saved to: {output_file_path}")
+            process_dssp_file(os.path.join(dssp_dir, file), output_dir, chain_id)
 
 if __name__ == '__main__':
     dssp_dir = ""  # Path to the directory containing DSSP files
     output_dir = ""  # Path to the output directory for CSV files
-    process_dssp_files(dssp_dir, output_dir, chain_id='A')
+    process_dssp_files(dssp_dir, output_dir, chain_id=None)
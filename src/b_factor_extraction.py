@@ -1,51 +1,147 @@
 import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
-from Bio.PDB import PDBParser, PDBExceptions
+from structure_store import get_structure, iter_models
+import family_store
+
+B_FACTOR_COLUMNS = ['Model', 'Chain', 'ResidueName', 'ResidueNumber', 'AverageBFactor', 'MaxBFactor',
+                    'CABFactor', 'NormalizedBFactor', 'NormalizedCABFactor']
+
+# Family store table of the per-residue B-factors of every chain
+STORE_TABLE = 'b_factors'
+
+def chain_z_scores(values, groups):
+    """Z-scores of `values` within each group (population std); NaN values are ignored, constant groups give 0."""
+    present = ~np.isnan(values)
+    n_groups = groups.max() + 1 if len(groups) else 0
+    counts = np.bincount(groups[present], minlength=n_groups)
+    sums = np.bincount(groups[present], weights=values[present], minlength=n_groups)
+    squares = np.bincount(groups[present], weights=values[present] ** 2, minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = sums / counts
+        std = np.sqrt(np.maximum(squares / counts - mean ** 2, 0.0))
+        z = (values - mean[groups]) / std[groups]
+    return np.where(std[groups] > 0, z, np.where(present, 0.0, np.nan))
+
+def b_factor_table(structure):
+    """
+    Per-residue B-factors of a parsed structure, computed with reduceat over the atom arrays.
+
+    Alternate locations are resolved by occupancy. AverageBFactor and MaxBFactor cover all
+    kept atoms of a residue, CABFactor its CA atom; the Normalized columns are z-scores
+    within each model and chain.
+    """
+    kept = structure.occupancy_atom_mask()
+    residue = structure.residue_index[kept]
+    bfactor = structure.bfactor[kept].astype(float)
+    if not len(residue):
+        return pd.DataFrame(columns=B_FACTOR_COLUMNS)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(residue)) + 1))
+    residues = residue[starts]
+    counts = np.diff(np.append(starts, len(residue)))
+
+    ca_bfactor = np.full(len(structure.res_start), np.nan)
+    is_ca = structure.atom_name[kept] == 'CA'
+    ca_bfactor[residue[is_ca]] = bfactor[is_ca]
+    ca_bfactor = ca_bfactor[residues]
+
+    average = np.add.reduceat(bfactor, starts) / counts
+    _, chain_groups = np.unique(np.rec.fromarrays([structure.res_model[residues], structure.res_chain[residues]]),
+                                return_inverse=True)
+    chain_groups = chain_groups.ravel()
+    return pd.DataFrame({
+        'Model': structure.res_model[residues].astype(int),
+        'Chain': structure.res_chain[residues].astype(str),
+        'ResidueName': structure.res_resname[residues].astype(str),
+        'ResidueNumber': structure.res_resnum[residues].astype(int),
+        'AverageBFactor': average,
+        'MaxBFactor': np.maximum.reduceat(bfactor, starts),
+        'CABFactor': ca_bfactor,
+        'NormalizedBFactor': chain_z_scores(average, chain_groups),
+        'NormalizedCABFactor': chain_z_scores(ca_bfactor, chain_groups),
+    })
 
 def extract_b_factors(pdb_file):
-    """Extract average B-factors for each residue from a PDB file."""
-    parser = PDBParser(QUIET=True)
+    """Extract per-residue B-factors from a PDB file as a DataFrame (empty on read errors)."""
     try:
-        structure = parser.get_structure('structure', pdb_file)
-    except (PDBExceptions.PDBConstructionException, FileNotFoundError) as e:
+        structure = get_structure(pdb_file)
+    except (ValueError, FileNotFoundError) as e:
         print(f"Error reading PDB file {pdb_file}: {e}")
-        return []
-    
-    b_factors = []
-    
-    for model in structure:
-        for chain in model:
-            for residue in chain:
-                res_b_factors = [atom.get_bfactor() for atom in residue if atom.is_disordered() == 0]
-                if res_b_factors:
-                    avg_b_factor = sum(res_b_factors) / len(res_b_factors)
-                    b_factors.append({
-                        'Model': model.id,
-                        'Chain': chain.id,
-                        'ResidueName': residue.resname,
-                        'ResidueNumber': residue.id[1],
-                        'AverageBFactor': avg_b_factor
-                    })
+        return pd.DataFrame(columns=B_FACTOR_COLUMNS)
+    return b_factor_table(structure)
+
+def extract_ensemble_b_factors(pdb_file):
+    """`extract_b_factors` of an NMR or MD ensemble, parsed one MODEL block at a time without caching."""
+    try:
+        tables = [b_factor_table(structure) for _, structure in iter_models(pdb_file)]
+    except (ValueError, FileNotFoundError) as e:
+        print(f"Error reading PDB file {pdb_file}: {e}")
+        return pd.DataFrame(columns=B_FACTOR_COLUMNS)
+    tables = [table for table in tables if not table.empty]
+    return pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(columns=B_FACTOR_COLUMNS)
+
+def b_factor_output_name(pdb_file):
+    return f"{os.path.splitext(os.path.basename(pdb_file))[0]}.csv"
+
+def family_table_name(family):
+    return f"{family}_b_factors.csv"
+
+def process_pdb_file(pdb_file, output_dir):
+    """Extract B-factors from one PDB file and save them as CSV in the output directory."""
+    file = os.path.basename(pdb_file)
+    df_b_factors = extract_b_factors(pdb_file)
     
-    return b_factors
+    if not df_b_factors.empty:
+        output_file = os.path.join(output_dir, b_factor_output_name(file))
+        df_b_factors.to_csv(output_file, index=False)
+        print(f"B-factors extracted and saved to {output_file}")
+        return output_file
+    else:
+        print(f"No B-factors found or error in file: {file}")
+        return None
+
+def store_pdb_file(pdb_file, store_path, ensemble=False):
+    """
+    Append the B-factors of one PDB file to the family's B-factor table, keyed by its Structure name.
+
+    With `ensemble=True` the file is read one model at a time, see `extract_ensemble_b_factors`.
+    """
+    name = os.path.splitext(os.path.basename(pdb_file))[0]
+    df_b_factors = extract_ensemble_b_factors(pdb_file) if ensemble else extract_b_factors(pdb_file)
+    if df_b_factors.empty:
+        family_store.remove_source(store_path, name)
+        print(f"No B-factors found or error in file: {os.path.basename(pdb_file)}")
+        return None
+    df_b_factors.insert(0, 'Structure', name)
+    family_store.append_table(store_path, df_b_factors, source=name)
+    print(f"B-factors of {name} stored in {store_path}")
+    return store_path
+
+def write_family_table(pdb_dir, output_dir, family):
+    """Concatenate the per-structure B-factor files of the PDB files in `pdb_dir` into `<family>_b_factors.csv`."""
+    tables = []
+    for file in sorted(os.listdir(pdb_dir)):
+        path = os.path.join(output_dir, b_factor_output_name(file))
+        if file.endswith('.pdb') and os.path.exists(path):
+            table = pd.read_csv(path, dtype={'Chain': str, 'ResidueName': str})
+            table.insert(0, 'Structure', os.path.splitext(file)[0])
+            tables.append(table)
+    family_df = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(columns=['Structure'] + B_FACTOR_COLUMNS)
+    output_file = os.path.join(output_dir, family_table_name(family))
+    family_df.to_csv(output_file, index=False)
+    print(f"B-factors of {len(tables)} structure(s) saved to {output_file}")
+    return output_file
 
-def process_pdb_files(input_dir, output_dir):
-    """Process all PDB files in the input directory and save B-factors to the output directory."""
+def process_pdb_files(input_dir, output_dir, family=None, workers=None):
+    """Process all PDB files in parallel, save per-structure B-factors and the family table."""
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
     
-    for file in os.listdir(input_dir):
-        if file.endswith('.pdb'):
-            pdb_file = os.path.join(input_dir, file)
-            b_factors = extract_b_factors(pdb_file)
-            
-            if b_factors:
-                df_b_factors = pd.DataFrame(b_factors)
-                output_file = os.path.join(output_dir, f"{os.path.splitext(file)[0]}.csv")
-                df_b_factors.to_csv(output_file, index=False)
-                print(f"B-factors extracted and saved to {output_file}")
-            else:
-                print(f"No B-factors found or error in file: {file}")
+    pdb_files = [os.path.join(input_dir, file) for file in sorted(os.listdir(input_dir)) if file.endswith('.pdb')]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(process_pdb_file, pdb_files, [output_dir] * len(pdb_files)))
+    return write_family_table(input_dir, output_dir, family or os.path.basename(os.path.normpath(input_dir)))
 
 if __name__ == "__main__":
     input_dir = ""  # Update with your input directory path
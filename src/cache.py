@@ -0,0 +1,141 @@
+"""
+Content-addressed manifest used to skip work items whose outputs are still valid.
+
+Each item is keyed by the content hashes of its input files together with the
+stage function, the source of its module, its arguments and any extra stage
+parameters (cutoffs, bin counts, external tool versions). An item is only
+recorded when all its declared outputs exist, and is skipped on a re-run when
+its key is unchanged and those outputs are still on disk.
+"""
+import os
+import re
+import json
+import hashlib
+import inspect
+import subprocess
+from functools import lru_cache
+
+MANIFEST_NAME = ".pipeline_manifest.json"
+
+# Part of every item key; bump it when a change outside the stage modules alters their outputs
+CACHE_VERSION = 2
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """SHA-256 of a file's contents."""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def tool_version(executable, args=('--version',)):
+    """Best-effort version string of an external executable, or None if it cannot be run."""
+    try:
+        result = subprocess.run([executable, *args], capture_output=True, text=True, timeout=30)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    output = result.stdout + result.stderr
+    match = re.search(r"[Vv]ersion\s*:?\s*([\w.\-]+)", output)
+    if match:
+        return match.group(1)
+    lines = [line.strip() for line in output.splitlines() if line.strip()]
+    return lines[0] if lines else None
+
+
+class Manifest:
+    """
+    JSON manifest of completed work items, stored in the pipeline output directory.
+
+    File digests are memoized by (size, mtime) so unchanged inputs are hashed only
+    once across runs. The manifest is only read and written by the scheduling
+    process, never by the workers.
+    """
+
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self.digests = {}
+        self.items = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    data = json.load(f)
+                self.digests = data.get('digests', {})
+                self.items = data.get('items', {})
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable manifest {self.path}: {e}")
+
+    def digest(self, path):
+        stat = os.stat(path)
+        entry = self.digests.get(path)
+        if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        digest = file_digest(path)
+        self.digests[path] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def code_digest(self, func):
+        """Digest of the source file defining `func`, so editing a stage module invalidates its items."""
+        try:
+            return self.digest(inspect.getsourcefile(func))
+        except (OSError, TypeError):
+            return None
+
+    def item_key(self, func, args, inputs, params=None):
+        """Hash of everything that determines an item's outputs; None if an input is missing."""
+        try:
+            input_digests = [[path, self.digest(path)] for path in inputs]
+        except OSError:
+            return None
+        payload = {
+            'version': CACHE_VERSION,
+            'func': f"{func.__module__}.{func.__qualname__}",
+            'code': self.code_digest(func),
+            'args': [str(arg) for arg in args],
+            'params': params or {},
+            'inputs': input_digests,
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    @staticmethod
+    def item_id(args):
+        return json.dumps([str(arg) for arg in args])
+
+    def is_valid(self, stage_name, args, key):
+        if key is None:
+            return False
+        entry = self.items.get(stage_name, {}).get(self.item_id(args))
+        if entry is None or entry['key'] != key:
+            return False
+        return all(os.path.exists(path) for path in entry['outputs'] + entry.get('shared', []))
+
+    def invalidate(self, stage_name, args):
+        """Forget an item and delete the outputs it produced last time, so stale files never leak downstream."""
+        entry = self.items.get(stage_name, {}).pop(self.item_id(args), None)
+        if entry is not None:
+            for path in entry['outputs']:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def record(self, stage_name, args, key, outputs, shared_outputs=()):
+        """
+        Remember a completed item. Shared outputs (appended to by many items) are required but never deleted.
+
+        Returns:
+        - list: Declared outputs that do not exist. The item is only recorded when there are none,
+          so an item that did not write its outputs is run again next time.
+        """
+        outputs, shared = list(outputs), list(shared_outputs)
+        missing = [path for path in outputs + shared if not os.path.exists(path)]
+        if key is not None and not missing:
+            self.items.setdefault(stage_name, {})[self.item_id(args)] = {'key': key, 'outputs': outputs,
+                                                                        'shared': shared}
+        return missing
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'digests': self.digests, 'items': self.items}, f)
+        os.replace(tmp_path, self.path)
@@ -1,51 +1,175 @@
-from Bio.PDB import PDBParser, calc_dihedral
-from Bio.PDB.Polypeptide import protein_letters_3to1, is_aa
 import numpy as np
+import pandas as pd
 import os
+from structure_store import get_structure, iter_models
+import family_store
 
-def calculate_phi_psi_and_save_to_csv(pdb_file_path, output_csv_path):
-    parser = PDBParser(QUIET=True)
-    structure_id = os.path.basename(pdb_file_path).split('.')[0]
-    structure = parser.get_structure(structure_id, pdb_file_path)
-    
-    # Open the output CSV file. 'w' mode will overwrite existing file, writing the header.
-    with open(output_csv_path, 'w') as csv_file:
-        # Write header
-        csv_file.write("ResidueNumber,ResidueName,Phi,Psi\n")
-        
-        for model in structure:
-            for chain in model:
-                residues = list(chain)
-                for i, res in enumerate(residues):
-                    if not is_aa(res, standard=True):
-                        continue
-
-                    try:
-                        phi = psi = None
-                        if i > 0:
-                            phi = calc_dihedral(residues[i-1]['C'].get_vector(),
-                                                res['N'].get_vector(),
-                                                res['CA'].get_vector(),
-                                                res['C'].get_vector())
-
-                        if i < len(residues) - 1:
-                            psi = calc_dihedral(res['N'].get_vector(),
-                                                res['CA'].get_vector(),
-                                                res['C'].get_vector(),
-                                                residues[i+1]['N'].get_vector())
-
-                        if phi is not None and psi is not None:
-                            res_num = res.get_id()[1]
-                            try:
-                                # Using protein_letters_3to1 dictionary
-                                res_name = protein_letters_3to1[res.get_resname()]
-                                # Write data directly to CSV
-                                csv_file.write(f"{res_num},{res_name},{np.degrees(phi)},{np.degrees(psi)}\n")
-                            except KeyError:
-                                continue
-
-                    except KeyError:
-                        continue
+# Family store table of the angles of every chain
+STORE_TABLE = 'angles'
+
+# Gamma atom defining chi1 (N-CA-CB-XG); Ala and Gly have no chi1
+CHI1_GAMMA_ATOMS = {
+    'ARG': 'CG', 'ASN': 'CG', 'ASP': 'CG', 'CYS': 'SG', 'GLN': 'CG', 'GLU': 'CG',
+    'HIS': 'CG', 'ILE': 'CG1', 'LEU': 'CG', 'LYS': 'CG', 'MET': 'CG', 'PHE': 'CG',
+    'PRO': 'CG', 'SER': 'OG', 'THR': 'OG1', 'TRP': 'CG', 'TYR': 'CG', 'VAL': 'CG1',
+}
+
+def dihedral_angles(p0, p1, p2, p3):
+    """
+    Dihedral angles in degrees for arrays of four points, one angle per row.
+
+    Parameters:
+    - p0, p1, p2, p3 (ndarray): (n, 3) coordinate arrays. Rows containing NaN give NaN.
+
+    Returns:
+    - ndarray: (n,) angles in the range (-180, 180], with the same sign convention as Bio.PDB.calc_dihedral.
+    """
+    b0 = p0 - p1
+    b1 = p2 - p1
+    b2 = p3 - p2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        b1 = b1 / np.linalg.norm(b1, axis=1, keepdims=True)
+        v = b0 - np.sum(b0 * b1, axis=1, keepdims=True) * b1
+        w = b2 - np.sum(b2 * b1, axis=1, keepdims=True) * b1
+        x = np.sum(v * w, axis=1)
+        y = np.sum(np.cross(b1, v) * w, axis=1)
+    return np.degrees(np.arctan2(y, x))
+
+def gather_atom_coordinates(structure, atom_names):
+    """
+    (n_residues, 3) coordinates of one named atom per residue, NaN where the atom is missing.
+
+    `atom_names` is a single name or an array with one name per residue.
+    """
+    coords = np.full((len(structure.res_start), 3), np.nan)
+    wanted = np.broadcast_to(np.asarray(atom_names), structure.res_start.shape)
+    # One alternate location per atom, the one with the highest occupancy, as Bio.PDB selects it
+    selected = structure.occupancy_atom_mask() & (structure.atom_name == wanted[structure.residue_index])
+    coords[structure.residue_index[selected]] = structure.coords[selected]
+    return coords
+
+def compute_backbone_dihedrals(structure, omega=False, chi1=False, max_peptide_bond=2.0):
+    """
+    Backbone dihedrals for every residue of every model and chain in one batched operation.
+
+    Phi of a residue uses the C atom of the preceding residue of the same model and chain,
+    psi the N atom of the following one. When the C-N distance to a neighbour exceeds
+    `max_peptide_bond` (in Angstrom), the chain is considered broken and the angle
+    spanning the break is NaN; pass None to disable the check.
+
+    Returns:
+    - DataFrame: Model, ResidueNumber, ResidueName, Standard, Phi, Psi (and Omega/Chi1 if
+      requested), one row per residue in chain order.
+    """
+    n_res = len(structure.res_start)
+    # Residues grouped by (model, chain) in order of first appearance, as Bio.PDB iterates them
+    group_key = np.char.add(structure.res_model.astype(str), np.char.add('|', structure.res_chain))
+    _, first, inverse = np.unique(group_key, return_index=True, return_inverse=True)
+    order = np.lexsort((np.arange(n_res), first[inverse]))
+    group = inverse[order]
+
+    n = gather_atom_coordinates(structure, 'N')[order]
+    ca = gather_atom_coordinates(structure, 'CA')[order]
+    c = gather_atom_coordinates(structure, 'C')[order]
+
+    # Neighbours shifted by one residue, NaN across chain/model boundaries and breaks
+    has_prev = np.zeros(n_res, dtype=bool)
+    has_prev[1:] = group[1:] == group[:-1]
+    if max_peptide_bond is not None:
+        bond = np.full(n_res, np.nan)
+        bond[1:] = np.linalg.norm(n[1:] - c[:-1], axis=1)
+        has_prev &= ~(bond > max_peptide_bond)
+    has_next = np.append(has_prev[1:], False)
+
+    prev_c = np.full_like(c, np.nan)
+    prev_c[1:] = c[:-1]
+    prev_c[~has_prev] = np.nan
+    next_n = np.full_like(n, np.nan)
+    next_n[:-1] = n[1:]
+    next_n[~has_next] = np.nan
+
+    result = pd.DataFrame({
+        'Model': structure.res_model[order],
+        'ResidueNumber': structure.res_resnum[order],
+        'ResidueName': structure.res_code[order],
+        'Standard': structure.res_standard[order],
+        'Phi': dihedral_angles(prev_c, n, ca, c),
+        'Psi': dihedral_angles(n, ca, c, next_n),
+    })
+    if omega:
+        prev_ca = np.full_like(ca, np.nan)
+        prev_ca[1:] = ca[:-1]
+        prev_ca[~has_prev] = np.nan
+        result['Omega'] = dihedral_angles(prev_ca, prev_c, n, ca)
+    if chi1:
+        gamma_names = np.array([CHI1_GAMMA_ATOMS.get(name, '') for name in structure.res_resname])
+        cb = gather_atom_coordinates(structure, 'CB')[order]
+        gamma = gather_atom_coordinates(structure, gamma_names)[order]
+        result['Chi1'] = dihedral_angles(n, ca, cb, gamma)
+    return result
+
+def standard_angles(pdb_file_path, ensemble=False, omega=False, chi1=False):
+    """
+    Phi/psi of every standard residue with both angles defined.
+
+    All models are processed in one call. With `ensemble=True` a leading Model column keys
+    each row by its model ID; otherwise rows of all models follow one another.
+    """
+    return _standard_rows(get_structure(pdb_file_path), ensemble, omega, chi1)
+
+def ensemble_angles(pdb_file_path, omega=False, chi1=False):
+    """
+    `standard_angles` of an NMR or MD ensemble, with the Model column, parsed one MODEL block at a time.
+
+    Only one model's atoms are in memory at once, so ensembles of thousands of models
+    can be processed; the parsed models are not cached.
+    """
+    tables = [_standard_rows(structure, True, omega, chi1) for _, structure in iter_models(pdb_file_path)]
+    if not tables:
+        return _standard_rows(get_structure(pdb_file_path), True, omega, chi1)
+    return pd.concat(tables, ignore_index=True)
+
+def _standard_rows(structure, ensemble, omega, chi1):
+    angles = compute_backbone_dihedrals(structure, omega=omega, chi1=chi1)
+    angles = angles[angles['Standard'] & angles['Phi'].notna() & angles['Psi'].notna()]
+
+    columns = ['ResidueNumber', 'ResidueName', 'Phi', 'Psi']
+    if ensemble:
+        columns.insert(0, 'Model')
+    columns += [name for name in ('Omega', 'Chi1') if name in angles]
+    return angles[columns].reset_index(drop=True)
+
+def calculate_phi_psi_and_save_to_csv(pdb_file_path, output_csv_path, ensemble=False, omega=False, chi1=False):
+    """Write the `standard_angles` table of a structure to a CSV file."""
+    # 'w' mode will overwrite an existing file, writing the header
+    standard_angles(pdb_file_path, ensemble, omega, chi1).to_csv(output_csv_path, index=False)
+
+def angles_csv_name(pdb_file):
+    return os.path.basename(pdb_file).replace('.pdb', '_angles.csv')
+
+def process_structure(pdb_file_path, output_dir):
+    print(f"Processing {os.path.basename(pdb_file_path)}...")
+    output_file = angles_csv_name(pdb_file_path)
+    calculate_phi_psi_and_save_to_csv(pdb_file_path, os.path.join(output_dir, output_file))
+    print(f"Saved {output_file}")
+
+def store_structure_angles(pdb_file_path, store_path, ensemble=False):
+    """
+    Append the angles of one chain to the family's angles table, keyed by its Structure name.
+
+    Rows carry the Model ID of their model (0 for single-model files). With `ensemble=True`
+    the file is read one model at a time, see `ensemble_angles`.
+    """
+    name = os.path.splitext(os.path.basename(pdb_file_path))[0]
+    try:
+        angles = ensemble_angles(pdb_file_path) if ensemble else standard_angles(pdb_file_path, ensemble=True)
+    except Exception:
+        # Rows of an earlier run must not outlive a failed one
+        family_store.remove_source(store_path, name)
+        raise
+    angles.insert(0, 'Structure', name)
+    family_store.append_table(store_path, angles, source=name)
+    print(f"Stored {len(angles)} angle row(s) of {name}")
 
 def process_structures_and_save_angles(input_dir, output_dir):
     if not os.path.exists(output_dir):
@@ -53,16 +177,11 @@ def process_structures_and_save_angles(input_dir, output_dir):
     
     for pdb_file in os.listdir(input_dir):
         if pdb_file.endswith(".pdb"):
-            pdb_file_path = os.path.join(input_dir, pdb_file)
-            print(f"Processing {pdb_file}...")
-            output_file = pdb_file.replace('.pdb', '_angles.csv')
-            output_csv_path = os.path.join(output_dir, output_file)
-            calculate_phi_psi_and_save_to_csv(pdb_file_path, output_csv_path)
-            print(f"Saved {output_file}")
-
-# Ensure to set the correct paths for your input_directory and output_directory
-input_directory = ""
-output_directory = ""
+            process_structure(os.path.join(input_dir, pdb_file), output_dir)
 
+if __name__ == "__main__":
+    # Ensure to set the correct paths for your input_directory and output_directory
+    input_directory = ""
+    output_directory = ""
 
-process_structures_and_save_angles(input_directory, output_directory)
+    process_structures_and_save_angles(input_directory, output_directory)
@@ -0,0 +1,193 @@
+"""
+Correlation of per-residue conformational entropy with RMSD, B-factors and relative SASA.
+
+The per-residue outputs of the entropy, RMSD, B-factor and ASA stages are joined on
+the reference residue number. Pearson and Spearman coefficients are computed per
+family and over all families, with two-sided permutation p-values. Permutations are
+drawn in vectorized batches (one matrix product per batch) and the batches are
+spread over a process pool. For the pooled 'all' rows, values are only shuffled
+within each family.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from entropy_calculation import entropy_output_name
+from rmsd_calculation import rmsd_output_name
+from b_factor_extraction import family_table_name, STORE_TABLE as B_FACTOR_TABLE
+from asa_extraction import asa_output_name, STORE_TABLE as ASA_TABLE
+import family_store
+
+ENTROPY_COLUMNS = ['PhiEntropy', 'PsiEntropy']
+METRIC_COLUMNS = ['Mean_RMSD', 'NormalizedBFactor', 'Relative_ASA']
+
+# Permutations evaluated per vectorized batch
+PERMUTATION_BATCH = 1000
+
+def _reference_b_factors(b_factor_dir, family, reference, store_dir):
+    if store_dir is not None:
+        path = family_store.table_path(store_dir, family, B_FACTOR_TABLE)
+        if not os.path.exists(path):
+            return None
+        return family_store.read_table(path, ['Model', 'ResidueNumber', 'NormalizedBFactor'],
+                                       {'Structure': reference})
+    b_factor_file = os.path.join(b_factor_dir, family_table_name(family))
+    if not os.path.exists(b_factor_file):
+        return None
+    b_factors = pd.read_csv(b_factor_file, dtype={'Structure': str, 'Chain': str, 'ResidueName': str})
+    return b_factors[b_factors['Structure'] == reference]
+
+def _reference_asa(asa_dir, family, reference, store_dir):
+    if store_dir is not None:
+        path = family_store.table_path(store_dir, family, ASA_TABLE)
+        if not os.path.exists(path):
+            return None
+        return family_store.read_table(path, ['Model', 'Residue_Number', 'Relative_ASA'], {'Structure': reference})
+    asa_file = os.path.join(asa_dir, asa_output_name(f"{reference}.dssp"))
+    if not os.path.exists(asa_file):
+        return None
+    return pd.read_csv(asa_file, usecols=['Residue_Number', 'Relative_ASA'])
+
+def family_metrics(family, reference, entropy_dir, rmsd_dir, b_factor_dir, asa_dir, store_dir=None):
+    """
+    Per-residue table of one family on the reference numbering.
+
+    B-factors and relative SASA are those of the first model of the reference structure,
+    read from the family store tables in `store_dir` if given, otherwise from the CSV files
+    in `b_factor_dir` and `asa_dir`. Metrics whose data is missing are left as NaN.
+    """
+    reference = os.path.splitext(os.path.basename(reference))[0]
+    entropy = pd.read_csv(os.path.join(entropy_dir, entropy_output_name(family)))
+    metrics = entropy[['RefResidueNumber', *ENTROPY_COLUMNS]].rename(columns={'RefResidueNumber': 'ResidueNumber'})
+
+    rmsd_file = os.path.join(rmsd_dir, rmsd_output_name(family))
+    if os.path.exists(rmsd_file):
+        rmsd = pd.read_csv(rmsd_file, usecols=['Residue', 'Mean_RMSD'])
+        rmsd['ResidueNumber'] = pd.to_numeric(rmsd['Residue'], errors='coerce')
+        metrics = metrics.merge(rmsd[['ResidueNumber', 'Mean_RMSD']].dropna(subset=['ResidueNumber']),
+                                on='ResidueNumber', how='left')
+
+    b_factors = _reference_b_factors(b_factor_dir, family, reference, store_dir)
+    if b_factors is not None:
+        b_factors = b_factors[b_factors['Model'] == b_factors['Model'].min()]
+        metrics = metrics.merge(b_factors[['ResidueNumber', 'NormalizedBFactor']].drop_duplicates('ResidueNumber'),
+                                on='ResidueNumber', how='left')
+
+    asa = _reference_asa(asa_dir, family, reference, store_dir)
+    if asa is not None:
+        if 'Model' in asa:
+            asa = asa[asa['Model'] == asa['Model'].min()].drop(columns='Model')
+        asa = asa.rename(columns={'Residue_Number': 'ResidueNumber'}).drop_duplicates('ResidueNumber')
+        metrics = metrics.merge(asa, on='ResidueNumber', how='left')
+
+    metrics = metrics.reindex(columns=['ResidueNumber', *ENTROPY_COLUMNS, *METRIC_COLUMNS])
+    metrics.insert(0, 'Family', family)
+    return metrics
+
+def _standardize(values):
+    centered = values - values.mean(axis=-1, keepdims=True)
+    return centered / np.sqrt((centered ** 2).sum(axis=-1, keepdims=True))
+
+def _ranks(values):
+    return pd.Series(values).rank().to_numpy()
+
+def _permutation_batch(x, y, groups, size, seed):
+    """
+    Number of `size` permutations of `y` whose |r| with `x` reaches the observed |r|.
+
+    Both series are standardized, so r is a dot product and a whole batch is one
+    matrix product. Rows are sorted by group, so one argsort of (group + uniform
+    noise) per permutation shuffles within groups only.
+    """
+    rng = np.random.default_rng(seed)
+    order = np.argsort(groups + rng.random((size, len(groups))), axis=1)
+    observed = abs(y @ x)
+    return int((np.abs(y[order] @ x) >= observed - 1e-12).sum())
+
+def correlate(x, y, groups, n_permutations=1000, seed=0, pool=None):
+    """
+    Pearson and Spearman coefficients of two series with permutation p-values.
+
+    Returns:
+    - tuple: (pearson, pearson_p, spearman, spearman_p).
+    """
+    groups = np.asarray(groups, dtype=float)
+    order = np.argsort(groups, kind='stable')
+    x, y, groups = x[order], y[order], groups[order]
+    x_series = np.stack([_standardize(x), _standardize(_ranks(x))])
+    y_series = np.stack([_standardize(y), _standardize(_ranks(y))])
+    pearson, spearman = float(x_series[0] @ y_series[0]), float(x_series[1] @ y_series[1])
+    if not n_permutations:
+        return pearson, np.nan, spearman, np.nan
+
+    sizes = [min(PERMUTATION_BATCH, n_permutations - start) for start in range(0, n_permutations, PERMUTATION_BATCH)]
+    exceed = np.zeros(2)
+    for k in range(2):
+        args = [(x_series[k], y_series[k], groups, size, seed + batch) for batch, size in enumerate(sizes)]
+        exceed[k] = sum((pool.map if pool is not None else map)(_permutation_batch, *zip(*args)))
+    p_values = (exceed + 1) / (n_permutations + 1)
+    return pearson, float(p_values[0]), spearman, float(p_values[1])
+
+def correlation_summary(metrics, n_permutations=1000, workers=None, seed=0, min_residues=3):
+    """
+    One row per (family or 'all', entropy column, metric) with N, Pearson, Spearman and their p-values.
+    """
+    rows = []
+    subsets = [(family, table) for family, table in metrics.groupby('Family', sort=True)]
+    if len(subsets) > 1:
+        subsets.append(('all', metrics))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for family, table in subsets:
+            groups = pd.factorize(table['Family'])[0]
+            for entropy_column in ENTROPY_COLUMNS:
+                for metric in METRIC_COLUMNS:
+                    complete = table[[entropy_column, metric]].notna().all(axis=1).to_numpy()
+                    row = {'Family': family, 'Entropy': entropy_column, 'Metric': metric, 'N': int(complete.sum())}
+                    if complete.sum() >= min_residues:
+                        x = table[entropy_column].to_numpy(dtype=float)[complete]
+                        y = table[metric].to_numpy(dtype=float)[complete]
+                        if np.ptp(x) > 0 and np.ptp(y) > 0:
+                            row['Pearson'], row['PearsonP'], row['Spearman'], row['SpearmanP'] = correlate(
+                                x, y, groups[complete], n_permutations, seed, pool)
+                    rows.append(row)
+    return pd.DataFrame(rows, columns=['Family', 'Entropy', 'Metric', 'N', 'Pearson', 'PearsonP',
+                                       'Spearman', 'SpearmanP'])
+
+def metrics_output_name(family):
+    return f"{family}_metrics.csv"
+
+def summary_output_name(family):
+    return f"{family}_correlation.csv"
+
+def process_family(family, reference, entropy_dir, rmsd_dir, b_factor_dir, asa_dir, output_dir,
+                   n_permutations=1000, workers=None, store_dir=None, seed=0):
+    """Join one family's per-residue outputs and write its metrics and correlation summary."""
+    os.makedirs(output_dir, exist_ok=True)
+    metrics = family_metrics(family, reference, entropy_dir, rmsd_dir, b_factor_dir, asa_dir, store_dir)
+    metrics_file = os.path.join(output_dir, metrics_output_name(family))
+    summary_file = os.path.join(output_dir, summary_output_name(family))
+    metrics.to_csv(metrics_file, index=False)
+    correlation_summary(metrics, n_permutations, workers, seed).to_csv(summary_file, index=False)
+    print(f"Correlations for {family} saved to {summary_file}")
+    return metrics_file, summary_file
+
+def process_family_store(family, reference, entropy_dir, rmsd_dir, store_dir, output_dir, n_permutations=1000,
+                         workers=None, seed=0):
+    """`process_family` with B-factors and relative SASA read from the family store in `store_dir`."""
+    return process_family(family, reference, entropy_dir, rmsd_dir, None, None, output_dir, n_permutations, workers,
+                          store_dir, seed)
+
+def process_families(metrics_dir, output_file, n_permutations=1000, workers=None, seed=0):
+    """One summary table over every `<family>_metrics.csv` in `metrics_dir`, per family and overall."""
+    files = sorted(f for f in os.listdir(metrics_dir) if f.endswith('_metrics.csv'))
+    metrics = pd.concat([pd.read_csv(os.path.join(metrics_dir, f), dtype={'Family': str}) for f in files],
+                        ignore_index=True)
+    correlation_summary(metrics, n_permutations, workers, seed).to_csv(output_file, index=False)
+    print(f"Correlations for {len(files)} family(ies) saved to {output_file}")
+    return output_file
+
+if __name__ == "__main__":
+    metrics_dir = ""  # Directory with the <family>_metrics.csv files of all families
+    output_file = ""  # Summary table
+
+    process_families(metrics_dir, output_file)
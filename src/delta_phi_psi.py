@@ -1,6 +1,11 @@
+import numpy as np
 import pandas as pd
 import os
 import glob
+from functools import lru_cache
+from residue_mapping import load_family_mappings
+from calculate_phi_psi import angles_csv_name
+import family_store
 
 def calculate_circular_difference(angle1, angle2):
     difference = (angle1 - angle2 + 180) % 360 - 180
@@ -11,6 +16,47 @@ def load_phi_psi_values(file_path):
     df.set_index('ResidueNumber', inplace=True)
     return df
 
+# Number of angle tables kept in memory per process by the batched mode
+ANGLE_CACHE_SIZE = 512
+
+def model_angle_tables(angles):
+    """Phi/Psi tables indexed by residue number, keyed by Model (all rows are model 0 without that column)."""
+    tables = {}
+    for model, table in (angles.groupby('Model', sort=True) if 'Model' in angles else [(0, angles)]):
+        table = table.set_index('ResidueNumber')
+        # Keep the first row per residue number so lookups stay one-to-one
+        tables[int(model)] = table[~table.index.duplicated(keep='first')][['Phi', 'Psi']]
+    return tables
+
+@lru_cache(maxsize=ANGLE_CACHE_SIZE)
+def _cached_angle_table(file_path, size, mtime_ns):
+    return model_angle_tables(pd.read_csv(file_path))
+
+def load_angle_table(file_path):
+    """`model_angle_tables` of an angles CSV file, from a per-process LRU cache keyed by file version."""
+    stat = os.stat(file_path)
+    return _cached_angle_table(file_path, stat.st_size, stat.st_mtime_ns)
+
+def join_deltas(ref_resnums, target_resnums, ref_table, target_table):
+    """
+    Circular phi/psi differences for aligned residue arrays via vectorized index alignment.
+
+    Returns:
+    - DataFrame: RefResidueNumber, TargetResidueNumber, DeltaPhi, DeltaPsi for the aligned
+      residues present in both angle tables.
+    """
+    ref_angles = ref_table.reindex(ref_resnums).to_numpy()
+    target_angles = target_table.reindex(target_resnums).to_numpy()
+    # Same membership rule as the per-residue lookup: both residues must have a row
+    present = np.isin(ref_resnums, ref_table.index) & np.isin(target_resnums, target_table.index)
+    deltas = calculate_circular_difference(ref_angles[present], target_angles[present])
+    return pd.DataFrame({
+        'RefResidueNumber': np.asarray(ref_resnums)[present],
+        'TargetResidueNumber': np.asarray(target_resnums)[present],
+        'DeltaPhi': deltas[:, 0],
+        'DeltaPsi': deltas[:, 1],
+    })
+
 def parse_alignment_file(aln_file):
     alignment_mapping = {}
     with open(aln_file, 'r') as file:
@@ -25,44 +71,137 @@ def parse_alignment_file(aln_file):
     return alignment_mapping
 
 
-def calculate_deltas_and_save(aln_file, ref_df, target_df, output_file_path):
+def calculate_deltas(alignment_mapping, ref_df, target_df):
     delta_phi_psi = []
-    alignment_mapping = parse_alignment_file(aln_file)
     for ref_index, target_index in alignment_mapping.items():
         if ref_index in ref_df.index and target_index in target_df.index:
             delta_phi = calculate_circular_difference(ref_df.at[ref_index, 'Phi'], target_df.at[target_index, 'Phi'])
             delta_psi = calculate_circular_difference(ref_df.at[ref_index, 'Psi'], target_df.at[target_index, 'Psi'])
             delta_phi_psi.append([ref_index, alignment_mapping[ref_index], delta_phi, delta_psi])
-    delta_df = pd.DataFrame(delta_phi_psi, columns=['RefResidueNumber', 'TargetResidueNumber', 'DeltaPhi', 'DeltaPsi'])
+    return pd.DataFrame(delta_phi_psi, columns=['RefResidueNumber', 'TargetResidueNumber', 'DeltaPhi', 'DeltaPsi'])
+
+def calculate_deltas_and_save(aln_file, ref_df, target_df, output_file_path):
+    alignment_mapping = parse_alignment_file(aln_file)
+    delta_df = calculate_deltas(alignment_mapping, ref_df, target_df)
     delta_df.to_csv(output_file_path, index=False)
 
+def pair_ids(aln_file):
+    base_name = os.path.basename(aln_file).replace('_residue_mapping.txt', '')
+    ref_id, target_id = base_name.split('_vs_')
+    return ref_id, target_id
+
+def pair_angle_paths(aln_file, phi_psi_files_dir):
+    ref_id, target_id = pair_ids(aln_file)
+    return (os.path.join(phi_psi_files_dir, f"{ref_id}_angles.csv"),
+            os.path.join(phi_psi_files_dir, f"{target_id}_angles.csv"))
+
+def delta_output_name(aln_file):
+    ref_id, target_id = pair_ids(aln_file)
+    return f"{ref_id}_vs_{target_id}_delta_phi_psi.csv"
+
+def agg_output_name(family):
+    return f"agg_{family}.csv"
+
+def load_store_angle_tables(store_path, names):
+    """
+    `model_angle_tables` of the structures `names` from a family angles table, keyed by structure name.
+
+    Only the rows of these structures and the five needed columns are read.
+    """
+    angles = family_store.read_table(store_path, ['Structure', 'Model', 'ResidueNumber', 'Phi', 'Psi'],
+                                     {'Structure': list(names)})
+    return {name: model_angle_tables(table) for name, table in angles.groupby('Structure', sort=False)}
+
+def _conformer_deltas(target, model, reference, ref_resnums, target_resnums, ref_table, target_table):
+    deltas = join_deltas(ref_resnums, target_resnums, ref_table, target_table)
+    deltas.insert(0, 'Reference', os.path.splitext(str(reference))[0])
+    deltas.insert(0, 'TargetModel', model)
+    deltas.insert(0, 'Target', os.path.splitext(str(target))[0])
+    return deltas
+
+def process_family(mapping_path, phi_psi_files_dir, output_dir, family, angles_store=None):
+    """
+    Delta phi/psi of every pair in a per-family residue mapping file, as one long-format table.
+
+    Angles come from the family angles table `angles_store` if given, otherwise from the
+    per-chain CSV files in `phi_psi_files_dir` through the LRU cache. Each angle table is
+    loaded once (the reference is shared by all pairs) and every pair is joined with
+    whole-array operations. The result is written to `agg_<family>.csv`, the input of
+    entropy_calculation.process_files.
+
+    Every model of an NMR or MD ensemble is a conformer of its own: each target model is
+    compared with the first model of the reference and recorded with its TargetModel, and
+    the further models of the reference are compared with its first model residue by residue.
+    """
+    mappings = load_family_mappings(mapping_path)
+    offsets = mappings['offsets']
+    stored = None
+    if angles_store is not None:
+        names = {os.path.splitext(str(name))[0] for name in [*mappings['reference'], *mappings['target']]}
+        stored = load_store_angle_tables(angles_store, names)
+
+    def angle_tables(name):
+        if stored is not None:
+            return stored.get(os.path.splitext(str(name))[0])
+        path = os.path.join(phi_psi_files_dir, angles_csv_name(str(name)))
+        return load_angle_table(path) if os.path.exists(path) else None
+
+    tables = []
+    n_pairs = 0
+    for pair, (target, reference) in enumerate(zip(mappings['target'], mappings['reference'])):
+        ref_tables, target_tables = angle_tables(reference), angle_tables(target)
+        if not ref_tables or not target_tables:
+            print(f"Missing phi/psi angles for {target} vs {reference}")
+            continue
+        start, end = offsets[pair], offsets[pair + 1]
+        ref_table = ref_tables[min(ref_tables)]
+        for model, target_table in target_tables.items():
+            tables.append(_conformer_deltas(target, model, reference, mappings['ref_resnum'][start:end],
+                                            mappings['target_resnum'][start:end], ref_table, target_table))
+        n_pairs += 1
+
+    for reference in dict.fromkeys(mappings['reference']):
+        ref_tables = angle_tables(reference) or {}
+        first = min(ref_tables, default=None)
+        for model, table in ref_tables.items():
+            if model != first:
+                resnums = ref_tables[first].index.to_numpy()
+                tables.append(_conformer_deltas(reference, model, reference, resnums, resnums,
+                                                ref_tables[first], table))
+
+    columns = ['Target', 'TargetModel', 'Reference', 'RefResidueNumber', 'TargetResidueNumber', 'DeltaPhi', 'DeltaPsi']
+    agg_df = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(columns=columns)
+    output_file_path = os.path.join(output_dir, agg_output_name(family))
+    agg_df.to_csv(output_file_path + '.tmp', index=False)
+    os.replace(output_file_path + '.tmp', output_file_path)
+    print(f"Processed {n_pairs} pair(s), {len(tables)} conformer(s) into {output_file_path}")
+    return output_file_path
+
+def process_alignment_pair(aln_file, phi_psi_files_dir, output_dir):
+    base_name = os.path.basename(aln_file).replace('_residue_mapping.txt', '')
+    ref_phi_psi_path, target_phi_psi_path = pair_angle_paths(aln_file, phi_psi_files_dir)
+    
+    if os.path.exists(ref_phi_psi_path) and os.path.exists(target_phi_psi_path):
+        ref_df = load_phi_psi_values(ref_phi_psi_path)
+        target_df = load_phi_psi_values(target_phi_psi_path)
+        output_file_name = delta_output_name(aln_file)
+        output_file_path = os.path.join(output_dir, output_file_name)
+        calculate_deltas_and_save(aln_file, ref_df, target_df, output_file_path)
+        print(f"Processed {output_file_name}")
+    else:
+        print(f"Missing phi/psi files for {base_name}")
+
 def process_alignment_pairs(alignment_files_dir, phi_psi_files_dir, output_dir):
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
     for aln_file in glob.glob(os.path.join(alignment_files_dir, '*_residue_mapping.txt')):
-        base_name = os.path.basename(aln_file).replace('_residue_mapping.txt', '')
-        ref_id, target_id = base_name.split('_vs_')
-        
-        ref_phi_psi_file = f"{ref_id}_angles.csv"
-        target_phi_psi_file = f"{target_id}_angles.csv"
-        
-        ref_phi_psi_path = os.path.join(phi_psi_files_dir, ref_phi_psi_file)
-        target_phi_psi_path = os.path.join(phi_psi_files_dir, target_phi_psi_file)
-        
-        if os.path.exists(ref_phi_psi_path) and os.path.exists(target_phi_psi_path):
-            ref_df = load_phi_psi_values(ref_phi_psi_path)
-            target_df = load_phi_psi_values(target_phi_psi_path)
-            output_file_name = f"{ref_id}_vs_{target_id}_delta_phi_psi.csv"
-            output_file_path = os.path.join(output_dir, output_file_name)
-            calculate_deltas_and_save(aln_file, ref_df, target_df, output_file_path)
-            print(f"Processed {output_file_name}")
-        else:
-            print(f"Missing phi/psi files for {base_name}")
-
-# Set your directories here
-alignment_files_dir = ""
-phi_psi_files_dir = ""
-output_dir = ""
-
-# Process each pair
-process_alignment_pairs(alignment_files_dir, phi_psi_files_dir, output_dir)
+        process_alignment_pair(aln_file, phi_psi_files_dir, output_dir)
+
+if __name__ == "__main__":
+    # Set your directories here
+    alignment_files_dir = ""
+    phi_psi_files_dir = ""
+    output_dir = ""
+
+    # Process each pair
+    process_alignment_pairs(alignment_files_dir, phi_psi_files_dir, output_dir)
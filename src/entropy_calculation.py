@@ -1,13 +1,40 @@
 import os
 import pandas as pd
 import numpy as np
-from scipy.stats import entropy
-import matplotlib.pyplot as plt
-import seaborn as sns
 import logging
-
-# Set up logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+import warnings
+
+# Dictionary specifying max residue numbers for specific protein families
+MAX_RESIDUE_NUMBER_DICT = {
+    'Azurin': 128,
+    'CDK2': 298,
+    'Carbonic-Anhydrase': 250,
+    'Cytochrome-C': 104,
+    'Beta-Lactamase': 361,
+    'Haemoglobin': 141,
+    'HIV-Protease': 99,
+    'HSP-90': 224,
+    'MHC1': 274,
+    'KRAS': 167,
+    'MAPK-1': 357,
+    'Lysozyme-C': 130,
+    'Superoxide-Dismutase': 201,
+    'Thioredoxin': 139,
+    'Trypsin': 245,
+    'Peroxidase': 294,
+    'Myoglobin': 151,
+    'p53': 290,
+    'Cytochrome-C': 104,
+    'KRAS': 166,
+    'Lysozyme-C': 146,
+    'Caspase-3': 175,
+    'Ribonuclease-A': 124,
+    'TIM': 248,
+    'Caspase-3': 175,
+    'Phospholipase': 133,
+
+    # Add other protein families and their max residue numbers here
+}
 
 def calculate_histogram_entropy(data, bins):
     """
@@ -28,84 +55,180 @@ def calculate_histogram_entropy(data, bins):
     histogram, bin_edges = np.histogram(data, bins=bins, range=(0, 360), density=True)
     histogram = histogram[histogram > 0]
 
+    from scipy.stats import entropy  # scipy.stats takes about a second to import
     return entropy(histogram, base=2)  # Base 2 logarithm for binary entropy
 
-def process_files(input_dir, output_dir, max_residue_number_dict, bins):
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+# Bin counts evaluated alongside the main one to check how sensitive entropies are to binning
+BIN_SWEEP = (12, 36, 60, 120)
 
-    for file_name in os.listdir(input_dir):
-        if file_name.startswith("agg_") and file_name.endswith(".csv"):
-            protein_name = file_name.split('_')[1].replace('.csv', '')
-            input_file = os.path.join(input_dir, file_name)
-            output_file = os.path.join(output_dir, f"entropy_{protein_name}.csv")
+def histogram_bin_indices(values, bins):
+    """
+    Bin index of every value on the (0, 360) range, with np.histogram edge semantics
+    (half-open bins, the last one closed). Values that are NaN or out of range get -1.
+    """
+    edges = np.linspace(0, 360, bins + 1)
+    indices = np.searchsorted(edges, values, side='right') - 1
+    indices[values == 360] = bins - 1
+    indices[~((values >= 0) & (values <= 360))] = -1
+    return indices
 
-            max_residue_number = max_residue_number_dict.get(protein_name, None)
+def count_entropies(counts):
+    """
+    Plug-in and Miller-Madow corrected base-2 entropies along the last (bin) axis of a count array.
 
-            # Load data
-            try:
-                data = pd.read_csv(input_file)
-                logging.info(f"Processing file: {input_file}")
+    Rows without counts get NaN.
+    """
+    totals = counts.sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = counts / totals[..., None]
+        terms = np.where(counts > 0, p * np.log2(p), 0.0)
+        plugin = np.where(totals > 0, -terms.sum(axis=-1), np.nan)
+        # Miller-Madow: + (occupied bins - 1) / 2N nats
+        occupied = (counts > 0).sum(axis=-1)
+        corrected = plugin + (occupied - 1) / (2 * totals * np.log(2))
+    return plugin, corrected
+
+def binned_entropies(residue_codes, n_residues, values, bins):
+    """
+    Base-2 histogram entropy per residue, for all residues at once.
+
+    A (residue x bin) count matrix is built with a single bincount and normalized per
+    row, which gives the same result as calculate_histogram_entropy on each group.
+    Residues without any binned value get NaN.
+    """
+    indices = histogram_bin_indices(values, bins)
+    valid = indices >= 0
+    counts = np.bincount(residue_codes[valid] * bins + indices[valid],
+                         minlength=n_residues * bins).reshape(n_residues, bins)
+    return count_entropies(counts)[0]
 
-                # Filter residues up to max_residue_number if specified
-                if max_residue_number is not None:
-                    data = data[data['RefResidueNumber'] <= max_residue_number]
+# Upper bound on the elements of one (bootstrap x residue x bin) count chunk
+BOOTSTRAP_CHUNK_ELEMENTS = 1 << 24
 
-                # Ensure DeltaPhi and DeltaPsi columns are numeric
-                data['DeltaPhi'] = pd.to_numeric(data['DeltaPhi'], errors='coerce')
-                data['DeltaPsi'] = pd.to_numeric(data['DeltaPsi'], errors='coerce')
+def bootstrap_entropies(pair_codes, n_pairs, residue_codes, n_residues, values, bins, n_boot=1000,
+                        ci=0.95, seed=0):
+    """
+    Bootstrap of per-residue entropies, resampling whole alignment pairs.
 
-                # Calculate entropy for each residue number
-                phi_entropy = data.groupby('RefResidueNumber')['DeltaPhi'].apply(lambda x: calculate_histogram_entropy(x, bins=bins)).reset_index()
-                psi_entropy = data.groupby('RefResidueNumber')['DeltaPsi'].apply(lambda x: calculate_histogram_entropy(x, bins=bins)).reset_index()
+    Bin indices are computed once and turned into a sparse (pair x residue*bin) count
+    matrix; each chunk of replicates draws multinomial pair weights, so the
+    (replicate x residue x bin) count tensor is a single sparse-dense product.
 
-                # Merge entropy results
-                entropy_df = pd.merge(phi_entropy, psi_entropy, on='RefResidueNumber', suffixes=('_PhiEntropy', '_PsiEntropy'))
-                entropy_df.columns = ['RefResidueNumber', 'PhiEntropy', 'PsiEntropy']
+    Returns:
+    - dict: Per-residue arrays 'MillerMadow', 'BootMean', 'CILow' and 'CIHigh'.
+    """
+    from scipy import sparse
+    indices = histogram_bin_indices(values, bins)
+    valid = indices >= 0
+    cells = n_residues * bins
+    pair_counts = sparse.csr_matrix(
+        (np.ones(int(valid.sum())), (pair_codes[valid], residue_codes[valid] * bins + indices[valid])),
+        shape=(n_pairs, cells))
+    _, corrected = count_entropies(np.asarray(pair_counts.sum(axis=0)).reshape(n_residues, bins))
+
+    rng = np.random.default_rng(seed)
+    chunk = max(1, BOOTSTRAP_CHUNK_ELEMENTS // max(cells, 1))
+    replicates = np.empty((n_boot, n_residues))
+    for start in range(0, n_boot, chunk):
+        size = min(chunk, n_boot - start)
+        weights = rng.multinomial(n_pairs, np.full(n_pairs, 1.0 / n_pairs), size=size)
+        counts = (pair_counts.T @ weights.T).T.reshape(size, n_residues, bins)
+        replicates[start:start + size] = count_entropies(counts)[0]
+
+    alpha = (1 - ci) / 2
+    with warnings.catch_warnings():
+        # Residues that are absent from every replicate stay NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        low, high = np.nanquantile(replicates, [alpha, 1 - alpha], axis=0)
+        mean = np.nanmean(replicates, axis=0)
+    return {'MillerMadow': corrected, 'BootMean': mean, 'CILow': low, 'CIHigh': high}
+
+def family_name(file_name):
+    """Family of an aggregated `agg_<family>.csv` table; family names may contain underscores."""
+    return file_name[len("agg_"):-len(".csv")]
+
+def entropy_output_name(family):
+    return f"entropy_{family}.csv"
+
+def process_file(input_file, output_file, max_residue_number, bins, sweep=(), n_boot=0, ci=0.95, seed=0):
+    """
+    Per-residue DeltaPhi/DeltaPsi entropies of one aggregated family table.
+
+    PhiEntropy and PsiEntropy use `bins`; every bin count in `sweep` is computed from the
+    same pass over the data and added as PhiEntropy_<bins> and PsiEntropy_<bins>.
+    With `n_boot` > 0, alignment pairs (the Target column, or rows for tables without it)
+    are resampled, all models of an ensemble target together, to add <Angle>EntropyMM
+    (Miller-Madow), <Angle>BootMean, <Angle>CILow and <Angle>CIHigh for the `bins` entropy.
+    Errors are logged and re-raised, so the caller sees the file as failed.
+    """
+    # Load data
+    try:
+        data = pd.read_csv(input_file)
+        logging.info(f"Processing file: {input_file}")
+
+        # Filter residues up to max_residue_number if specified
+        if max_residue_number is not None:
+            data = data[data['RefResidueNumber'] <= max_residue_number]
+        data = data.dropna(subset=['RefResidueNumber'])
+
+        # Ensure DeltaPhi and DeltaPsi columns are numeric
+        phi = pd.to_numeric(data['DeltaPhi'], errors='coerce').to_numpy(dtype=float)
+        psi = pd.to_numeric(data['DeltaPsi'], errors='coerce').to_numpy(dtype=float)
+
+        # Residue numbers are factorized once and shared by every bin count
+        residues, residue_codes = np.unique(data['RefResidueNumber'].to_numpy(), return_inverse=True)
+        entropy_df = pd.DataFrame({'RefResidueNumber': residues})
+        results = {n_bins: (binned_entropies(residue_codes, len(residues), phi, n_bins),
+                            binned_entropies(residue_codes, len(residues), psi, n_bins))
+                   for n_bins in dict.fromkeys([bins, *sweep])}
+        entropy_df['PhiEntropy'], entropy_df['PsiEntropy'] = results[bins]
+        for n_bins in sweep:
+            entropy_df[f'PhiEntropy_{n_bins}'], entropy_df[f'PsiEntropy_{n_bins}'] = results[n_bins]
+
+        if n_boot:
+            pair_codes, pairs = pd.factorize(data['Target'] if 'Target' in data else pd.RangeIndex(len(data)))
+            for angle, values in (('Phi', phi), ('Psi', psi)):
+                boot = bootstrap_entropies(pair_codes, len(pairs), residue_codes, len(residues), values, bins,
+                                           n_boot, ci, seed)
+                entropy_df[f'{angle}EntropyMM'] = boot['MillerMadow']
+                for key in ('BootMean', 'CILow', 'CIHigh'):
+                    entropy_df[f'{angle}{key}'] = boot[key]
+            logging.info(f"Bootstrapped {n_boot} replicate(s) over {len(pairs)} pair(s)")
+
+        # Save results, sorting by RefResidueNumber
+        entropy_df.to_csv(output_file, index=False)
+        logging.info(f"Entropy calculations completed and saved to {output_file}")
+
+    except Exception as e:
+        logging.error(f"An error occurred while processing {input_file}: {e}")
+        raise
+
+def process_files(input_dir, output_dir, max_residue_number_dict, bins, sweep=(), n_boot=0):
+    """
+    Entropies of every `agg_<family>.csv` table in `input_dir`.
 
-                # Save results, sorting by RefResidueNumber
-                entropy_df.to_csv(output_file, index=False)
-                logging.info(f"Entropy calculations completed and saved to {output_file}")
+    A file that fails is logged and the remaining files are still processed; a
+    RuntimeError naming the failed files is raised at the end.
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
 
-            except Exception as e:
-                logging.error(f"An error occurred while processing {input_file}: {e}")
+    failed = []
+    for file_name in sorted(os.listdir(input_dir)):
+        if file_name.startswith("agg_") and file_name.endswith(".csv"):
+            protein_name = family_name(file_name)
+            input_file = os.path.join(input_dir, file_name)
+            output_file = os.path.join(output_dir, entropy_output_name(protein_name))
+            try:
+                process_file(input_file, output_file, max_residue_number_dict.get(protein_name, None), bins, sweep, n_boot)
+            except Exception:
+                failed.append(file_name)
+    if failed:
+        raise RuntimeError(f"Entropy calculation failed for {len(failed)} file(s): {', '.join(failed)}")
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
     input_dir = ""
     output_dir = ""
-    
-    # Dictionary specifying max residue numbers for specific protein families
-    max_residue_number_dict = {
-        'Azurin': 128,
-        'CDK2': 298,
-        'Carbonic-Anhydrase': 250,
-        'Cytochrome-C': 104,
-        'Beta-Lactamase': 361,
-        'Haemoglobin': 141,
-        'HIV-Protease': 99,
-        'HSP-90': 224,
-        'MHC1': 274,
-        'KRAS': 167,
-        'MAPK-1': 357,
-        'Lysozyme-C': 130,
-        'Superoxide-Dismutase': 201,
-        'Thioredoxin': 139,
-        'Trypsin': 245,
-        'Peroxidase': 294,
-        'Myoglobin': 151,
-        'p53': 290,
-        'Cytochrome-C': 104,
-        'KRAS': 166,
-        'Lysozyme-C': 146,
-        'Caspase-3': 175,
-        'Ribonuclease-A': 124,
-        'TIM': 248,
-        'Caspase-3': 175,
-        'Phospholipase': 133,
-
-
-        
-        # Add other protein families and their max residue numbers here
-    }
-
-    process_files(input_dir, output_dir, max_residue_number_dict, bins=60)
+
+    process_files(input_dir, output_dir, MAX_RESIDUE_NUMBER_DICT, bins=60, sweep=BIN_SWEEP)
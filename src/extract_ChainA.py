@@ -1,55 +1,124 @@
 import os
 import gzip
-import shutil
-import pymol
-from pymol import cmd
-
-# Specify the input and output directories
-input_directory = ""
-output_directory = ""
-os.makedirs(output_directory, exist_ok=True)
-
-# Decompress .gz files
-for filename in os.listdir(input_directory):
-    if filename.endswith(".gz"):
-        filepath = os.path.join(input_directory, filename)
-        decompressed_filepath = os.path.join(input_directory, filename[:-3])  # Remove the .gz extension
-        with gzip.open(filepath, 'rb') as f_in:
-            with open(decompressed_filepath, 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
-        print(f"Decompressed: {filename} -> {decompressed_filepath}")
-
-# Initialize PyMOL
-pymol.finish_launching()
-
-# Load decompressed PDB files into PyMOL
-for filename in os.listdir(input_directory):
-    if filename.endswith(".pdb"):
-        filepath = os.path.join(input_directory, filename)
-        cmd.load(filepath)
-
-# List all loaded objects in PyMOL
-loaded_objects = cmd.get_names("objects")
-
-for object_name in loaded_objects:
-    try:
-        # Get the list of chains in the current object
-        chains = cmd.get_chains(object_name)
-        if chains:
-            # Select the first chain
-            first_chain = chains[0]
-            cmd.select('first_chain', f'{object_name} and chain {first_chain}')
-            new_filename = f'{object_name}_Chain{first_chain}.pdb'
-            new_filepath = os.path.join(output_directory, new_filename)
-            cmd.save(new_filepath, 'first_chain')
-            print(f"Processed: {object_name} -> {new_filename}")
-        else:
-            print(f"No chains found in {object_name}")
-        
-        # Deselect the selection for the next iteration
-        cmd.deselect()
-    except pymol.CmdException as e:
-        print(f"Error processing {object_name}: {e}")
-
-# Display "done" message
-print("Done")
+from concurrent.futures import ProcessPoolExecutor
+
+STRUCTURE_SUFFIXES = ('.pdb', '.ent', '.pdb.gz', '.ent.gz')
+
+def structure_name(filename):
+    """Name of a structure file without its .gz and .pdb/.ent extensions."""
+    name = os.path.basename(filename)
+    if name.endswith('.gz'):
+        name = name[:-3]
+    return os.path.splitext(name)[0]
+
+def chain_output_name(filename, chain_id):
+    return f'{structure_name(filename)}_Chain{chain_id}.pdb'
+
+def open_structure(filepath):
+    # gzip input is decompressed on the fly, never written to disk
+    if filepath.endswith('.gz'):
+        return gzip.open(filepath, 'rt')
+    return open(filepath, 'r')
+
+def is_coordinate_record(line):
+    return line.startswith('ATOM  ') or line.startswith('HETATM')
+
+def chain_sizes(filepath):
+    """Number of residues per chain in the first model, in order of appearance."""
+    sizes = {}
+    seen = set()
+    with open_structure(filepath) as f:
+        for line in f:
+            if line.startswith('ENDMDL'):
+                break
+            if line.startswith('ATOM  '):
+                chain_id = line[21]
+                residue = (chain_id, line[22:27])
+                if residue not in seen:
+                    seen.add(residue)
+                    sizes[chain_id] = sizes.get(chain_id, 0) + 1
+    return sizes
+
+def select_chain(filepath, chain_policy='first'):
+    """
+    Pick the chain to extract.
+
+    `chain_policy` is 'first' (first chain with protein residues, so a leading ligand or
+    water chain is skipped), 'longest' (most protein residues) or an explicit chain ID.
+    Like `chain_sizes`, only ATOM records of the first model count. Returns None if no
+    such chain exists.
+    """
+    if chain_policy == 'first':
+        with open_structure(filepath) as f:
+            for line in f:
+                if line.startswith('ENDMDL'):
+                    break
+                if line.startswith('ATOM  '):
+                    return line[21]
+        return None
+    sizes = chain_sizes(filepath)
+    if chain_policy == 'longest':
+        return max(sizes, key=sizes.get) if sizes else None
+    return chain_policy if chain_policy in sizes else None
+
+def extract_chain(filepath, output_directory, chain_policy='first', all_models=False):
+    """
+    Stream the ATOM/HETATM/TER records of one chain into `<name>_Chain<ID>.pdb`.
+
+    Only the first model is written unless `all_models` is set, in which case the
+    MODEL/ENDMDL records are kept as well. Returns the output path, or None if the
+    file has no matching chain.
+    """
+    filename = os.path.basename(filepath)
+    chain_id = select_chain(filepath, chain_policy)
+    if chain_id is None:
+        print(f"No chains found in {filename}")
+        return None
+
+    new_filename = chain_output_name(filename, chain_id)
+    new_filepath = os.path.join(output_directory, new_filename)
+    tmp_filepath = new_filepath + '.tmp'
+    last_in_chain = False
+    with open_structure(filepath) as f_in, open(tmp_filepath, 'w') as f_out:
+        for line in f_in:
+            if is_coordinate_record(line):
+                last_in_chain = line[21] == chain_id
+                if last_in_chain:
+                    f_out.write(line)
+            elif line.startswith('TER'):
+                if last_in_chain:
+                    f_out.write(line)
+                last_in_chain = False
+            elif line.startswith('ENDMDL'):
+                if not all_models:
+                    break
+                f_out.write(line)
+            elif line.startswith('MODEL') and all_models:
+                f_out.write(line)
+        f_out.write('END\n')
+    os.replace(tmp_filepath, new_filepath)
+    print(f"Processed: {filename} -> {new_filename}")
+    return new_filepath
+
+def list_structure_files(input_directory):
+    return sorted(os.path.join(input_directory, filename) for filename in os.listdir(input_directory)
+                  if filename.endswith(STRUCTURE_SUFFIXES) and not filename.startswith('.'))
+
+def extract_chains(input_directory, output_directory, chain_policy='first', workers=None):
+    """Extract one chain from every (optionally gzipped) structure file, in parallel across files."""
+    os.makedirs(output_directory, exist_ok=True)
+    filepaths = list_structure_files(input_directory)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        outputs = list(pool.map(extract_chain, filepaths, [output_directory] * len(filepaths),
+                                [chain_policy] * len(filepaths)))
+
+    # Display "done" message
+    print("Done")
+    return [path for path in outputs if path is not None]
+
+if __name__ == "__main__":
+    # Specify the input and output directories
+    input_directory = ""
+    output_directory = ""
+
+    extract_chains(input_directory, output_directory)
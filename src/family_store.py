@@ -0,0 +1,373 @@
+"""
+Columnar per-family result tables.
+
+Each table of a family (angles, DSSP, ASA, B-factors...) is one append-only file
+of chunks. A chunk is a JSON header followed by one typed column buffer per
+column (numpy dtypes; strings as fixed-width unicode), aligned so every column
+can be memory-mapped with np.memmap. The header holds the row count, the
+column layout, per-column min/max used to skip chunks on filtered reads, and
+the sources (usually structure names) whose rows the chunk holds.
+
+Appends take an exclusive flock and write a whole chunk at the end of the file;
+readers stop at an incomplete trailing chunk, so they never see a partial
+write. Writers keep the end of the complete chunks and the column names in a
+`<table>.fstore.tail` file, so an append only checks the chunks written since
+the last recorded one instead of every header of the file. Rows of a source written again by a later chunk are superseded: readers
+drop them, and `compact` removes them from the file and merges small chunks.
+
+With `set_shard`, a process (and the workers it starts) appends to its own shard
+file next to each table instead, e.g. a queue worker on a shared filesystem
+where file locks cannot be relied on; `merge_shards` later moves the shard
+chunks into the table.
+"""
+import os
+import json
+import fcntl
+import glob
+import struct
+import numpy as np
+import pandas as pd
+
+CHUNK_MAGIC = b'FSCHUNK1'
+ALIGNMENT = 64
+STORE_SUFFIX = '.fstore'
+
+# Worker processes inherit the shard name through the environment
+SHARD_ENV = "PIPELINE_STORE_SHARD"
+SHARD_DIR = "shards"
+
+# Sidecar with the end offset, inode and column names of a table file as of its last append
+TAIL_SUFFIX = '.tail'
+
+# Rows per chunk written by `compact`
+COMPACT_CHUNK_ROWS = 1 << 20
+
+# Columns used for residue ranges, in order of preference
+RESIDUE_COLUMNS = ('ResidueNumber', 'RefResidueNumber', 'Residue_Number')
+
+def table_path(store_dir, family, table):
+    return os.path.join(store_dir, f"{family}_{table}{STORE_SUFFIX}")
+
+def set_shard(shard):
+    """Append to shard `shard` of every table in this process and in workers started after this call (None: off)."""
+    if shard:
+        os.environ[SHARD_ENV] = shard
+    else:
+        os.environ.pop(SHARD_ENV, None)
+
+def shard_path(path, shard):
+    return os.path.join(os.path.dirname(path), SHARD_DIR, shard, os.path.basename(path))
+
+def _padding(size):
+    return -size % ALIGNMENT
+
+def _column_array(values):
+    """Typed numpy array of a column; nullable integers with missing values become float."""
+    series = pd.Series(values)
+    if isinstance(series.dtype, pd.api.extensions.ExtensionDtype) and series.dtype.kind in 'iub':
+        series = series.astype(float) if series.isna().any() else series.astype(series.dtype.numpy_dtype)
+    array = series.to_numpy()
+    if array.dtype.kind == 'O':
+        array = series.fillna('').astype(str).to_numpy().astype(str)
+    if array.dtype.kind == 'U' and array.dtype.itemsize == 0:
+        array = array.astype('<U1')
+    return np.ascontiguousarray(array)
+
+def _stats(array):
+    # JSON-safe min/max, None when there is nothing to compare
+    if not len(array) or array.dtype.kind not in 'biufU':
+        return None
+    if array.dtype.kind == 'f':
+        finite = array[~np.isnan(array)]
+        return [float(finite.min()), float(finite.max())] if len(finite) else None
+    if array.dtype.kind == 'U':
+        ordered = np.sort(array)
+        return [str(ordered[0]), str(ordered[-1])]
+    return [array.min().item(), array.max().item()]
+
+def _encode_chunk(columns, sources):
+    arrays = {name: _column_array(values) for name, values in columns.items()}
+    rows = {len(array) for array in arrays.values()}
+    if len(rows) > 1:
+        raise ValueError(f"Columns of a chunk differ in length: {sorted(rows)}")
+    layout, offset = [], 0
+    for name, array in arrays.items():
+        layout.append({'name': name, 'dtype': array.dtype.str, 'offset': offset, 'nbytes': array.nbytes,
+                       'stats': _stats(array)})
+        offset += array.nbytes + _padding(array.nbytes)
+    header = {'rows': rows.pop() if rows else 0, 'columns': layout, 'sources': sorted(map(str, sources)),
+              'data_bytes': offset}
+    encoded = json.dumps(header).encode()
+    encoded += b' ' * _padding(len(CHUNK_MAGIC) + 8 + len(encoded))
+    parts = [CHUNK_MAGIC, struct.pack('<Q', len(encoded)), encoded]
+    for array in arrays.values():
+        parts += [array.tobytes(), b'\0' * _padding(array.nbytes)]
+    return b''.join(parts)
+
+def _scan_chunks(f, position, size):
+    # Headers of the complete chunks from `position` on, and where they end
+    headers = []
+    while position + len(CHUNK_MAGIC) + 8 <= size:
+        f.seek(position)
+        prefix = f.read(len(CHUNK_MAGIC) + 8)
+        if prefix[:len(CHUNK_MAGIC)] != CHUNK_MAGIC:
+            break
+        header_length = struct.unpack('<Q', prefix[len(CHUNK_MAGIC):])[0]
+        data_offset = position + len(prefix) + header_length
+        if data_offset > size:
+            break
+        header = json.loads(f.read(header_length))
+        end = data_offset + header['data_bytes']
+        if end > size:
+            break
+        header['chunk_offset'] = position
+        header['data_offset'] = data_offset
+        headers.append(header)
+        position = end
+    return headers, position
+
+def chunk_headers(path):
+    """
+    Headers of the complete chunks of a table file, each with its absolute `data_offset`.
+
+    Returns:
+    - tuple: (list of header dicts, byte offset where the complete chunks end).
+    """
+    if not os.path.exists(path):
+        return [], 0
+    with open(path, 'rb') as f:
+        return _scan_chunks(f, 0, os.fstat(f.fileno()).st_size)
+
+def _read_tail(path, stat):
+    # The recorded tail, if it belongs to this file and the file still reaches it
+    try:
+        with open(path + TAIL_SUFFIX) as f:
+            tail = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if tail.get('inode') != stat.st_ino or tail.get('end', 0) > stat.st_size:
+        return None
+    return tail
+
+def _write_tail(path, stat, end, columns):
+    tmp_path = f"{path}{TAIL_SUFFIX}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({'inode': stat.st_ino, 'end': end, 'columns': columns}, f)
+    os.replace(tmp_path, path + TAIL_SUFFIX)
+
+def _remove_tail(path):
+    try:
+        os.remove(path + TAIL_SUFFIX)
+    except FileNotFoundError:
+        pass
+
+def append_table(path, table, source=None, source_column='Structure'):
+    """
+    Append the rows of a DataFrame (or dict of arrays) to a table file as one chunk.
+
+    Rows of `source` from earlier chunks are superseded, so re-running an item for the
+    same structure replaces its rows. The first chunk fixes the column names; later
+    chunks must have the same ones.
+    """
+    columns = {name: table[name] for name in table}
+    if source is not None:
+        sources = [source]
+    elif source_column in columns:
+        sources = pd.unique(pd.Series(columns[source_column]).astype(str)).tolist()
+    else:
+        sources = []
+    chunk = _encode_chunk(columns, sources)
+    shard = os.environ.get(SHARD_ENV)
+    return _append_chunks(shard_path(path, shard) if shard else path, [chunk], list(columns))
+
+def _append_chunks(path, chunks, columns):
+    # Encoded chunks are written at the end of the file under an exclusive lock
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    while True:
+        with open(path, 'ab') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                # `compact` may have replaced the file while this writer waited for the lock
+                if not os.path.exists(path) or os.stat(path).st_ino != os.fstat(f.fileno()).st_ino:
+                    continue
+                # Only chunks written after the recorded tail are read, normally none
+                stat = os.fstat(f.fileno())
+                tail = _read_tail(path, stat)
+                with open(path, 'rb') as reader:
+                    headers, end = _scan_chunks(reader, tail['end'] if tail else 0, stat.st_size)
+                if tail:
+                    expected = tail['columns']
+                else:
+                    expected = [column['name'] for column in headers[0]['columns']] if headers else columns
+                if sorted(expected) != sorted(columns):
+                    raise ValueError(f"Columns {sorted(columns)} do not match {sorted(expected)} of {path}")
+                # Drop a chunk left incomplete by an interrupted writer
+                if stat.st_size != end:
+                    f.truncate(end)
+                for chunk in chunks:
+                    f.write(chunk)
+                f.flush()
+                _write_tail(path, stat, end + sum(len(chunk) for chunk in chunks), expected)
+                return path
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def merge_shards(path):
+    """
+    Move the complete chunks of every shard of a table into the table, in shard name order,
+    and delete the shard files. Rows of a source in a shard supersede its rows in the table.
+
+    Returns:
+    - int: Number of chunks moved.
+    """
+    moved = 0
+    for shard_file in sorted(glob.glob(shard_path(glob.escape(path), '*'))):
+        headers, _ = chunk_headers(shard_file)
+        if headers:
+            with open(shard_file, 'rb') as f:
+                chunks = []
+                for header in headers:
+                    f.seek(header['chunk_offset'])
+                    chunks.append(f.read(header['data_offset'] + header['data_bytes'] - header['chunk_offset']))
+            _append_chunks(path, chunks, [column['name'] for column in headers[0]['columns']])
+            moved += len(chunks)
+        os.remove(shard_file)
+        _remove_tail(shard_file)
+        for directory in (os.path.dirname(shard_file), os.path.dirname(os.path.dirname(shard_file))):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+    if moved:
+        print(f"Merged {moved} shard chunk(s) into {path}")
+    return moved
+
+def remove_source(path, source):
+    """Supersede every row of `source` with an empty chunk, e.g. when its item failed on a re-run."""
+    headers, _ = chunk_headers(path)
+    if not headers:
+        return None
+    empty = {column['name']: np.zeros(0, dtype=column['dtype']) for column in headers[0]['columns']}
+    return append_table(path, empty, source=source)
+
+def _column_map(path, header, name):
+    column = next(column for column in header['columns'] if column['name'] == name)
+    dtype = np.dtype(column['dtype'])
+    if header['rows'] == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=header['data_offset'] + column['offset'],
+                     shape=(header['rows'],))
+
+def _may_match(column, condition):
+    stats = column['stats']
+    if stats is None:
+        return True
+    low, high = stats
+    if isinstance(condition, tuple):
+        return not ((condition[0] is not None and high < condition[0]) or (condition[1] is not None and low > condition[1]))
+    values = condition if isinstance(condition, (list, set, frozenset)) else [condition]
+    return any(low <= value <= high for value in values)
+
+def _condition_mask(array, condition):
+    if isinstance(condition, tuple):
+        mask = np.ones(len(array), dtype=bool)
+        if condition[0] is not None:
+            mask &= array >= condition[0]
+        if condition[1] is not None:
+            mask &= array <= condition[1]
+        return mask
+    values = list(condition) if isinstance(condition, (list, set, frozenset)) else [condition]
+    return np.isin(array, values)
+
+def read_columns(path, columns=None, filters=None, source_column='Structure'):
+    """
+    Selected columns of the live rows of a table file as numpy arrays.
+
+    Parameters:
+    - columns (list): Columns to load (default: all). Only these are read from disk.
+    - filters (dict): Column -> condition: a (low, high) tuple for an inclusive range
+      (either end may be None), a list or set for membership, or a single value.
+      Chunks whose min/max rule a condition out are skipped without reading them.
+
+    Returns:
+    - dict: Column name -> array. Unfiltered single-chunk reads are memory-mapped.
+    """
+    headers, _ = chunk_headers(path)
+    if not headers:
+        return {name: np.zeros(0) for name in columns or []}
+    names = columns or [column['name'] for column in headers[0]['columns']]
+    filters = filters or {}
+    unknown = set(names) | set(filters)
+    unknown -= {column['name'] for column in headers[0]['columns']}
+    if unknown:
+        raise KeyError(f"Unknown column(s) {sorted(unknown)} in {path}")
+
+    # Newest chunks first: their sources supersede the rows of older chunks
+    parts, superseded = [], set()
+    for header in reversed(headers):
+        sources = set(header['sources'])
+        stale = sources & superseded
+        superseded |= sources
+        if sources and stale == sources:
+            continue
+        # Empty chunks only supersede the rows of their sources
+        if header['rows'] == 0:
+            continue
+        by_name = {column['name']: column for column in header['columns']}
+        if not all(_may_match(by_name[name], condition) for name, condition in filters.items()):
+            continue
+        mask = None
+        if stale:
+            mask = ~np.isin(_column_map(path, header, source_column).astype(str), list(stale))
+        for name, condition in filters.items():
+            condition_mask = _condition_mask(_column_map(path, header, name), condition)
+            mask = condition_mask if mask is None else mask & condition_mask
+        selected = {name: _column_map(path, header, name) for name in names}
+        if mask is not None:
+            selected = {name: np.asarray(values)[mask] for name, values in selected.items()}
+        parts.append(selected)
+
+    parts.reverse()
+    if len(parts) == 1:
+        return parts[0]
+    if not parts:
+        return {name: _column_map(path, {**headers[0], 'rows': 0}, name) for name in names}
+    return {name: np.concatenate([part[name] for part in parts]) for name in names}
+
+def read_table(path, columns=None, filters=None, source_column='Structure'):
+    """Like `read_columns`, as a DataFrame in file order."""
+    return pd.DataFrame(read_columns(path, columns, filters, source_column), columns=columns)
+
+def residue_column(path):
+    """Residue number column of a table file, used for residue-range reads, or None."""
+    headers, _ = chunk_headers(path)
+    names = {column['name'] for column in headers[0]['columns']} if headers else set()
+    return next((name for name in RESIDUE_COLUMNS if name in names), None)
+
+def export_csv(path, csv_path, columns=None, filters=None):
+    """Write the live rows of a table file (optionally a subset) as CSV."""
+    table = read_table(path, columns, filters)
+    table.to_csv(csv_path + '.tmp', index=False)
+    os.replace(csv_path + '.tmp', csv_path)
+    print(f"Exported {len(table)} row(s) of {path} to {csv_path}")
+    return csv_path
+
+def compact(path, chunk_rows=COMPACT_CHUNK_ROWS, source_column='Structure'):
+    """Rewrite a table file without superseded rows, merging its chunks into chunks of up to `chunk_rows` rows."""
+    with open(path, 'ab') as lock:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        try:
+            headers, _ = chunk_headers(path)
+            table = read_table(path, source_column=source_column)
+            with open(path + '.tmp', 'wb') as f:
+                for start in range(0, max(len(table), 1), chunk_rows):
+                    part = table.iloc[start:start + chunk_rows]
+                    sources = pd.unique(part[source_column].astype(str)).tolist() if source_column in part else []
+                    f.write(_encode_chunk({name: part[name].to_numpy() for name in part}, sources))
+            os.replace(path + '.tmp', path)
+            # The next append records the tail of the new file
+            _remove_tail(path)
+        finally:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+    print(f"Compacted {path}: {len(headers)} chunk(s) -> {-(-max(len(table), 1) // chunk_rows)}")
+    return path
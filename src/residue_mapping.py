@@ -1,35 +1,32 @@
 import os
-from Bio.PDB import PDBParser, is_aa
-from Bio.SeqUtils import seq1  # Correct import for three-letter to one-letter conversion
-import warnings
+from functools import lru_cache
+import numpy as np
+from structure_store import get_structure
+from tm_align_results import passed_records
 
-def get_residue_numbers(pdb_file_path, chain_id):
-    parser = PDBParser(QUIET=True)
+# Alignment marker classes: ':' residue pairs closer than 5 A, '.' other aligned residues
+MARKER_CLASSES = {' ': 0, '.': 1, ':': 2}
 
+def get_residue_numbers(pdb_file_path, chain_id):
     # Check if the PDB file exists before attempting to parse it
     if not os.path.exists(pdb_file_path) or pdb_file_path.startswith('.') or not pdb_file_path.endswith('.pdb'):
         print(f"Skipping: File not found or invalid: {pdb_file_path}")
         return []
 
-    structure = parser.get_structure('', pdb_file_path)
+    structure = get_structure(pdb_file_path)
     
     # Check if the structure contains models
-    if len(structure) == 0:
+    if len(structure.res_model) == 0:
         print(f"No models found in {pdb_file_path}")
         return []
 
-    model = structure[0]  # Assuming the first model in the PDB file
-
-    residue_numbers = []
-    if chain_id in model:
-        for residue in model[chain_id]:
-            if is_aa(residue, standard=True):
-                residue_numbers.append((residue.id[1], seq1(residue.resname)))
-    else:
+    # Assuming the first model in the PDB file
+    if chain_id not in structure.res_chain[structure.residue_mask()]:
         print(f"Chain ID {chain_id} not found in {pdb_file_path}")
         return []
 
-    return residue_numbers
+    mask = structure.residue_mask(chain_id=chain_id, standard_only=True)
+    return list(zip(structure.res_resnum[mask].tolist(), structure.res_code[mask].tolist()))
 
 
 def parse_alignment(file_path):
@@ -78,13 +75,18 @@ def extract_ids_from_filename(filename):
     return pdb_id_1, chain_id_1, pdb_id_2, chain_id_2
 
 
-def compare_and_save_mappings(file_path, pdb_dir, output_dir):
-    seq1, markers, seq2 = parse_alignment(file_path)
+def mapping_output_name(file_path):
+    return os.path.splitext(os.path.basename(file_path))[0] + "_residue_mapping.txt"
+
+
+def mapping_pdb_paths(file_path, pdb_dir):
+    """Paths of the two chain PDB files an alignment file refers to."""
     pdb_id_1, chain_id_1, pdb_id_2, chain_id_2 = extract_ids_from_filename(os.path.basename(file_path))
+    return (os.path.join(pdb_dir, f"{pdb_id_1}_Chain{chain_id_1}.pdb"),
+            os.path.join(pdb_dir, f"{pdb_id_2}_Chain{chain_id_2}.pdb"))
 
-    residue_numbers_1 = get_residue_numbers(os.path.join(pdb_dir, f"{pdb_id_1}_Chain{chain_id_1}.pdb"), chain_id_1)
-    residue_numbers_2 = get_residue_numbers(os.path.join(pdb_dir, f"{pdb_id_2}_Chain{chain_id_2}.pdb"), chain_id_2)
 
+def build_mapping(seq1, markers, seq2, residue_numbers_1, residue_numbers_2):
     comparison_data = []
     index_1, index_2 = 0, 0
 
@@ -112,8 +114,39 @@ def compare_and_save_mappings(file_path, pdb_dir, output_dir):
         if alignment_char != ' ':
             comparison_data.append(f"{res_num_1}{aa_code_1} - {res_num_2}{aa_code_2}")
 
-    output_filename = os.path.splitext(os.path.basename(file_path))[0] + "_residue_mapping.txt"
-    save_residue_mapping(output_dir, output_filename, comparison_data)
+    return comparison_data
+
+
+def compare_and_save_mappings(file_path, pdb_dir, output_dir):
+    seq1, markers, seq2 = parse_alignment(file_path)
+    pdb_id_1, chain_id_1, pdb_id_2, chain_id_2 = extract_ids_from_filename(os.path.basename(file_path))
+
+    pdb_path_1, pdb_path_2 = mapping_pdb_paths(file_path, pdb_dir)
+
+    residue_numbers_1 = get_residue_numbers(pdb_path_1, chain_id_1)
+    residue_numbers_2 = get_residue_numbers(pdb_path_2, chain_id_2)
+
+    comparison_data = build_mapping(seq1, markers, seq2, residue_numbers_1, residue_numbers_2)
+    save_residue_mapping(output_dir, mapping_output_name(file_path), comparison_data)
+
+
+def record_alignment_name(record):
+    """Name of the legacy TM-align text file for a result record, e.g. '1abc_ChainA_vs_2xyz_ChainA.txt'."""
+    return f"{os.path.splitext(record['Mobile'])[0]}_vs_{os.path.splitext(record['Reference'])[0]}.txt"
+
+
+def map_tm_record(record, pdb_dir, output_dir):
+    """Residue mapping for one record of a per-family TM-align result file."""
+    alignment_name = record_alignment_name(record)
+    pdb_id_1, chain_id_1, pdb_id_2, chain_id_2 = extract_ids_from_filename(alignment_name)
+    pdb_path_1, pdb_path_2 = mapping_pdb_paths(alignment_name, pdb_dir)
+
+    residue_numbers_1 = get_residue_numbers(pdb_path_1, chain_id_1)
+    residue_numbers_2 = get_residue_numbers(pdb_path_2, chain_id_2)
+
+    # Record alignment lines keep their leading spaces, so markers stay in register
+    comparison_data = build_mapping(record['Seq1'], record['Markers'], record['Seq2'], residue_numbers_1, residue_numbers_2)
+    save_residue_mapping(output_dir, mapping_output_name(alignment_name), comparison_data)
 
 
 def save_residue_mapping(output_dir, filename, comparison_data):
@@ -125,17 +158,116 @@ def save_residue_mapping(output_dir, filename, comparison_data):
             f.write(line + "\n")
 
 
-# Example usage
-pdb_dir = ""
-tm_align_output_dir = ""
-output_dir = ""
+@lru_cache(maxsize=4096)
+def _residue_index(pdb_file_path, chain_id, size, mtime_ns):
+    residue_numbers = get_residue_numbers(pdb_file_path, chain_id)
+    return np.array([number for number, _ in residue_numbers], dtype=np.int32)
+
+
+def residue_index(pdb_file_path, chain_id):
+    """Residue numbers of the standard residues of a chain, cached per process and file version."""
+    stat = os.stat(pdb_file_path)
+    return _residue_index(pdb_file_path, chain_id, stat.st_size, stat.st_mtime_ns)
+
+
+def alignment_indices(seq1, markers, seq2, residue_numbers_1, residue_numbers_2):
+    """
+    Residue numbers of the aligned positions of a TM-align alignment, without any text round-trip.
+
+    Returns:
+    - tuple: (residue numbers in chain 1, residue numbers in chain 2, marker class) arrays,
+      one entry per position whose marker is not blank.
+    """
+    length = max(len(seq1), len(markers), len(seq2))
+    seq1_codes = np.frombuffer(seq1.ljust(length, '-').encode(), dtype=np.uint8)
+    seq2_codes = np.frombuffer(seq2.ljust(length, '-').encode(), dtype=np.uint8)
+    marker_codes = np.frombuffer(markers.ljust(length).encode(), dtype=np.uint8)
+
+    # Position of every alignment column in each chain's residue list (-1 for gaps)
+    present_1 = seq1_codes != ord('-')
+    present_2 = seq2_codes != ord('-')
+    position_1 = np.where(present_1, np.cumsum(present_1) - 1, -1)
+    position_2 = np.where(present_2, np.cumsum(present_2) - 1, -1)
+
+    aligned = (marker_codes != ord(' ')) & present_1 & present_2
+    in_range = (position_1 < len(residue_numbers_1)) & (position_2 < len(residue_numbers_2))
+    if np.any(aligned & ~in_range):
+        print(f"Alignment is longer than the residue index; {int(np.sum(aligned & ~in_range))} position(s) dropped.")
+    aligned &= in_range
+
+    marker_class = np.where(marker_codes[aligned] == ord(':'), MARKER_CLASSES[':'], MARKER_CLASSES['.']).astype(np.int8)
+    return (np.asarray(residue_numbers_1)[position_1[aligned]], np.asarray(residue_numbers_2)[position_2[aligned]],
+            marker_class)
+
+
+def mapping_file_name(family):
+    return f"{family}_residue_mapping.npz"
+
+
+def build_family_mappings(results_path, pdb_dir, output_dir, family):
+    """
+    Residue mappings of every pair that passed the RMSD cutoff, as one binary file per family.
+
+    The reference of each pair is TM-align's Chain_2 and the target its Chain_1 (the mobile
+    structure). Arrays of all pairs are concatenated; pair k spans `offsets[k]:offsets[k+1]`.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    targets, references, offsets = [], [], [0]
+    ref_resnums, target_resnums, marker_classes = [], [], []
+    for record in passed_records(results_path):
+        pdb_id_1, chain_id_1, pdb_id_2, chain_id_2 = extract_ids_from_filename(record_alignment_name(record))
+        pdb_path_1, pdb_path_2 = mapping_pdb_paths(record_alignment_name(record), pdb_dir)
+        target_numbers, ref_numbers, marker_class = alignment_indices(
+            record['Seq1'], record['Markers'], record['Seq2'],
+            residue_index(pdb_path_1, chain_id_1), residue_index(pdb_path_2, chain_id_2))
+        targets.append(record['Mobile'])
+        references.append(record['Reference'])
+        ref_resnums.append(ref_numbers)
+        target_resnums.append(target_numbers)
+        marker_classes.append(marker_class)
+        offsets.append(offsets[-1] + len(ref_numbers))
+
+    output_path = os.path.join(output_dir, mapping_file_name(family))
+    tmp_path = output_path + '.tmp.npz'
+    np.savez(tmp_path, target=np.array(targets, dtype=str), reference=np.array(references, dtype=str),
+             offsets=np.array(offsets, dtype=np.int64),
+             ref_resnum=np.concatenate(ref_resnums) if ref_resnums else np.zeros(0, dtype=np.int32),
+             target_resnum=np.concatenate(target_resnums) if target_resnums else np.zeros(0, dtype=np.int32),
+             marker_class=np.concatenate(marker_classes) if marker_classes else np.zeros(0, dtype=np.int8))
+    os.replace(tmp_path, output_path)
+    print(f"Residue mappings for {len(targets)} pair(s) saved to {output_path}")
+    return output_path
+
+
+def load_family_mappings(mapping_path):
+    """Arrays of a per-family residue mapping file as a dict."""
+    with np.load(mapping_path) as data:
+        return {key: data[key] for key in data.files}
+
+
+def process_tm_results(results_path, pdb_dir, output_dir):
+    """Residue mappings for every pair that passed the RMSD cutoff in a TM-align result file."""
+    for record in passed_records(results_path):
+        map_tm_record(record, pdb_dir, output_dir)
+        print(f"Residue mapping for {record_alignment_name(record)} saved.")
+
+
+def process_residue_mappings(tm_align_output_dir, pdb_dir, output_dir):
+    for filename in os.listdir(tm_align_output_dir):
+        # Skip hidden or non-TXT files
+        if filename.startswith('.') or not filename.endswith(".txt"):
+            print(f"Skipping hidden or non-TXT file: {filename}")
+            continue
+
+        file_path = os.path.join(tm_align_output_dir, filename)
+        compare_and_save_mappings(file_path, pdb_dir, output_dir)
+        print(f"Residue mapping for {filename} saved.")
+
 
-for filename in os.listdir(tm_align_output_dir):
-    # Skip hidden or non-TXT files
-    if filename.startswith('.') or not filename.endswith(".txt"):
-        print(f"Skipping hidden or non-TXT file: {filename}")
-        continue
+if __name__ == "__main__":
+    # Example usage
+    pdb_dir = ""
+    tm_align_output_dir = ""
+    output_dir = ""
 
-    file_path = os.path.join(tm_align_output_dir, filename)
-    compare_and_save_mappings(file_path, pdb_dir, output_dir)
-    print(f"Residue mapping for {filename} saved.")
+    process_residue_mappings(tm_align_output_dir, pdb_dir, output_dir)
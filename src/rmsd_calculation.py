@@ -1,15 +1,9 @@
 import os
 import pandas as pd
 import numpy as np
-from scipy.spatial import distance
-
-# Directory containing the Excel coordinate files
-coord_dir = ""  # Replace with your directory path
-output_dir = ""  # Replace with your desired output directory
-
-# Ensure the output directory exists
-if not os.path.exists(output_dir):
-    os.makedirs(output_dir)
+from structure_store import get_structure
+from residue_mapping import load_family_mappings
+from superposition import superposition_deviations
 
 # Function to sort residues
 def sort_residues(residues):
@@ -18,54 +12,57 @@ def sort_residues(residues):
         return [int(text) if text.isdigit() else text for text in re.split('([0-9]+)', key)]
     return sorted(residues, key=alphanum_key)
 
-# Function to process each Excel file
-def process_excel_file(file_path):
-    # Read the Excel file
-    df = pd.read_excel(file_path)
-    
-    # Identify the reference model (assuming it's the first model in the file)
-    reference_model = df['model'].iloc[0]
-    print(f"Using {reference_model} as the reference model")
-
-    # Define the atoms to consider for distance calculations
-    atoms_to_consider = ['CA']
-
-    # Create a DataFrame to store the results
-    result_df = pd.DataFrame(columns=['Residue', 'Amino_Acid'] + [f"RMSD:{model}" for model in df['model'].unique() if model != reference_model])
-
-    # Filter rows for the reference structure
-    reference_df = df[df['model'] == reference_model]
-
-    # Extract all unique models excluding the reference
-    unique_models = df['model'].unique()
-    unique_models = [model for model in unique_models if model != reference_model]
-
-    # Iterate over unique models
-    for model in unique_models:
-        current_df = df[df['model'] == model]
-        for residue in reference_df['resi'].unique():
-            ref_atoms_df = reference_df[(reference_df['resi'] == residue) & (reference_df['name'].isin(atoms_to_consider))]
-            curr_atoms_df = current_df[(current_df['resi'] == residue) & (current_df['name'].isin(atoms_to_consider))]
-
-            if not ref_atoms_df.empty and not curr_atoms_df.empty:
-                ref_coords = ref_atoms_df[['x', 'y', 'z']].values
-                curr_coords = curr_atoms_df[['x', 'y', 'z']].values
-                distances = distance.cdist(ref_coords, curr_coords, 'euclidean')
-
-                # Compute RMSD
-                rmsd = np.sqrt(np.mean(np.square(distances)))
-                
-                # Update or insert the row
-                if str(residue) in result_df['Residue'].values:
-                    result_df.loc[result_df['Residue'] == str(residue), f"RMSD:{model}"] = rmsd
-                else:
-                    new_row = pd.DataFrame({
-                        'Residue': [str(residue)],
-                        'Amino_Acid': [ref_atoms_df['resn'].iloc[0]],
-                        f"RMSD:{model}": [rmsd]
-                    })
-                    if not new_row.isna().all().all():
-                        result_df = pd.concat([result_df, new_row], ignore_index=True)
+def rmsd_output_name(file_path):
+    protein_name = os.path.splitext(os.path.basename(file_path))[0].replace('_coord', '')
+    return f"results_mean_RMSD_{protein_name}.csv"
+
+def coordinate_tensor(df, atom_name='CA', reference_model=None):
+    """
+    Pivot a long coordinate table (model, resi, resn, name, x, y, z) into arrays.
+
+    Residues are those of the reference model (the first model unless given), in order
+    of appearance; the first matching atom per model and residue is used.
+
+    Returns:
+    - tuple: (models, residues, residue names, (model x residue x 3) coordinates, presence mask).
+    """
+    models = pd.unique(df['model'])
+    if reference_model is not None:
+        models = np.concatenate([[reference_model], [model for model in models if model != reference_model]])
+    residues = pd.unique(df.loc[df['model'] == models[0], 'resi'])
+
+    atoms = df[df['name'] == atom_name]
+    model_codes = pd.Categorical(atoms['model'], categories=models).codes
+    residue_codes = pd.Categorical(atoms['resi'], categories=residues).codes
+    keep = residue_codes >= 0
+    cells = pd.DataFrame({'model': model_codes[keep], 'residue': residue_codes[keep]})
+    first = ~cells.duplicated().to_numpy()
+    model_codes, residue_codes = cells['model'].to_numpy()[first], cells['residue'].to_numpy()[first]
+    atoms = atoms[keep][first]
+
+    coords = np.full((len(models), len(residues), 3), np.nan)
+    present = np.zeros((len(models), len(residues)), dtype=bool)
+    coords[model_codes, residue_codes] = atoms[['x', 'y', 'z']].to_numpy(dtype=float)
+    present[model_codes, residue_codes] = True
+    residue_names = np.full(len(residues), None, dtype=object)
+    from_reference = model_codes == 0
+    residue_names[residue_codes[from_reference]] = atoms['resn'].to_numpy()[from_reference]
+    return models, residues, residue_names, coords, present
+
+def residue_deviations(coords, present):
+    """(model x residue) distance of every atom to the reference model (index 0); NaN where either is missing."""
+    deviations = np.linalg.norm(coords - coords[0], axis=2)
+    return np.where(present & present[0], deviations, np.nan)
+
+def rmsd_table(df, atom_name='CA', reference_model=None):
+    """Per-residue deviations of every model from the reference plus their Mean_RMSD, as a DataFrame."""
+    models, residues, residue_names, coords, present = coordinate_tensor(df, atom_name, reference_model)
+    deviations = residue_deviations(coords, present)[1:]
+    # Residues without any comparable model are left out
+    observed = ~np.isnan(deviations).all(axis=0)
+    result_df = pd.DataFrame({'Residue': residues[observed].astype(str), 'Amino_Acid': residue_names[observed]})
+    for model, values in zip(models[1:], deviations[:, observed]):
+        result_df[f"RMSD:{model}"] = values
 
     # Sort the DataFrame by Residue using the custom sorting function
     sorted_residues = sort_residues(result_df['Residue'].unique())
@@ -74,15 +71,126 @@ def process_excel_file(file_path):
 
     # Calculate the mean RMSD for each residue across all models
     result_df['Mean_RMSD'] = result_df.loc[:, [col for col in result_df.columns if col.startswith('RMSD:')]].mean(axis=1)
+    return result_df
+
+# Function to process each Excel file
+def process_excel_file(file_path, output_dir):
+    # Read the Excel file
+    df = pd.read_excel(file_path)
+
+    # Identify the reference model (assuming it's the first model in the file)
+    reference_model = df['model'].iloc[0]
+    print(f"Using {reference_model} as the reference model")
+
+    # Distances of every CA to the reference CA, for all models and residues at once
+    result_df = rmsd_table(df, 'CA', reference_model)
 
     # Save the results to a CSV file
     protein_name = os.path.splitext(os.path.basename(file_path))[0].replace('_coord', '')
-    output_file = os.path.join(output_dir, f"results_mean_RMSD_{protein_name}.csv")
+    output_file = os.path.join(output_dir, rmsd_output_name(file_path))
     result_df.to_csv(output_file, index=False)
 
     print(f"RMSD calculation completed for {protein_name} and results saved to {output_file}")
 
-# Process all Excel files in the directory
-for file in os.listdir(coord_dir):
-    if file.endswith("_coord.xlsx"):
-        process_excel_file(os.path.join(coord_dir, file))
+def chain_ca_coordinates(pdb_path):
+    """
+    CA atoms of the standard residues of the first model of a chain PDB.
+
+    Returns:
+    - tuple: (residue numbers, residue names, (n, 3) coordinates), sorted by residue number,
+      first residue kept when a number repeats.
+    """
+    structure = get_structure(pdb_path)
+    residues = structure.residue_mask(standard_only=True)
+    is_ca = (structure.atom_name == 'CA') & residues[structure.residue_index] & structure.occupancy_atom_mask()
+    residue = structure.residue_index[is_ca]
+    resnums, first = np.unique(structure.res_resnum[residue], return_index=True)
+    return resnums, structure.res_resname[residue][first], structure.coords[is_ca][first]
+
+def lookup_coordinates(resnums, table):
+    """Coordinates of `resnums` in a chain_ca_coordinates table, NaN for residues without a CA."""
+    table_resnums, _, coords = table
+    position = np.clip(np.searchsorted(table_resnums, resnums), 0, max(len(table_resnums) - 1, 0))
+    found = (table_resnums[position] == resnums) if len(table_resnums) else np.zeros(len(resnums), dtype=bool)
+    result = np.full((len(resnums), 3), np.nan)
+    result[found] = coords[position[found]]
+    return result
+
+def superposition_output_name(family):
+    return f"{family}_superposition_rmsd.csv"
+
+def process_family(mapping_path, pdb_dir, output_dir, family, trim_cutoff=None, max_iterations=5):
+    """
+    Per-residue and global RMSD of every mapped target after superposition onto its reference.
+
+    CA pairs come from the per-family residue mapping file, so residues are matched through
+    the TM-align alignment. All pairs are padded to a common length and fitted in one batch.
+    Writes `results_mean_RMSD_<family>.csv` (RMSD:<target> columns per reference residue and
+    Mean_RMSD) and `<family>_superposition_rmsd.csv` (one row of global values per pair).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    mappings = load_family_mappings(mapping_path)
+    offsets = mappings['offsets']
+    targets = [os.path.splitext(str(target))[0] for target in mappings['target']]
+    references = [str(reference) for reference in mappings['reference']]
+    n_pairs = len(targets)
+    length = int(np.diff(offsets).max()) if n_pairs else 0
+
+    tables = {name: chain_ca_coordinates(os.path.join(pdb_dir, name))
+              for name in dict.fromkeys([*references, *mappings['target'].tolist()])}
+    mobile = np.zeros((n_pairs, length, 3))
+    reference = np.zeros((n_pairs, length, 3))
+    ref_resnums = np.zeros((n_pairs, length), dtype=np.int64)
+    for pair in range(n_pairs):
+        start, end = offsets[pair], offsets[pair + 1]
+        ref_resnums[pair, :end - start] = mappings['ref_resnum'][start:end]
+        reference[pair, :end - start] = lookup_coordinates(mappings['ref_resnum'][start:end], tables[references[pair]])
+        mobile[pair, :end - start] = lookup_coordinates(mappings['target_resnum'][start:end], tables[str(mappings['target'][pair])])
+    present = ~(np.isnan(mobile).any(axis=2) | np.isnan(reference).any(axis=2))
+    deviations, fitted = superposition_deviations(mobile, reference, present, trim_cutoff, max_iterations)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        summary_df = pd.DataFrame({
+            'Target': targets,
+            'Reference': [os.path.splitext(name)[0] for name in references],
+            'AlignedResidues': present.sum(axis=1),
+            'FittedResidues': fitted.sum(axis=1),
+            'RMSD': np.sqrt(np.nansum(deviations ** 2, axis=1) / present.sum(axis=1)),
+            'CoreRMSD': np.sqrt(np.nansum(np.where(fitted, deviations, 0.0) ** 2, axis=1) / fitted.sum(axis=1)),
+        })
+
+    # Per-residue table on the reference numbering, one column per target
+    residues = np.unique(ref_resnums[present])
+    columns = np.full((n_pairs, len(residues)), np.nan)
+    pair_index, position = np.nonzero(present)
+    columns[pair_index, np.searchsorted(residues, ref_resnums[pair_index, position])] = deviations[pair_index, position]
+    reference_table = tables[references[0]] if n_pairs else (np.zeros(0, dtype=int), np.zeros(0, dtype=object), None)
+    names = dict(zip(reference_table[0].tolist(), reference_table[1].tolist()))
+    result_df = pd.DataFrame({'Residue': residues, 'Amino_Acid': [names.get(r) for r in residues.tolist()]})
+    for target, values in zip(targets, columns):
+        result_df[f"RMSD:{target}"] = values
+    result_df['Mean_RMSD'] = result_df.loc[:, [col for col in result_df.columns if col.startswith('RMSD:')]].mean(axis=1)
+
+    output_file = os.path.join(output_dir, rmsd_output_name(family))
+    summary_file = os.path.join(output_dir, superposition_output_name(family))
+    result_df.to_csv(output_file, index=False)
+    summary_df.to_csv(summary_file, index=False)
+    print(f"Superposition RMSD completed for {n_pairs} pair(s) of {family}; results saved to {output_file} and {summary_file}")
+    return output_file, summary_file
+
+def process_rmsd_files(coord_dir, output_dir):
+    # Ensure the output directory exists
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    # Process all Excel files in the directory
+    for file in os.listdir(coord_dir):
+        if file.endswith("_coord.xlsx"):
+            process_excel_file(os.path.join(coord_dir, file), output_dir)
+
+if __name__ == "__main__":
+    # Directory containing the Excel coordinate files
+    coord_dir = ""  # Replace with your directory path
+    output_dir = ""  # Replace with your desired output directory
+
+    process_rmsd_files(coord_dir, output_dir)
@@ -0,0 +1,150 @@
+"""
+In-process RMSD pre-screen of TM-align pairs.
+
+Most pairs sent to TM-align against a family reference are only discarded
+afterwards because their RMSD exceeds the cutoff. The screen estimates that RMSD
+without the external tool: the sequences of both chains are aligned (global
+alignment with free end gaps), the CA atoms of the aligned residues are superposed
+with Kabsch, and the fit is repeated on the core of residue pairs within
+TM-align's length-dependent cutoff d8, as TM-align computes its reported RMSD
+over those pairs only. Pairs whose estimate
+exceeds the cutoff by more than a margin are rejected before TM-align runs; pairs
+whose sequence alignment is too short or too dissimilar to judge are passed on.
+"""
+import hashlib
+import numpy as np
+from structure_store import get_structure
+from superposition import superposition_deviations
+
+# Pairs are rejected when the estimate exceeds the RMSD cutoff by more than this (Angstrom).
+# A larger margin skips fewer TM-align runs and rejects fewer pairs that would have passed
+SCREEN_MARGIN = 1.0
+
+# Pairs are only judged when at least this many residues align, with this fraction identical
+MIN_ALIGNED = 10
+MIN_IDENTITY = 0.3
+
+# Sequence alignment scores: identical and different residues, and the penalty per gap position
+MATCH_SCORE = 2
+MISMATCH_SCORE = -1
+GAP_PENALTY = 2
+
+SCREEN_COLUMNS = ['ScreenRMSD', 'ScreenIdentity', 'ScreenDecision']
+
+def ca_trace(pdb_path):
+    """One-letter sequence and (n, 3) CA coordinates of the standard residues with a CA atom, first model."""
+    structure = get_structure(pdb_path)
+    residues = structure.residue_mask(standard_only=True)
+    is_ca = (structure.atom_name == 'CA') & residues[structure.residue_index] & structure.occupancy_atom_mask()
+    residue, first = np.unique(structure.residue_index[is_ca], return_index=True)
+    return ''.join(structure.res_code[residue]), structure.coords[is_ca][first].astype(float)
+
+def align_sequences(sequence_1, sequence_2, match=MATCH_SCORE, mismatch=MISMATCH_SCORE, gap=GAP_PENALTY):
+    """
+    Global alignment with free end gaps and a linear gap penalty.
+
+    Each row of the dynamic programming matrix is one set of whole-array operations: gaps
+    along the row are resolved with a running maximum, so only the rows are a Python loop.
+
+    Returns:
+    - tuple: Index arrays into `sequence_1` and `sequence_2` of the aligned residue pairs.
+    """
+    a = np.frombuffer(sequence_1.encode(), dtype=np.uint8)
+    b = np.frombuffer(sequence_2.encode(), dtype=np.uint8)
+    n, m = len(a), len(b)
+    if not n or not m:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    # End gaps are free, so the first row and column stay 0
+    scores = np.zeros((n + 1, m + 1), dtype=np.int32)
+    # 0: aligned pair, 1: gap in sequence_2, 2: gap in sequence_1
+    moves = np.zeros((n + 1, m + 1), dtype=np.int8)
+    offsets = gap * np.arange(m + 1)
+    for i in range(1, n + 1):
+        diagonal = scores[i - 1, :-1] + np.where(b == a[i - 1], match, mismatch)
+        up = scores[i - 1, 1:] - gap
+        best = np.maximum(diagonal, up)
+        scores[i] = np.maximum.accumulate(np.concatenate(([0], best)) + offsets) - offsets
+        moves[i, 1:] = np.where(scores[i, 1:] > best, 2, np.where(diagonal >= up, 0, 1))
+
+    if scores[n].max() >= scores[:, m].max():
+        i, j = n, int(scores[n].argmax())
+    else:
+        i, j = int(scores[:, m].argmax()), m
+    pairs = []
+    while i > 0 and j > 0:
+        move = moves[i, j]
+        if move == 0:
+            pairs.append((i - 1, j - 1))
+            i, j = i - 1, j - 1
+        elif move == 1:
+            i -= 1
+        else:
+            j -= 1
+    pairs = np.array(pairs[::-1], dtype=int).reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1]
+
+def core_cutoff(length):
+    """TM-align's d8 (Angstrom) for chains of `length` residues: aligned pairs farther apart are not in its RMSD."""
+    return 1.5 * length ** 0.3 + 3.5
+
+def estimate_rmsd(mobile, reference, cutoff=None):
+    """
+    RMSD estimate of a pair of `ca_trace`s over the superposed core of pairs within
+    `cutoff` (default: `core_cutoff` of the shorter chain).
+
+    Returns:
+    - dict: ScreenRMSD (NaN with fewer than MIN_ALIGNED aligned residues), ScreenIdentity
+      (identical fraction of the aligned residues) and AlignedLength.
+    """
+    (sequence_1, ca_1), (sequence_2, ca_2) = mobile, reference
+    index_1, index_2 = align_sequences(sequence_1, sequence_2)
+    codes_1 = np.frombuffer(sequence_1.encode(), dtype=np.uint8)[index_1]
+    codes_2 = np.frombuffer(sequence_2.encode(), dtype=np.uint8)[index_2]
+    estimate = {'ScreenRMSD': np.nan, 'ScreenIdentity': float(np.mean(codes_1 == codes_2)) if len(index_1) else 0.0,
+                'AlignedLength': len(index_1)}
+    if len(index_1) >= MIN_ALIGNED:
+        present = np.ones((1, len(index_1)), dtype=bool)
+        cutoff = cutoff or core_cutoff(min(len(sequence_1), len(sequence_2)))
+        deviations, core = superposition_deviations(ca_1[index_1][None], ca_2[index_2][None], present,
+                                                    trim_cutoff=cutoff)
+        estimate['ScreenRMSD'] = float(np.sqrt(np.mean(deviations[core] ** 2)))
+    return estimate
+
+def screen_pair(mobile, reference, max_rmsd, margin=SCREEN_MARGIN, min_identity=MIN_IDENTITY):
+    """
+    Screen decision of a pair of `ca_trace`s against an RMSD cutoff.
+
+    Returns:
+    - dict: ScreenRMSD, ScreenIdentity and ScreenDecision, which is 'reject' when the
+      estimate exceeds `max_rmsd + margin`, 'pass' when it does not, and 'unjudged' when
+      the sequence alignment is too short or below `min_identity`.
+    """
+    estimate = estimate_rmsd(mobile, reference)
+    if estimate['AlignedLength'] < MIN_ALIGNED or estimate['ScreenIdentity'] < min_identity:
+        decision = 'unjudged'
+    else:
+        decision = 'reject' if estimate['ScreenRMSD'] > max_rmsd + margin else 'pass'
+    return {'ScreenRMSD': estimate['ScreenRMSD'], 'ScreenIdentity': estimate['ScreenIdentity'],
+            'ScreenDecision': decision}
+
+def audited(name, fraction):
+    """Whether a rejected pair belongs to the audit sample; the same `fraction` of names is picked on every run."""
+    if fraction <= 0:
+        return False
+    return int(hashlib.sha256(name.encode()).hexdigest()[:8], 16) < fraction * 16 ** 8
+
+def screen_summary(results, max_rmsd):
+    """
+    Screen decisions of a TM-align result table.
+
+    Rejected pairs of the audit sample were aligned anyway; those whose TM-align RMSD is
+    within `max_rmsd` are false rejects.
+
+    Returns:
+    - dict: Numbers of judged, rejected, audited and falsely rejected pairs.
+    """
+    decisions = results['ScreenDecision']
+    rejected = results[decisions == 'reject']
+    audit = rejected[rejected['Status'] == 'ok']
+    return {'judged': int(decisions.isin(['pass', 'reject']).sum()), 'rejected': len(rejected),
+            'audited': len(audit), 'false_rejects': int((audit['RMSD'] <= max_rmsd).sum())}
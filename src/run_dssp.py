@@ -1,34 +1,84 @@
 import os
+import re
+import shutil
+import tempfile
 import pandas as pd
 import warnings
-from Bio.PDB import PDBParser, DSSP
+from concurrent.futures import ThreadPoolExecutor
+from cache import tool_version
+from asa_extraction import parse_dssp, model_dssp_dir
+from structure_store import iter_model_blocks
+from tool_executor import run_tool
+import family_store
+
+# Family store tables: the parse_dssp table of every chain, and the SS class percentages
+STORE_TABLE = 'dssp'
+COMPOSITION_TABLE = 'ss_composition'
 
 # Suppress specific warnings
 warnings.filterwarnings('ignore', message="Ignoring unrecognized record 'TER'")
 warnings.filterwarnings('ignore', message="DSSP could not be created due to an error")
 
-def run_dssp(pdb_file, dssp_executable):
-    p = PDBParser(QUIET=True)
+def run_dssp(pdb_file, dssp_executable, timeout=None):
+    # mkdssp runs on the shared tool executor; Bio.PDB only parses its output
+    from Bio.PDB.DSSP import make_dssp_dict
+    dssp_file = run_mkdssp(pdb_file, os.path.join(tempfile.mkdtemp(), dssp_output_name(pdb_file)), dssp_executable,
+                           timeout or DSSP_TIMEOUT)
+    if dssp_file is None:
+        return None
     try:
-        structure = p.get_structure('X', pdb_file)
-        model = structure[0]  # Assuming first model
-        dssp = DSSP(model, pdb_file, dssp=dssp_executable)
+        dssp, keys = make_dssp_dict(dssp_file)
         return dssp
     except Exception as e:
         print(f"Error processing {pdb_file}: {e}")
         return None
+    finally:
+        shutil.rmtree(os.path.dirname(dssp_file), ignore_errors=True)
+
+# Seconds before a single mkdssp run is killed
+DSSP_TIMEOUT = 300
+
+def dssp_command(pdb_file, dssp_executable):
+    # mkdssp 4.x writes mmCIF unless the classic format is requested
+    version = tool_version(dssp_executable) or "3.9.9"
+    match = re.match(r"(\d+)", version)
+    if match and int(match.group(1)) >= 4:
+        return [dssp_executable, "--output-format=dssp", pdb_file]
+    return [dssp_executable, pdb_file]
+
+def dssp_output_name(pdb_file_path):
+    return f"{os.path.splitext(os.path.basename(pdb_file_path))[0]}.dssp"
+
+def run_mkdssp(pdb_file, dssp_file, dssp_executable, timeout=DSSP_TIMEOUT, retries=0):
+    """
+    Run mkdssp once on the shared tool executor and keep its classic-format output as `dssp_file`.
+
+    Returns the path of the written file, or None if mkdssp failed or timed out.
+    """
+    result = run_tool('mkdssp', dssp_command(pdb_file, dssp_executable), timeout=timeout, retries=retries,
+                      accept=lambda output: bool(output.strip()))
+    if result['status'] != 'ok':
+        print(f"Error processing {pdb_file}: {result['error']}")
+        return None
+    with open(dssp_file + '.tmp', 'w') as f:
+        f.write(result['stdout'])
+    os.replace(dssp_file + '.tmp', dssp_file)
+    return dssp_file
+
+SS_CLASSES = {
+    'H': 'Helix', 'B': 'Beta Strand', 'E': 'Beta Strand',
+    'G': 'Helix', 'I': 'Helix', 'T': 'Turn', 'S': 'Coil', ' ': 'Coil'
+}
 
 def parse_dssp_data(dssp):
-    ss_map = {
-        'H': 'Helix', 'B': 'Beta Strand', 'E': 'Beta Strand', 
-        'G': 'Helix', 'I': 'Helix', 'T': 'Turn', 'S': 'Coil', ' ': 'Coil'
-    }
+    ss_map = SS_CLASSES
     ss_counts = {'Helix': 0, 'Beta Strand': 0, 'Turn': 0, 'Coil': 0}
     results = []
     
+    # Values are (aa, ss, acc, phi, psi, ...) tuples keyed by (chain, residue id)
     for key in dssp.keys():
-        aa = dssp[key][1]
-        ss = ss_map.get(dssp[key][2], 'Coil')
+        aa = dssp[key][0]
+        ss = ss_map.get(dssp[key][1], 'Coil')
         resnum = key[1][1]
         results.append({'ResidueNumber': resnum, 'AminoAcid': aa, 'SecondaryStructure': ss})
         ss_counts[ss] += 1
@@ -38,33 +88,133 @@ def parse_dssp_data(dssp):
     
     return results, ss_percentages
 
-def process_pdb_files(input_directory, output_directory, dssp_executable):
+def summarize_secondary_structure(residues):
+    """SS class per residue and class percentages from a parse_dssp table."""
+    ss = residues['SecondaryStructure'].map(SS_CLASSES).fillna('Coil')
+    df_results = pd.DataFrame({'ResidueNumber': residues['ResidueNumber'], 'AminoAcid': residues['AminoAcid'],
+                               'SecondaryStructure': ss})
+    counts = ss.value_counts().reindex(['Helix', 'Beta Strand', 'Turn', 'Coil'], fill_value=0)
+    ss_percentages = (counts / max(len(ss), 1) * 100).to_dict()
+    return df_results, ss_percentages
+
+def ss_output_name(pdb_file_path):
+    return f"SS_{os.path.splitext(os.path.basename(pdb_file_path))[0]}.csv"
+
+def residue_output_name(pdb_file_path):
+    return f"DSSP_{os.path.splitext(os.path.basename(pdb_file_path))[0]}.csv"
+
+def process_pdb_file(pdb_file_path, output_directory, dssp_executable, timeout=DSSP_TIMEOUT):
+    """
+    Run mkdssp once for a chain and derive every DSSP product from its cached output.
+
+    Writes `<name>.dssp` (raw output, also read by the ASA stage), `SS_<name>.csv`
+    (secondary structure and percentages) and `DSSP_<name>.csv` (the parse_dssp table:
+    per-residue SS, ASA, relative ASA, H-bond energies and backbone angles).
+    """
+    protein_name = os.path.splitext(os.path.basename(pdb_file_path))[0]
+    output_file = os.path.join(output_directory, ss_output_name(pdb_file_path))
+
+    dssp_file = run_mkdssp(pdb_file_path, os.path.join(output_directory, dssp_output_name(pdb_file_path)),
+                           dssp_executable, timeout)
+    if dssp_file is not None:
+        residues = parse_dssp(dssp_file)
+        df_results, ss_percentages = summarize_secondary_structure(residues)
+        
+        # Save results to CSV
+        df_ss_percentages = pd.DataFrame.from_dict(ss_percentages, orient='index', columns=['Percentage']).reset_index()
+        df_ss_percentages = df_ss_percentages.rename(columns={'index': 'SecondaryStructure'})
+        
+        # Writing both results and percentages into the CSV
+        with open(output_file, 'w') as f:
+            df_results.to_csv(f, index=False)
+            f.write("\n\nSecondary Structure Percentages\n")
+            df_ss_percentages.to_csv(f, index=False)
+        residues.to_csv(os.path.join(output_directory, residue_output_name(pdb_file_path)), index=False)
+        
+        print(f"DSSP analysis completed for {protein_name}. Results saved to {output_file}.")
+    else:
+        print(f"Failed to process {pdb_file_path}: DSSP failed to produce an output.")
+
+def run_model_mkdssp(pdb_file_path, output_directory, dssp_executable, timeout=DSSP_TIMEOUT, workers=None):
+    """
+    Run mkdssp on every model of an NMR or MD ensemble file.
+
+    MODEL blocks are streamed one at a time into single-model temporary PDB files, so the
+    ensemble is never held in memory, and up to `workers` of them wait on the shared tool
+    executor at once. Model 0 is written to `<name>.dssp` as for a single-model chain,
+    model k to `<k>.dssp` in asa_extraction.model_dssp_dir; outputs left by a previous run
+    are removed first.
+
+    Returns:
+    - list: (model ID, output path or None if mkdssp failed), by model.
+    """
+    dssp_file = os.path.join(output_directory, dssp_output_name(pdb_file_path))
+    model_dir = model_dssp_dir(dssp_file)
+    shutil.rmtree(model_dir, ignore_errors=True)
+    temp_dir = tempfile.mkdtemp()
+    jobs = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+            for model, records in iter_model_blocks(pdb_file_path):
+                model_pdb = os.path.join(temp_dir, f"model_{model}.pdb")
+                with open(model_pdb, 'wb') as f:
+                    f.write(b'\n'.join(records) + b'\nEND\n')
+                if model:
+                    os.makedirs(model_dir, exist_ok=True)
+                output = os.path.join(model_dir, f"{model}.dssp") if model else dssp_file
+                jobs.append((model, pool.submit(run_mkdssp, model_pdb, output, dssp_executable, timeout)))
+            return [(model, job.result()) for model, job in jobs]
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def store_pdb_file(pdb_file_path, output_directory, residue_store, composition_store, dssp_executable,
+                   timeout=DSSP_TIMEOUT, ensemble=False):
+    """
+    Run mkdssp once for a chain and append its products to the family store.
+
+    The raw `<name>.dssp` output is still written to `output_directory` for the ASA stage.
+    The parse_dssp table, with the SS class of every residue as SecondaryStructureClass,
+    goes to `residue_store` and the class percentages to `composition_store`, both keyed
+    by the Structure name and with the Model ID of each row. With `ensemble=True` mkdssp
+    runs once per model (see `run_model_mkdssp`); if any model fails, nothing is stored.
+    """
+    name = os.path.splitext(os.path.basename(pdb_file_path))[0]
+    if ensemble:
+        outputs = run_model_mkdssp(pdb_file_path, output_directory, dssp_executable, timeout)
+    else:
+        shutil.rmtree(model_dssp_dir(os.path.join(output_directory, dssp_output_name(pdb_file_path))), ignore_errors=True)
+        outputs = [(0, run_mkdssp(pdb_file_path, os.path.join(output_directory, dssp_output_name(pdb_file_path)),
+                                  dssp_executable, timeout))]
+    if not outputs or any(dssp_file is None for _, dssp_file in outputs):
+        for store in (residue_store, composition_store):
+            family_store.remove_source(store, name)
+        print(f"Failed to process {pdb_file_path}: DSSP failed to produce an output.")
+        return None
+
+    residue_tables, compositions = [], []
+    for model, dssp_file in outputs:
+        residues = parse_dssp(dssp_file)
+        df_results, ss_percentages = summarize_secondary_structure(residues)
+        residues.insert(0, 'Structure', name)
+        residues.insert(1, 'Model', model)
+        residues.insert(7, 'SecondaryStructureClass', df_results['SecondaryStructure'].to_numpy())
+        residue_tables.append(residues)
+        compositions.append(pd.DataFrame({'Structure': name, 'Model': model, 'SecondaryStructure': list(ss_percentages),
+                                          'Percentage': list(ss_percentages.values())}))
+    family_store.append_table(residue_store, pd.concat(residue_tables, ignore_index=True), source=name)
+    family_store.append_table(composition_store, pd.concat(compositions, ignore_index=True), source=name)
+    print(f"DSSP analysis completed for {name} ({len(outputs)} model(s)). Results stored in {residue_store}.")
+    return outputs[0][1]
+
+def process_pdb_files(input_directory, output_directory, dssp_executable, workers=None, timeout=DSSP_TIMEOUT):
+    """Run DSSP for every PDB file, with at most `workers` mkdssp processes at a time."""
     os.makedirs(output_directory, exist_ok=True)
 
-    for filename in os.listdir(input_directory):
-        if filename.endswith(".pdb"):
-            pdb_file_path = os.path.join(input_directory, filename)
-            protein_name = os.path.splitext(filename)[0]
-            output_file = os.path.join(output_directory, f"SS_{protein_name}.csv")
-            
-            dssp = run_dssp(pdb_file_path, dssp_executable)
-            if dssp is not None:
-                results, ss_percentages = parse_dssp_data(dssp)
-                
-                # Save results to CSV
-                df_results = pd.DataFrame(results)
-                df_ss_percentages = pd.DataFrame.from_dict(ss_percentages, orient='index', columns=['Percentage']).reset_index()
-                df_ss_percentages = df_ss_percentages.rename(columns={'index': 'SecondaryStructure'})
-                
-                # Writing both results and percentages into the CSV
-                with open(output_file, 'w') as f:
-                    df_results.to_csv(f, index=False)
-                    f.write("\n\nSecondary Structure Percentages\n")
-                    df_ss_percentages.to_csv(f, index=False)
-                
-                print(f"DSSP analysis completed for {protein_name}. Results saved to {output_file}.")
-            else:
-                print(f"Failed to process {pdb_file_path}: DSSP failed to produce an output.")
+    pdb_files = [os.path.join(input_directory, filename) for filename in sorted(os.listdir(input_directory))
+                 if filename.endswith(".pdb")]
+    # Threads wait on jobs of the shared tool executor and parse their output
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        list(pool.map(lambda path: process_pdb_file(path, output_directory, dssp_executable, timeout), pdb_files))
 
 if __name__ == "__main__":
     input_directory = "/mnt/"  # Update with your PDB files directory
@@ -1,18 +1,26 @@
 import os
-import subprocess
 import re
-
-# Directory setup
-pdb_dir = "/mnt/"  # Your PDB files directory
-output_dir = "/mnt/"
-reference_pdb_name = ".pdb"  # Name of the reference PDB file
-
-# Make sure output directory exists
-os.makedirs(output_dir, exist_ok=True)
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from cache import file_digest, tool_version
+from tool_executor import run_tool
+import rmsd_prescreen
+from tm_align_results import load_results
 
 # Path to TM-align executable
 tm_align_path = "/usr/local/bin/TMalign"
 
+# Pairs with a TM-align RMSD above this cutoff are discarded
+MAX_RMSD = 3.0
+
+# Seconds before a TM-align run is killed, and extra attempts after a failed run
+TM_ALIGN_TIMEOUT = 300
+TM_ALIGN_RETRIES = 2
+
+RECORD_COLUMNS = ['Mobile', 'Reference', 'Status', 'Error', 'Length1', 'Length2', 'AlignedLength',
+                  'RMSD', 'SeqID', 'TMScore1', 'TMScore2', 'Seq1', 'Markers', 'Seq2',
+                  'MobileSHA256', 'ReferenceSHA256', 'ToolVersion', *rmsd_prescreen.SCREEN_COLUMNS, 'Passed']
+
 # Function to parse RMSD from TM-align output
 def parse_rmsd(output):
     match = re.search(r"RMSD=\s+(\d+\.\d+)", output)
@@ -20,31 +28,208 @@ def parse_rmsd(output):
         return float(match.group(1))
     return None
 
-# Run TM-align for each PDB file against the reference and save the output if RMSD <= 3
-reference_pdb_path = os.path.join(pdb_dir, reference_pdb_name)
+def _search(pattern, text, cast=float):
+    match = re.search(pattern, text)
+    return cast(match.group(1)) if match else None
+
+def parse_tm_output(output):
+    """
+    Parse TM-align stdout into a record.
+
+    Returns a dict with the chain lengths, aligned length, RMSD, sequence identity,
+    the TM-scores normalized by Chain_1 and by Chain_2, and the three alignment
+    lines (Chain_1 sequence, markers, Chain_2 sequence) with their spacing intact.
+    """
+    record = {
+        'Length1': _search(r"Length of Chain_1:\s*(\d+)", output, int),
+        'Length2': _search(r"Length of Chain_2:\s*(\d+)", output, int),
+        'AlignedLength': _search(r"Aligned length=\s*(\d+)", output, int),
+        'RMSD': parse_rmsd(output),
+        'SeqID': _search(r"Seq_ID=n_identical/n_aligned=\s*(\d+\.\d+)", output),
+        'TMScore1': _search(r"TM-score=\s*(\d+\.\d+)\s*\(if normalized by length of Chain_1", output),
+        'TMScore2': _search(r"TM-score=\s*(\d+\.\d+)\s*\(if normalized by length of Chain_2", output),
+        'Seq1': '', 'Markers': '', 'Seq2': '',
+    }
+    lines = output.splitlines()
+    for i, line in enumerate(lines):
+        if "denotes residue pairs" in line or "denotes other aligned residues" in line:
+            alignment = lines[i + 1:i + 4]
+            if len(alignment) == 3:
+                record['Seq1'], record['Markers'], record['Seq2'] = alignment
+            break
+    return record
+
+def align_pair(pdb_path, reference_pdb_path, tm_align_path=tm_align_path, timeout=TM_ALIGN_TIMEOUT,
+               retries=TM_ALIGN_RETRIES, backoff=1.0):
+    """
+    Run TM-align for one pair on the shared tool executor, with a timeout and retries of
+    failed runs with exponential backoff.
+
+    Returns:
+    - dict: A result record; Status is 'ok', 'timeout' or 'error'.
+    """
+    record = {'Mobile': os.path.basename(pdb_path), 'Reference': os.path.basename(reference_pdb_path)}
+    result = run_tool('TMalign', [tm_align_path, pdb_path, reference_pdb_path], timeout=timeout, retries=retries,
+                      backoff=backoff, accept=lambda output: parse_tm_output(output)['RMSD'] is not None)
+    if result['status'] != 'ok':
+        record.update(Status=result['status'], Error=result['error'])
+        return record
+    record.update(parse_tm_output(result['stdout']), Status='ok', Error='')
+    return record
+
+def align_screened_pair(pdb_path, reference_pdb_path, tm_align_path=tm_align_path, timeout=TM_ALIGN_TIMEOUT,
+                        retries=TM_ALIGN_RETRIES, max_rmsd=MAX_RMSD, screen_margin=rmsd_prescreen.SCREEN_MARGIN,
+                        screen_audit=0.0, reference_trace=None):
+    """
+    `align_pair` behind the RMSD pre-screen of rmsd_prescreen.
+
+    Pairs the screen rejects get Status 'screened' without running TM-align, except the
+    `screen_audit` fraction of them picked by rmsd_prescreen.audited, which are aligned
+    anyway so false rejects can be counted. The screen columns are added to every record;
+    with `screen_margin=None` the screen is off and every pair is aligned.
+    """
+    if screen_margin is None:
+        return align_pair(pdb_path, reference_pdb_path, tm_align_path, timeout, retries)
+    screen = rmsd_prescreen.screen_pair(rmsd_prescreen.ca_trace(pdb_path),
+                                        reference_trace or rmsd_prescreen.ca_trace(reference_pdb_path),
+                                        max_rmsd, screen_margin)
+    mobile = os.path.basename(pdb_path)
+    if screen['ScreenDecision'] == 'reject' and not rmsd_prescreen.audited(mobile, screen_audit):
+        record = {'Mobile': mobile, 'Reference': os.path.basename(reference_pdb_path), 'Status': 'screened',
+                  'Error': f"estimated RMSD {screen['ScreenRMSD']:.2f} > {max_rmsd} + {screen_margin}"}
+    else:
+        record = align_pair(pdb_path, reference_pdb_path, tm_align_path, timeout, retries)
+    record.update(screen)
+    return record
+
+def results_file_name(family):
+    return f"{family}_tm_align.csv"
+
+def run_tm_align(pdb_dir, output_dir, reference_pdb_name, tm_align_path=tm_align_path, family=None,
+                 workers=None, timeout=TM_ALIGN_TIMEOUT, retries=TM_ALIGN_RETRIES, max_rmsd=MAX_RMSD,
+                 screen_margin=rmsd_prescreen.SCREEN_MARGIN, screen_audit=0.0):
+    """
+    Align every PDB file in `pdb_dir` against the reference, keeping `workers` TM-align
+    processes in flight, and write all records to `<family>_tm_align.csv`.
 
-for pdb_file in os.listdir(pdb_dir):
-    if pdb_file == reference_pdb_name or not pdb_file.endswith(".pdb"):
-        continue
-    
+    Pairs whose RMSD the pre-screen estimates above `max_rmsd + screen_margin` are not
+    aligned; see `align_screened_pair`. Records from a previous run are reused when both
+    input files and the TM-align version are unchanged, so only new or modified structures
+    are screened and aligned again.
+    """
+    # Make sure output directory exists
+    os.makedirs(output_dir, exist_ok=True)
+    family = family or os.path.basename(os.path.normpath(pdb_dir))
+    results_path = os.path.join(output_dir, results_file_name(family))
+    reference_pdb_path = os.path.join(pdb_dir, reference_pdb_name)
+    reference_sha = file_digest(reference_pdb_path)
+    version = tool_version(tm_align_path, args=()) or 'unknown'
+
+    previous = {}
+    if os.path.exists(results_path):
+        for record in load_results(results_path).to_dict('records'):
+            if record['Status'] == 'ok':
+                previous[(record['Mobile'], record['MobileSHA256'], record['ReferenceSHA256'], record['ToolVersion'])] = record
+
+    records, to_align = [], []
+    for pdb_file in pair_mobiles(pdb_dir, reference_pdb_name):
+        pdb_path = os.path.join(pdb_dir, pdb_file)
+        mobile_sha = file_digest(pdb_path)
+        cached = previous.get((pdb_file, mobile_sha, reference_sha, version))
+        if cached is not None:
+            records.append(cached)
+        else:
+            to_align.append((pdb_path, mobile_sha))
+    print(f"{'Screening and aligning' if screen_margin is not None else 'Running TM-align for'} "
+          f"{len(to_align)} pair(s), {len(records)} reused")
+    reference_trace = rmsd_prescreen.ca_trace(reference_pdb_path) if screen_margin is not None and to_align else None
+
+    # Threads only wait on jobs of the shared tool executor, which enforces the process budget;
+    # `workers` caps the jobs this call has in flight
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        futures = [(pool.submit(align_screened_pair, pdb_path, reference_pdb_path, tm_align_path, timeout, retries,
+                                max_rmsd, screen_margin, screen_audit, reference_trace), mobile_sha)
+                   for pdb_path, mobile_sha in to_align]
+        for future, mobile_sha in futures:
+            record = future.result()
+            record.update(MobileSHA256=mobile_sha, ReferenceSHA256=reference_sha, ToolVersion=version)
+            if record['Status'] not in ('ok', 'screened'):
+                print(f"TM-align failed for {record['Mobile']}: {record['Error']}")
+            records.append(record)
+    return write_results(records, results_path, max_rmsd)
+
+def write_results(records, results_path, max_rmsd=MAX_RMSD):
+    """
+    Write TM-align records, with the Passed flag of the RMSD cutoff, as a per-family result file.
+
+    Pairs rejected by the pre-screen never pass, unless they were aligned for the audit.
+    """
+    results = pd.DataFrame(records, columns=RECORD_COLUMNS)
+    results['Passed'] = (results['Status'] == 'ok') & (results['RMSD'] <= max_rmsd)
+    results = results.sort_values('Mobile').reset_index(drop=True)
+    results.to_csv(results_path + '.tmp', index=False)
+    os.replace(results_path + '.tmp', results_path)
+    print(f"TM-align processing complete: {int(results['Passed'].sum())} of {len(results)} pair(s) "
+          f"with RMSD <= {max_rmsd}. Results saved to {results_path}")
+    screen = rmsd_prescreen.screen_summary(results, max_rmsd)
+    if screen['judged']:
+        print(f"Pre-screen rejected {screen['rejected']} of {screen['judged']} judged pair(s); "
+              f"{screen['false_rejects']} of {screen['audited']} audited reject(s) passed TM-align")
+    return results_path
+
+def pair_record_name(pdb_file):
+    return f"{os.path.splitext(os.path.basename(pdb_file))[0]}_tm_align.csv"
+
+def pair_mobiles(pdb_dir, reference_pdb_name):
+    """Chain files of `pdb_dir` aligned against the reference, in file name order."""
+    return [pdb_file for pdb_file in sorted(os.listdir(pdb_dir))
+            if pdb_file.endswith(".pdb") and pdb_file != reference_pdb_name]
+
+def align_pair_record(pdb_dir, record_dir, reference_pdb_name, pdb_file, tm_align_path=tm_align_path,
+                      timeout=TM_ALIGN_TIMEOUT, retries=TM_ALIGN_RETRIES, max_rmsd=MAX_RMSD,
+                      screen_margin=rmsd_prescreen.SCREEN_MARGIN, screen_audit=0.0):
+    """
+    Screen and align one chain against the reference and write its record to `record_dir`,
+    for work split into one item per pair; `merge_pair_records` builds the family result file.
+
+    A record from an earlier run is kept when both input files and the TM-align
+    version are unchanged.
+    """
+    os.makedirs(record_dir, exist_ok=True)
+    record_path = os.path.join(record_dir, pair_record_name(pdb_file))
     pdb_path = os.path.join(pdb_dir, pdb_file)
-    
-    cmd = [tm_align_path, pdb_path, reference_pdb_path]
-    
-    print(f"Running command: {' '.join(cmd)}")  # Debugging statement
-    
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    
-    print(f"TM-align output for {pdb_file}:\n{result.stdout}")  # Debugging statement
-    
-    rmsd = parse_rmsd(result.stdout)
-    
-    print(f"RMSD for {pdb_file}: {rmsd}")  # Debugging statement
-    
-    if rmsd is not None and rmsd <= 3.0:
-        output_file_path = os.path.join(output_dir, f"{os.path.splitext(pdb_file)[0]}_vs_{os.path.splitext(reference_pdb_name)[0]}.txt")
-        with open(output_file_path, 'w') as output_file:
-            output_file.write(result.stdout)
-        print(f"Output saved to: {output_file_path}")  # Debugging statement
-
-print("TM-align processing complete.")
+    reference_pdb_path = os.path.join(pdb_dir, reference_pdb_name)
+    key = {'MobileSHA256': file_digest(pdb_path), 'ReferenceSHA256': file_digest(reference_pdb_path),
+           'ToolVersion': tool_version(tm_align_path, args=()) or 'unknown'}
+    if os.path.exists(record_path):
+        previous = load_results(record_path).to_dict('records')
+        if previous and previous[0]['Status'] == 'ok' and all(previous[0][k] == v for k, v in key.items()):
+            return record_path
+
+    record = align_screened_pair(pdb_path, reference_pdb_path, tm_align_path, timeout, retries, max_rmsd,
+                                 screen_margin, screen_audit)
+    record.update(key)
+    if record['Status'] not in ('ok', 'screened'):
+        print(f"TM-align failed for {record['Mobile']}: {record['Error']}")
+    pd.DataFrame([record], columns=RECORD_COLUMNS[:-1]).to_csv(record_path + '.tmp', index=False)
+    os.replace(record_path + '.tmp', record_path)
+    return record_path
+
+def merge_pair_records(pdb_dir, record_dir, output_dir, reference_pdb_name, family, max_rmsd=MAX_RMSD):
+    """Combine the pair records of the current chains and reference into `<family>_tm_align.csv`."""
+    records = []
+    for pdb_file in pair_mobiles(pdb_dir, reference_pdb_name):
+        record_path = os.path.join(record_dir, pair_record_name(pdb_file))
+        if os.path.exists(record_path):
+            record = load_results(record_path).to_dict('records')[0]
+            if record['Reference'] == reference_pdb_name:
+                records.append(record)
+    return write_results(records, os.path.join(output_dir, results_file_name(family)), max_rmsd)
+
+if __name__ == "__main__":
+    # Directory setup
+    pdb_dir = "/mnt/"  # Your PDB files directory
+    output_dir = "/mnt/"
+    reference_pdb_name = ".pdb"  # Name of the reference PDB file
+
+    run_tm_align(pdb_dir, output_dir, reference_pdb_name)
@@ -0,0 +1,180 @@
+"""
+Dependency-aware scheduler for the pipeline stages.
+
+Stages form a DAG. Once all dependencies of a stage have finished, the stage is
+expanded into independent work items (one per structure or per alignment pair)
+which are submitted to a shared process pool, so independent branches of the
+pipeline overlap instead of running one after another. With a `cache.Manifest`
+items whose inputs and parameters are unchanged are skipped. With hooks (see
+`tracing.Hook`) every item is measured in its worker and reported to the hooks.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from tracing import traced_call, item_label
+
+
+class Stage:
+    """
+    A pipeline stage.
+
+    Parameters:
+    - name (str): Unique stage name, used in `deps` of downstream stages.
+    - func (callable): Module-level function run once per work item.
+    - items (callable): Returns the argument tuples for `func`. It is called only
+      after the dependencies have finished, so it may list their outputs.
+      Defaults to a single call without arguments.
+    - deps (iterable): Names of the stages that must finish first.
+    - inputs (callable): Maps an item's arguments to the input files it reads.
+      Stages without `inputs` are never cached.
+    - outputs (callable): Maps an item's arguments to the files it writes. An item that
+      returns without writing all of them counts as failed.
+    - params (dict): Extra parameters that invalidate the cache when changed.
+    - shared_outputs (callable): Maps an item's arguments to files it appends to
+      together with other items (family store tables). They must exist for the item
+      to count as cached, but are never deleted when the item is re-run.
+    """
+
+    def __init__(self, name, func, items=None, deps=(), inputs=None, outputs=None, params=None, shared_outputs=None):
+        self.name = name
+        self.func = func
+        self.items = items if items is not None else (lambda: [()])
+        self.deps = tuple(deps)
+        self.inputs = inputs
+        self.outputs = outputs if outputs is not None else (lambda *args: [])
+        self.params = params or {}
+        self.shared_outputs = shared_outputs if shared_outputs is not None else (lambda *args: [])
+
+
+def topological_order(stages):
+    """Return stage names in dependency order, raising ValueError on unknown deps or cycles."""
+    by_name = {stage.name: stage for stage in stages}
+    for stage in stages:
+        for dep in stage.deps:
+            if dep not in by_name:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{dep}'")
+
+    order, visiting, visited = [], set(), set()
+
+    def visit(name):
+        if name in visited:
+            return
+        if name in visiting:
+            raise ValueError(f"Dependency cycle detected at stage '{name}'")
+        visiting.add(name)
+        for dep in by_name[name].deps:
+            visit(dep)
+        visiting.remove(name)
+        visited.add(name)
+        order.append(name)
+
+    for stage in stages:
+        visit(stage.name)
+    return order
+
+
+def run_stages(stages, workers=None, manifest=None, hooks=()):
+    """
+    Run the stages on a process pool with `workers` processes (default: CPU count).
+
+    A failing item, or one that did not write all its declared outputs, is reported and
+    counted but does not stop the run; downstream
+    stages simply see whatever outputs were produced, as with the serial pipeline.
+    If a manifest is given, still-valid items are skipped and completed ones recorded.
+    With `hooks`, items run through `tracing.traced_call` and the hooks receive
+    their measurements, the cache hits and the stage start and end.
+
+    Returns:
+    - dict: Per-stage counts of scheduled, cached and failed items.
+    """
+    by_name = {stage.name: stage for stage in stages}
+    order = topological_order(stages)
+    workers = workers or os.cpu_count() or 1
+
+    summary = {}
+    remaining = {}  # stage name -> number of items still running
+    finished = set()
+    pending = {}  # future -> (stage name, args, cache key)
+
+    def stage_done(name):
+        finished.add(name)
+        for hook in hooks:
+            hook.stage_finished(name, summary[name])
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+
+        def launch_ready():
+            launched = True
+            while launched:
+                launched = False
+                for name in order:
+                    if name in summary:
+                        continue
+                    stage = by_name[name]
+                    if not all(dep in finished for dep in stage.deps):
+                        continue
+                    items = list(stage.items())
+                    to_run, cached_items = [], []
+                    for args in items:
+                        key = None
+                        if manifest is not None and stage.inputs is not None:
+                            key = manifest.item_key(stage.func, args, stage.inputs(*args), stage.params)
+                            if manifest.is_valid(name, args, key):
+                                cached_items.append(args)
+                                continue
+                            manifest.invalidate(name, args)
+                        to_run.append((args, key))
+                    cached = len(cached_items)
+                    summary[name] = {'items': len(items), 'cached': cached, 'failed': 0}
+                    print(f"[{name}] Scheduling {len(to_run)} item(s), {cached} up to date")
+                    for hook in hooks:
+                        hook.stage_started(name, len(items), cached)
+                        for args in cached_items:
+                            hook.item_cached(name, item_label(args))
+                    if not to_run:
+                        stage_done(name)
+                        launched = True
+                        continue
+                    remaining[name] = len(to_run)
+                    intervals = [hook.sample_interval(name) for hook in hooks]
+                    interval = min((i for i in intervals if i), default=None)
+                    for args, key in to_run:
+                        if hooks:
+                            future = pool.submit(traced_call, stage.func, args, interval)
+                        else:
+                            future = pool.submit(stage.func, *args)
+                        pending[future] = (name, args, key)
+
+        launch_ready()
+        while pending:
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for future in done:
+                name, args, key = pending.pop(future)
+                error = future.exception()
+                if error is None:
+                    stage = by_name[name]
+                    outputs, shared = stage.outputs(*args), stage.shared_outputs(*args)
+                    if manifest is not None:
+                        missing = manifest.record(name, args, key, outputs, shared)
+                    else:
+                        missing = [path for path in [*outputs, *shared] if not os.path.exists(path)]
+                    if missing:
+                        error = FileNotFoundError(f"item did not write {', '.join(missing)}")
+                if error is not None:
+                    summary[name]['failed'] += 1
+                    print(f"[{name}] Item failed: {error!r}")
+                if hooks:
+                    raised = future.exception()
+                    trace = getattr(raised, 'trace', None) if raised is not None else future.result()
+                    for hook in hooks:
+                        hook.item_finished(name, item_label(args), trace, error)
+                remaining[name] -= 1
+                if remaining[name] == 0:
+                    stage_done(name)
+                    print(f"[{name}] Completed ({summary[name]['failed']} failed)")
+                    if manifest is not None:
+                        manifest.save()
+            launch_ready()
+
+    if manifest is not None:
+        manifest.save()
+    return summary
@@ -0,0 +1,300 @@
+"""
+Parse-once structure store shared by all stages.
+
+Each PDB file is parsed a single time into a handful of compact NumPy arrays
+(coordinates, atom names, residue numbers, one-letter codes, B-factors, chain
+IDs, ...) which are kept in a per-process LRU and persisted as `.npz` files in
+a cache directory, keyed by the SHA-256 of the PDB contents. Stages read these
+arrays instead of building Bio.PDB object trees.
+
+Large NMR or MD ensembles are read with `iter_models` instead, which parses one
+MODEL block at a time so memory stays bounded by the size of a single model.
+"""
+import os
+import gzip
+import socket
+from collections import OrderedDict
+import numpy as np
+
+from cache import file_digest
+
+# Worker processes inherit the cache directory through the environment
+STRUCTURE_CACHE_ENV = "PIPELINE_STRUCTURE_CACHE"
+
+THREE_TO_ONE = {
+    'ALA': 'A', 'ARG': 'R', 'ASN': 'N', 'ASP': 'D', 'CYS': 'C',
+    'GLN': 'Q', 'GLU': 'E', 'GLY': 'G', 'HIS': 'H', 'ILE': 'I',
+    'LEU': 'L', 'LYS': 'K', 'MET': 'M', 'PHE': 'F', 'PRO': 'P',
+    'SER': 'S', 'THR': 'T', 'TRP': 'W', 'TYR': 'Y', 'VAL': 'V',
+}
+
+# (start, end) columns of the fixed-width ATOM/HETATM record
+_COLUMNS = {
+    'atom_name': (12, 16), 'altloc': (16, 17), 'resname': (17, 20), 'chain': (21, 22),
+    'resnum': (22, 26), 'icode': (26, 27), 'x': (30, 38), 'y': (38, 46), 'z': (46, 54),
+    'occupancy': (54, 60), 'bfactor': (60, 66), 'element': (76, 78),
+}
+
+
+def _column(block, name):
+    start, end = _COLUMNS[name]
+    return np.ascontiguousarray(block[:, start:end]).view(f'S{end - start}').ravel()
+
+
+def _to_float(column, dtype=np.float32):
+    # Blank fields (e.g. missing occupancy) become NaN instead of failing the whole file
+    stripped = np.char.strip(column)
+    values = np.full(len(column), np.nan, dtype=dtype)
+    present = stripped != b''
+    values[present] = stripped[present].astype(dtype)
+    return values
+
+
+# Hybrid-36 residue numbers (A000-Z999, then a000-z999) continue after 9999
+_HY36_UPPER = int('A000', 36) - 10000
+_HY36_LOWER = _HY36_UPPER - 26 * 36 ** 3
+
+
+def _decode_resnum(field):
+    if field[:1].isupper() and field.isalnum() and not any(char.islower() for char in field):
+        return int(field, 36) - _HY36_UPPER
+    if field[:1].islower() and field.isalnum() and not any(char.isupper() for char in field):
+        return int(field, 36) - _HY36_LOWER
+    return int(field)
+
+
+def _to_resnum(column, lines, source):
+    # Plain decimal numbers are converted at once; hybrid-36 ones only when present
+    stripped = np.char.strip(column)
+    try:
+        return stripped.astype(np.int32)
+    except ValueError:
+        pass
+    values = np.zeros(len(column), dtype=np.int32)
+    for index, field in enumerate(stripped):
+        try:
+            values[index] = _decode_resnum(field.decode('ascii', 'replace'))
+        except ValueError:
+            raise ValueError(f"{source or 'PDB records'}: invalid residue number {field.decode(errors='replace')!r} "
+                             f"in record {lines[index].decode(errors='replace').rstrip()!r}") from None
+    return values
+
+
+def _to_str(column):
+    return np.char.strip(column).astype(str)
+
+
+class Structure:
+    """
+    Compact array representation of a PDB file.
+
+    Atom-level arrays (length n_atoms): `model`, `hetero`, `atom_name`, `altloc`,
+    `resname`, `chain`, `resnum`, `icode`, `coords` (n_atoms x 3), `occupancy`,
+    `bfactor`, `element`, `residue_index`.
+    Residue-level arrays (length n_residues): `res_start` (first atom of each
+    residue, for `np.add.reduceat`), `res_model`, `res_chain`, `res_resnum`,
+    `res_icode`, `res_resname`, `res_code` (one-letter code, 'X' if non-standard)
+    and `res_standard`.
+    """
+
+    ATOM_FIELDS = ('model', 'hetero', 'atom_name', 'altloc', 'resname', 'chain', 'resnum',
+                   'icode', 'coords', 'occupancy', 'bfactor', 'element')
+
+    def __init__(self, **arrays):
+        for field in self.ATOM_FIELDS:
+            setattr(self, field, arrays[field])
+        self._index_residues()
+
+    def _index_residues(self):
+        n_atoms = len(self.resnum)
+        if n_atoms:
+            changed = ((self.model[1:] != self.model[:-1]) | (self.chain[1:] != self.chain[:-1]) |
+                       (self.resnum[1:] != self.resnum[:-1]) | (self.icode[1:] != self.icode[:-1]))
+            self.res_start = np.concatenate(([0], np.flatnonzero(changed) + 1))
+        else:
+            self.res_start = np.zeros(0, dtype=np.int64)
+        self.residue_index = np.repeat(np.arange(len(self.res_start)), np.diff(np.append(self.res_start, n_atoms)))
+        self.res_model = self.model[self.res_start]
+        self.res_chain = self.chain[self.res_start]
+        self.res_resnum = self.resnum[self.res_start]
+        self.res_icode = self.icode[self.res_start]
+        self.res_resname = self.resname[self.res_start]
+        self.res_standard = np.isin(self.res_resname, list(THREE_TO_ONE))
+        self.res_code = np.array([THREE_TO_ONE.get(name, 'X') for name in self.res_resname], dtype='U1')
+
+    @property
+    def models(self):
+        return np.unique(self.model)
+
+    @classmethod
+    def from_pdb(cls, pdb_path):
+        """Parse the ATOM/HETATM records of a (optionally gzipped) PDB file."""
+        lines, models = [], []
+        for model_id, records in iter_model_blocks(pdb_path):
+            lines += records
+            models += [model_id] * len(records)
+        return cls.from_records(lines, models, pdb_path)
+
+    @classmethod
+    def from_records(cls, lines, models, source=None):
+        """
+        Arrays of ATOM/HETATM records padded to 80 bytes, with the model ID of every record.
+
+        Hybrid-36 residue numbers are decoded; any other non-numeric residue number raises
+        a ValueError naming `source` (the file the records come from) and the record.
+        """
+        block = np.frombuffer(b''.join(lines), dtype=np.uint8).reshape(len(lines), 80)
+        coords = np.column_stack([_to_float(_column(block, axis)) for axis in 'xyz']) if lines \
+            else np.zeros((0, 3), dtype=np.float32)
+        return cls(
+            model=np.array(models, dtype=np.int32),
+            hetero=block[:, 0] == ord('H'),
+            atom_name=_to_str(_column(block, 'atom_name')),
+            altloc=_to_str(_column(block, 'altloc')),
+            resname=_to_str(_column(block, 'resname')),
+            chain=_to_str(_column(block, 'chain')),
+            resnum=_to_resnum(_column(block, 'resnum'), lines, source),
+            icode=_to_str(_column(block, 'icode')),
+            coords=coords,
+            occupancy=_to_float(_column(block, 'occupancy')),
+            bfactor=_to_float(_column(block, 'bfactor')),
+            element=_to_str(_column(block, 'element')),
+        )
+
+    def save(self, npz_path):
+        # Processes on several hosts may cache the same file at once, so each writes its own temporary file
+        tmp_path = f"{npz_path}.{socket.gethostname()}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, **{field: getattr(self, field) for field in self.ATOM_FIELDS})
+        os.replace(tmp_path, npz_path)
+
+    @classmethod
+    def load(cls, npz_path):
+        with np.load(npz_path) as data:
+            return cls(**{field: data[field] for field in cls.ATOM_FIELDS})
+
+    def residue_mask(self, model=None, chain_id=None, standard_only=False):
+        """Boolean mask over residues selecting one model (default: the first) and optionally one chain."""
+        if model is None:
+            model = self.res_model[0] if len(self.res_model) else 0
+        mask = self.res_model == model
+        if chain_id is not None:
+            mask &= self.res_chain == chain_id
+        if standard_only:
+            mask &= self.res_standard
+        return mask
+
+    def occupancy_atom_mask(self):
+        """
+        Mask keeping one copy of every atom: the altloc with the highest occupancy, first listed
+        on ties, which is the altloc Bio.PDB selects for a disordered atom.
+        """
+        _, name_codes = np.unique(self.atom_name, return_inverse=True)
+        occupancy = np.nan_to_num(self.occupancy, nan=0.0)
+        order = np.lexsort((np.arange(len(self.resnum)), -occupancy, name_codes, self.residue_index))
+        keys = np.column_stack([self.residue_index, name_codes])[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (keys[1:] != keys[:-1]).any(axis=1)
+        mask = np.zeros(len(self.resnum), dtype=bool)
+        mask[order[first]] = True
+        return mask
+
+
+def iter_model_blocks(pdb_path):
+    """
+    Stream the ATOM/HETATM records of a (optionally gzipped) PDB file one model at a time.
+
+    Yields:
+    - tuple: (model ID, list of records padded to 80 bytes). Model IDs are 0-based in
+      file order, as in Bio.PDB; a file without MODEL records is model 0.
+    """
+    opener = gzip.open if pdb_path.endswith('.gz') else open
+    records = []
+    model_id = 0
+    seen_model = False
+    with opener(pdb_path, 'rb') as f:
+        for line in f:
+            if line.startswith(b'ATOM  ') or line.startswith(b'HETATM'):
+                records.append(line.rstrip(b'\r\n').ljust(80)[:80])
+            elif line.startswith(b'MODEL'):
+                if seen_model:
+                    if records:
+                        yield model_id, records
+                        records = []
+                    model_id += 1
+                seen_model = True
+            elif line.startswith(b'ENDMDL'):
+                if records:
+                    yield model_id, records
+                    records = []
+                if not seen_model:
+                    model_id += 1
+    if records:
+        yield model_id, records
+
+
+def iter_models(pdb_path):
+    """Parse a PDB file one model at a time, yielding (model ID, Structure of that model) without caching."""
+    for model_id, records in iter_model_blocks(pdb_path):
+        yield model_id, Structure.from_records(records, [model_id] * len(records), pdb_path)
+
+
+class StructureStore:
+    """Per-process LRU of parsed structures, backed by an optional on-disk `.npz` cache."""
+
+    def __init__(self, cache_dir=None, max_items=256):
+        self.cache_dir = cache_dir
+        self.max_items = max_items
+        self._structures = OrderedDict()
+        # Lookups served from memory, from the .npz cache and by parsing the PDB file
+        self.stats = {'memory': 0, 'disk': 0, 'parsed': 0}
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, pdb_path):
+        stat = os.stat(pdb_path)
+        memo_key = (os.path.abspath(pdb_path), stat.st_size, stat.st_mtime_ns)
+        structure = self._structures.get(memo_key)
+        if structure is not None:
+            self._structures.move_to_end(memo_key)
+            self.stats['memory'] += 1
+            return structure
+
+        npz_path = os.path.join(self.cache_dir, file_digest(pdb_path) + ".npz") if self.cache_dir else None
+        if npz_path and os.path.exists(npz_path):
+            structure = Structure.load(npz_path)
+            self.stats['disk'] += 1
+        else:
+            structure = Structure.from_pdb(pdb_path)
+            self.stats['parsed'] += 1
+            if npz_path:
+                structure.save(npz_path)
+
+        self._structures[memo_key] = structure
+        if len(self._structures) > self.max_items:
+            self._structures.popitem(last=False)
+        return structure
+
+
+_default_store = None
+
+
+def set_cache_dir(cache_dir):
+    """Use `cache_dir` for the persistent cache in this process and in workers started after this call."""
+    global _default_store
+    os.environ[STRUCTURE_CACHE_ENV] = cache_dir
+    _default_store = None
+
+
+def get_structure(pdb_path):
+    """Parsed arrays for `pdb_path` from the process-wide store."""
+    global _default_store
+    if _default_store is None:
+        _default_store = StructureStore(os.environ.get(STRUCTURE_CACHE_ENV) or None)
+    return _default_store.get(pdb_path)
+
+
+def cache_stats():
+    """Lookup counts of the process-wide store since it was created."""
+    if _default_store is None:
+        return {'memory': 0, 'disk': 0, 'parsed': 0}
+    return dict(_default_store.stats)
@@ -0,0 +1,63 @@
+"""
+Batched Kabsch superposition of coordinate sets.
+
+Depends on numpy only, so the RMSD stage and the TM-align pre-screen can both
+import it without importing each other.
+"""
+import numpy as np
+
+def kabsch_superpose(mobile, reference, weights):
+    """
+    Superpose a batch of coordinate sets at once with the Kabsch algorithm.
+
+    Parameters:
+    - mobile, reference (ndarray): (batch, n, 3) coordinates; padded rows may hold anything finite.
+    - weights (ndarray): (batch, n) fitting weights, 0 for padded or excluded positions.
+
+    Returns:
+    - ndarray: `mobile` rotated and translated onto `reference`.
+    """
+    total = np.maximum(weights.sum(axis=1), 1e-12)[:, None, None]
+    w = weights[:, :, None]
+    mobile_center = (w * mobile).sum(axis=1, keepdims=True) / total
+    reference_center = (w * reference).sum(axis=1, keepdims=True) / total
+    covariance = np.einsum('bni,bnj->bij', w * (mobile - mobile_center), reference - reference_center)
+    u, _, vt = np.linalg.svd(covariance)
+    # Flip the last axis where needed so every transform is a proper rotation
+    sign = np.sign(np.linalg.det(np.einsum('bij,bjk->bik', u, vt)))
+    sign[sign == 0] = 1
+    u[:, :, -1] *= sign[:, None]
+    rotation = np.einsum('bij,bjk->bik', u, vt)
+    return np.einsum('bni,bij->bnj', mobile - mobile_center, rotation) + reference_center
+
+def superposition_deviations(mobile, reference, present, trim_cutoff=None, max_iterations=5, min_atoms=3):
+    """
+    Per-position distances after a batched Kabsch fit, optionally refitted on a trimmed core.
+
+    With `trim_cutoff` (Angstrom), positions deviating more than the cutoff are dropped
+    from the fit and the fit is repeated until the core stops changing, `max_iterations`
+    is reached, or fewer than `min_atoms` positions would remain.
+
+    Returns:
+    - tuple: ((batch, n) distances, NaN where not present, and the (batch, n) fitted mask).
+    """
+    mobile = np.where(present[:, :, None], mobile, 0.0)
+    reference = np.where(present[:, :, None], reference, 0.0)
+    def fit(mask):
+        return np.linalg.norm(kabsch_superpose(mobile, reference, mask.astype(float)) - reference, axis=2)
+
+    fitted = present.copy()
+    for _ in range(max_iterations if trim_cutoff is not None else 1):
+        deviations = fit(fitted)
+        if trim_cutoff is None:
+            break
+        core = present & (deviations <= trim_cutoff)
+        # Pairs whose core would become too small keep their current fit
+        core = np.where((core.sum(axis=1) >= min_atoms)[:, None], core, fitted)
+        if np.array_equal(core, fitted):
+            break
+        fitted = core
+    else:
+        # The core changed in the last iteration: fit it, so the distances belong to the returned mask
+        deviations = fit(fitted)
+    return np.where(present, deviations, np.nan), fitted
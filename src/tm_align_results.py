@@ -0,0 +1,19 @@
+"""
+Reading per-family TM-align result files.
+
+Kept apart from `run_tm_align` so the stages that only read the results (residue
+mapping, RMSD) do not import the runner and its pre-screen.
+"""
+import pandas as pd
+
+def load_results(results_path):
+    """Read a per-family TM-align result file; alignment lines keep their leading spaces."""
+    return pd.read_csv(results_path, keep_default_na=False, na_values=[''],
+                       dtype={'Mobile': str, 'Reference': str, 'Seq1': str, 'Markers': str, 'Seq2': str,
+                              'Error': str, 'MobileSHA256': str, 'ReferenceSHA256': str, 'ToolVersion': str,
+                              'ScreenDecision': str})
+
+def passed_records(results_path):
+    """Records of the pairs that passed the RMSD cutoff, as dicts."""
+    results = load_results(results_path)
+    return results[results['Passed'] == True].to_dict('records')
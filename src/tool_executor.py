@@ -0,0 +1,216 @@
+"""
+Shared executor for external tools (TM-align, mkdssp).
+
+Jobs run as asyncio subprocesses on one event loop per process, in a background
+thread, so any number of threads can submit jobs and wait for them. Running jobs
+are limited by a global budget of tool processes and by per-tool limits. After
+`set_budget`, both limits are shared by every process of the run through slot
+files: a slot is an exclusive flock on one of N files, which the kernel releases
+even if its holder dies. Jobs that time out are killed together with their
+process group, failed jobs are retried with exponential backoff, and stdout and
+stderr are kept up to a size limit.
+"""
+import os
+import fcntl
+import signal
+import asyncio
+import threading
+import tracing
+
+# Worker processes inherit the shared budget through the environment
+SLOT_DIR_ENV = "PIPELINE_TOOL_SLOTS"
+BUDGET_ENV = "PIPELINE_TOOL_BUDGET"
+TOOL_LIMITS_ENV = "PIPELINE_TOOL_LIMITS"
+
+# Bytes of stdout and of stderr kept per job; a job with more output fails
+MAX_OUTPUT_BYTES = 64 << 20
+
+# Seconds between attempts to take a slot held by another process
+SLOT_POLL_SECONDS = 0.02
+
+
+def parse_tool_limits(text):
+    """{'TMalign': 4, 'mkdssp': 8} from 'TMalign=4,mkdssp=8'."""
+    limits = {}
+    for part in filter(None, (text or '').split(',')):
+        tool, _, limit = part.partition('=')
+        limits[tool.strip()] = int(limit)
+    return limits
+
+
+class SlotPool:
+    """`size` slots shared between processes, as exclusive flocks on files `<name>_<i>.lock` in `directory`."""
+
+    def __init__(self, directory, name, size):
+        self.paths = [os.path.join(directory, f"{name}_{i}.lock") for i in range(size)]
+
+    async def acquire(self):
+        while True:
+            for path in self.paths:
+                fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return fd
+                except BlockingIOError:
+                    os.close(fd)
+            await asyncio.sleep(SLOT_POLL_SECONDS)
+
+    def release(self, fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+async def _read_bounded(stream, limit):
+    # The whole stream is drained so the tool never blocks on a full pipe; only `limit` bytes are kept
+    chunks, kept, truncated = [], 0, False
+    while True:
+        chunk = await stream.read(1 << 16)
+        if not chunk:
+            return b''.join(chunks).decode(errors='replace'), truncated
+        if kept + len(chunk) > limit:
+            chunk, truncated = chunk[:limit - kept], True
+        chunks.append(chunk)
+        kept += len(chunk)
+
+
+class ToolExecutor:
+    """
+    Runs external tool jobs on an event loop thread of this process.
+
+    Parameters:
+    - max_processes (int): Tool processes running at once (default: CPU count).
+    - tool_limits (dict): Tool name -> processes of that tool running at once.
+    - slot_dir (str): Directory of the slot files that share both limits with other
+      processes, or None to limit this process only.
+    """
+
+    def __init__(self, max_processes=None, tool_limits=None, slot_dir=None):
+        self.max_processes = max_processes or os.cpu_count() or 1
+        self.tool_limits = dict(tool_limits or {})
+        self.slot_dir = slot_dir
+        self._limits = {}
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def _limits_for(self, tool):
+        # Created on the loop thread. The tool's own limit is taken before the global one, so jobs
+        # waiting for a busy tool do not hold global slots; the fixed order rules out deadlocks
+        names = ([tool] if tool in self.tool_limits else []) + ['global']
+        for name in names:
+            if name not in self._limits:
+                size = self.max_processes if name == 'global' else self.tool_limits[name]
+                slots = SlotPool(self.slot_dir, name, size) if self.slot_dir else None
+                self._limits[name] = (asyncio.Semaphore(size), slots)
+        return [self._limits[name] for name in names]
+
+    async def _run_once(self, tool, command, timeout, max_output):
+        held = []
+        try:
+            for semaphore, slots in self._limits_for(tool):
+                await semaphore.acquire()
+                held.append((semaphore, slots, await slots.acquire() if slots else None))
+            with tracing.external_call(tool):
+                try:
+                    process = await asyncio.create_subprocess_exec(
+                        *command, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE,
+                        stderr=asyncio.subprocess.PIPE, start_new_session=True)
+                except OSError as e:
+                    return {'status': 'error', 'error': str(e), 'returncode': None, 'stdout': '', 'stderr': ''}
+                try:
+                    (stdout, stdout_truncated), (stderr, _), returncode = await asyncio.wait_for(asyncio.gather(
+                        _read_bounded(process.stdout, max_output), _read_bounded(process.stderr, max_output),
+                        process.wait()), timeout)
+                except asyncio.TimeoutError:
+                    # The tool runs in its own session, so the whole process group is killed
+                    try:
+                        os.killpg(process.pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+                    await process.wait()
+                    return {'status': 'timeout', 'error': f"{tool} exceeded {timeout} s", 'returncode': None,
+                            'stdout': '', 'stderr': ''}
+        finally:
+            for semaphore, slots, fd in reversed(held):
+                if fd is not None:
+                    slots.release(fd)
+                semaphore.release()
+
+        result = {'status': 'ok', 'error': '', 'returncode': returncode, 'stdout': stdout, 'stderr': stderr}
+        if returncode != 0:
+            result.update(status='error', error=(stderr.strip() or f"exit status {returncode}")[:500])
+        elif stdout_truncated:
+            result.update(status='error', error=f"{tool} output exceeded {max_output} bytes")
+        return result
+
+    async def _run(self, tool, command, timeout, retries, backoff, max_output, accept):
+        for attempt in range(retries + 1):
+            if attempt:
+                await asyncio.sleep(backoff * 2 ** (attempt - 1))
+            result = await self._run_once(tool, command, timeout, max_output)
+            if result['status'] == 'ok' and accept is not None and not accept(result['stdout']):
+                result.update(status='error', error=(result['stderr'].strip() or f"unexpected {tool} output")[:500])
+            if result['status'] == 'ok':
+                break
+        result['attempts'] = attempt + 1
+        return result
+
+    def submit(self, tool, command, timeout=None, retries=0, backoff=1.0, max_output=MAX_OUTPUT_BYTES, accept=None):
+        """
+        Queue one job and return a concurrent.futures.Future of its result.
+
+        Parameters:
+        - tool (str): Tool name, used for the per-tool limit and in messages.
+        - command (list): Executable and arguments.
+        - timeout (float): Seconds before an attempt is killed, or None.
+        - retries (int): Extra attempts after a failure, `backoff * 2**k` seconds apart.
+        - accept (callable): Returns False if stdout of a successful exit is unusable, which
+          counts as a failure.
+
+        Returns:
+        - Future: dict with status ('ok', 'timeout' or 'error'), error, returncode, stdout,
+          stderr and attempts.
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self._run(tool, command, timeout, retries, backoff, max_output, accept), self._loop)
+
+    def run(self, tool, command, **options):
+        """Run one job and wait for its result; see `submit`."""
+        return self.submit(tool, command, **options).result()
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def set_budget(slot_dir, max_processes=None, tool_limits=None):
+    """
+    Share a budget of `max_processes` tool processes, and `tool_limits` per tool, between this
+    process and the workers started after this call.
+    """
+    global _executor
+    os.makedirs(slot_dir, exist_ok=True)
+    os.environ[SLOT_DIR_ENV] = slot_dir
+    os.environ[BUDGET_ENV] = str(max_processes or os.cpu_count() or 1)
+    os.environ[TOOL_LIMITS_ENV] = ','.join(f"{tool}={limit}" for tool, limit in (tool_limits or {}).items())
+    _executor = None
+
+
+def get_executor():
+    """The executor of this process, configured from the shared budget if one is set."""
+    global _executor, _executor_pid
+    with _executor_lock:
+        # A forked child inherits the executor object but not its loop thread
+        if _executor is None or _executor_pid != os.getpid():
+            budget = os.environ.get(BUDGET_ENV)
+            _executor = ToolExecutor(int(budget) if budget else None,
+                                     parse_tool_limits(os.environ.get(TOOL_LIMITS_ENV)),
+                                     os.environ.get(SLOT_DIR_ENV) or None)
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def run_tool(tool, command, **options):
+    """Run one job on this process's executor and wait for its result; see `ToolExecutor.submit`."""
+    return get_executor().run(tool, command, **options)
@@ -0,0 +1,321 @@
+"""
+Per-item tracing and profiling of pipeline stages.
+
+When `run_stages` is given hooks, every work item runs inside `traced_call`, which
+measures it in the worker process: wall and CPU time, peak RSS, bytes read and
+written, time spent in external tools (TM-align, mkdssp) and structure-store
+cache hits. Hooks are notified as stages start and finish, as items complete and
+for every item skipped by the manifest.
+
+`Tracer` is the standard hook. It keeps all records and writes them as a Chrome
+trace (chrome://tracing or https://ui.perfetto.dev) with one row per worker
+process and a per-stage summary. For one chosen stage it can also sample the
+Python stacks of the workers and write them in the folded format read by
+flamegraph.pl, inferno and speedscope.
+"""
+import os
+import sys
+import json
+import time
+import resource
+import threading
+from collections import Counter
+from contextlib import contextmanager
+import structure_store
+
+# Seconds spent in external tools by this process, per tool; updated from several threads
+_external_seconds = Counter()
+_external_lock = threading.Lock()
+
+def add_external_time(tool, seconds):
+    """Count `seconds` of external-process time towards `tool`."""
+    with _external_lock:
+        _external_seconds[tool] += seconds
+
+@contextmanager
+def external_call(tool):
+    """Count the wall time of the enclosed external-process call towards `tool`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_external_time(tool, time.perf_counter() - start)
+
+def _io_counters():
+    # Bytes passed through read/write calls so far, including page-cache hits (Linux only)
+    try:
+        with open('/proc/self/io') as f:
+            fields = dict(line.split(':', 1) for line in f)
+        return int(fields['rchar']), int(fields['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+def _reset_peak_rss():
+    # Writing 5 to clear_refs resets the peak RSS (VmHWM) of this process (Linux only)
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def _peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Peak over the whole process lifetime; ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def _child_cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+def _fold(frame, root=None):
+    # Frames from `root` outwards (the worker machinery and, after a fork, the parent's frames) are left out
+    names = []
+    while frame is not None and frame is not root:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+class StackSampler:
+    """
+    Samples the Python stacks of all other threads every `interval` seconds as folded-stack counts.
+
+    Stacks of the thread that created the sampler are cut at the creating frame.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._root = sys._getframe(1)
+        self.counts = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    self.counts[_fold(frame, self._root)] += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+def traced_call(func, args, sample_interval=None):
+    """
+    Run `func(*args)` in a worker process and measure it.
+
+    Parameters:
+    - func (callable): Stage function.
+    - args (tuple): Its arguments.
+    - sample_interval (float): If set, Python stacks are sampled at this interval.
+
+    Returns:
+    - dict: The measurements of the item. If `func` raises, they are attached to the
+      exception as its `trace` attribute, which survives pickling back to the scheduler.
+    """
+    _reset_peak_rss()
+    io_before = _io_counters()
+    external_before = Counter(_external_seconds)
+    cache_before = structure_store.cache_stats()
+    child_cpu_before = _child_cpu_seconds()
+    sampler = StackSampler(sample_interval) if sample_interval else None
+    start, wall_start, cpu_start = time.time(), time.perf_counter(), time.process_time()
+    error = None
+    try:
+        if sampler is not None:
+            with sampler:
+                func(*args)
+        else:
+            func(*args)
+    except Exception as e:
+        error = e
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    io_after = _io_counters()
+    cache_after = structure_store.cache_stats()
+    trace = {
+        'pid': os.getpid(),
+        'start': start,
+        'wall_seconds': wall,
+        'cpu_seconds': cpu,
+        'peak_rss_mb': _peak_rss_mb(),
+        'read_bytes': io_after[0] - io_before[0] if io_before and io_after else None,
+        'written_bytes': io_after[1] - io_before[1] if io_before and io_after else None,
+        'external_seconds': dict(Counter(_external_seconds) - external_before),
+        'child_cpu_seconds': _child_cpu_seconds() - child_cpu_before,
+        'structure_cache': {key: cache_after[key] - cache_before[key] for key in cache_after},
+    }
+    if sampler is not None:
+        trace['stacks'] = dict(sampler.counts)
+    if error is not None:
+        error.trace = trace
+        raise error
+    return trace
+
+def item_label(args):
+    """Short name of a work item: the base name of its first argument."""
+    if not args:
+        return ''
+    return os.path.basename(os.path.normpath(str(args[0])))
+
+class Hook:
+    """
+    Base class of scheduler hooks; every method is optional and does nothing here.
+
+    Stage names, item labels and the `traced_call` measurements are passed in.
+    """
+
+    def sample_interval(self, name):
+        """Stack-sampling interval for the items of stage `name`, or None to not sample."""
+        return None
+
+    def stage_started(self, name, n_items, n_cached):
+        pass
+
+    def item_cached(self, name, label):
+        pass
+
+    def item_finished(self, name, label, trace, error):
+        pass
+
+    def stage_finished(self, name, summary):
+        pass
+
+def _sum(records, key):
+    values = [record[key] for record in records if record.get(key) is not None]
+    return sum(values) if values else None
+
+class Tracer(Hook):
+    """
+    Collects the measurements of a run for a Chrome trace and an optional stack profile.
+
+    Parameters:
+    - profile_stage (str): Stage whose items are stack-sampled, or None.
+    - interval (float): Sampling interval in seconds.
+    """
+
+    def __init__(self, profile_stage=None, interval=0.005):
+        self.profile_stage = profile_stage
+        self.interval = interval
+        self.started = time.time()
+        self.stages = {}
+        self.records = []
+        self.cached = []
+        self.stacks = Counter()
+
+    def sample_interval(self, name):
+        return self.interval if name == self.profile_stage else None
+
+    def stage_started(self, name, n_items, n_cached):
+        self.stages[name] = {'start': time.time(), 'end': None, 'items': n_items, 'cached': n_cached}
+
+    def item_cached(self, name, label):
+        self.cached.append({'stage': name, 'label': label, 'time': time.time()})
+
+    def item_finished(self, name, label, trace, error):
+        trace = dict(trace or {})
+        self.stacks.update(trace.pop('stacks', {}))
+        self.records.append({'stage': name, 'label': label, 'error': repr(error) if error is not None else None,
+                             **trace})
+
+    def stage_finished(self, name, summary):
+        self.stages[name]['end'] = time.time()
+
+    def stage_summary(self, slowest=5):
+        """Per-stage totals, in start order, with the `slowest` items of each stage."""
+        rows = []
+        for name, stage in sorted(self.stages.items(), key=lambda item: item[1]['start']):
+            records = [record for record in self.records if record['stage'] == name]
+            external = Counter()
+            cache = Counter()
+            for record in records:
+                external.update(record.get('external_seconds', {}))
+                cache.update(record.get('structure_cache', {}))
+            ranked = sorted((record for record in records if 'wall_seconds' in record),
+                            key=lambda record: record['wall_seconds'], reverse=True)
+            peaks = [record['peak_rss_mb'] for record in records if record.get('peak_rss_mb') is not None]
+            rows.append({
+                'stage': name,
+                'wall_seconds': (stage['end'] or stage['start']) - stage['start'],
+                'items': stage['items'],
+                'cached': stage['cached'],
+                'failed': sum(record['error'] is not None for record in records),
+                'item_wall_seconds': _sum(records, 'wall_seconds'),
+                'cpu_seconds': _sum(records, 'cpu_seconds'),
+                'child_cpu_seconds': _sum(records, 'child_cpu_seconds'),
+                'peak_rss_mb': max(peaks) if peaks else None,
+                'read_bytes': _sum(records, 'read_bytes'),
+                'written_bytes': _sum(records, 'written_bytes'),
+                'external_seconds': dict(external),
+                'structure_cache': dict(cache),
+                'slowest': [{'label': record['label'], 'wall_seconds': record['wall_seconds']}
+                            for record in ranked[:slowest]],
+            })
+        return rows
+
+    def chrome_trace(self):
+        """Trace Event Format dict: one row per worker process, stages as async spans on the scheduler row."""
+        pid = os.getpid()
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'name': 'pipeline'}},
+                  {'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'name': 'scheduler'}}]
+
+        def micros(timestamp):
+            return (timestamp - self.started) * 1e6
+
+        for worker in sorted({record['pid'] for record in self.records if 'pid' in record}):
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': worker,
+                           'args': {'name': f"worker {worker}"}})
+        for span, (name, stage) in enumerate(self.stages.items()):
+            events.append({'name': name, 'cat': 'stage', 'ph': 'b', 'id': span, 'pid': pid, 'tid': 0,
+                           'ts': micros(stage['start']), 'args': {'items': stage['items'], 'cached': stage['cached']}})
+            events.append({'name': name, 'cat': 'stage', 'ph': 'e', 'id': span, 'pid': pid, 'tid': 0,
+                           'ts': micros(stage['end'] or stage['start'])})
+        for record in self.records:
+            if 'start' not in record:
+                continue
+            args = {key: value for key, value in record.items() if key not in ('stage', 'label', 'pid', 'start')}
+            events.append({'name': record['label'], 'cat': record['stage'], 'ph': 'X', 'pid': pid,
+                           'tid': record['pid'], 'ts': micros(record['start']),
+                           'dur': record['wall_seconds'] * 1e6, 'args': args})
+        for hit in self.cached:
+            events.append({'name': f"cached {hit['label']}", 'cat': hit['stage'], 'ph': 'i', 's': 't',
+                           'pid': pid, 'tid': 0, 'ts': micros(hit['time'])})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms', 'stageSummary': self.stage_summary()}
+
+    def write_trace(self, trace_file):
+        """Write the Chrome trace, with the per-stage summary under `stageSummary`."""
+        with open(trace_file + '.tmp', 'w') as f:
+            json.dump(self.chrome_trace(), f)
+        os.replace(trace_file + '.tmp', trace_file)
+        print(f"Trace saved to {trace_file}")
+        return trace_file
+
+    def write_folded(self, folded_file):
+        """Write the sampled stacks as `frame;frame;frame count` lines for flame graph tools."""
+        with open(folded_file + '.tmp', 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        os.replace(folded_file + '.tmp', folded_file)
+        print(f"Profile of {self.profile_stage} ({sum(self.stacks.values())} samples) saved to {folded_file}")
+        return folded_file
+
+    def print_summary(self, top=5):
+        """Print the stages by wall time and their slowest items."""
+        rows = sorted(self.stage_summary(slowest=3), key=lambda row: row['wall_seconds'], reverse=True)
+        for row in rows[:top]:
+            external = ', '.join(f"{tool} {seconds:.1f} s" for tool, seconds in row['external_seconds'].items())
+            print(f"[{row['stage']}] {row['wall_seconds']:.1f} s wall, {row['cpu_seconds'] or 0:.1f} s CPU, "
+                  f"{row['items']} item(s), {row['cached']} cached" + (f", external: {external}" if external else ""))
+            for item in row['slowest']:
+                print(f"    {item['label']}: {item['wall_seconds']:.2f} s")
@@ -0,0 +1,406 @@
+"""
+File-based work queue for running the pipeline of many families on several hosts.
+
+The queue is a directory on a filesystem shared by all hosts. Every family added
+to it has its own copy of the stage DAG. Any number of worker processes, on any
+number of hosts, pull work from the queue without a central scheduler:
+
+- Once all dependencies of a stage have finished, one worker expands the stage
+  into task files, one per work item (per structure, per pair or per family).
+- Workers claim tasks by creating claim files with O_CREAT | O_EXCL, which is
+  atomic on local filesystems and on NFS. While a worker runs a task it renews
+  its lease by touching the claim file; a claim not renewed for
+  `lease_seconds` is taken over by another worker. A task whose claim expired
+  MAX_ATTEMPTS times is marked failed instead of being retried again.
+- When every task of a stage is done, one worker merges the shard outputs of the
+  stage (see `family_store.merge_shards`) and marks the stage finished, which
+  makes the downstream stages ready.
+
+Expanding and merging are claimed like tasks, so each happens once. Stage work
+items are idempotent (they rewrite the same outputs), so a task that runs twice
+after a lost lease still leaves consistent results. Hosts need roughly
+synchronized clocks (NTP) for the lease checks.
+
+Layout under the queue directory:
+    families/<family>.json                   family configuration
+    tasks/<family>/<stage>/<i>.json          arguments of item i
+    stages/<family>/<stage>.json             the stage is expanded (task count)
+    claims/<family>/<stage>/<i|expand|merge> current claims
+    done/<family>/<stage>/<i>.json           status, worker and time of finished items
+    finished/<family>/<stage>.json           the stage is merged and finished
+"""
+import os
+import json
+import time
+import random
+import socket
+import threading
+import traceback
+import family_store
+from scheduler import topological_order
+
+# Seconds without a heartbeat after which a claim may be taken over
+LEASE_SECONDS = 300
+
+# Seconds between scans of an idle worker
+POLL_SECONDS = 2.0
+
+# Claims of one task that may expire before it is marked failed
+MAX_ATTEMPTS = 3
+
+
+def worker_name():
+    """Unique name of this worker process: host, process ID and start time."""
+    return f"{socket.gethostname()}-{os.getpid()}-{int(time.time() * 1000)}"
+
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def _as_args(value):
+    # JSON turns the tuples of item arguments into lists
+    if isinstance(value, list):
+        return tuple(_as_args(item) for item in value)
+    return value
+
+
+def add_family(queue_dir, family, config):
+    """Add a family to the queue; `config` is passed to the worker's stage builder and must be JSON-serializable."""
+    path = os.path.join(queue_dir, "families", f"{family}.json")
+    _write_json(path, {'family': family, 'config': config})
+    print(f"Queued family {family} in {queue_dir}")
+    return path
+
+
+def families(queue_dir):
+    directory = os.path.join(queue_dir, "families")
+    if not os.path.isdir(directory):
+        return []
+    return [_read_json(os.path.join(directory, name)) for name in sorted(os.listdir(directory))
+            if name.endswith('.json')]
+
+
+def missing_outputs(stage, args):
+    """
+    Declared outputs of a stage item that do not exist, as in `scheduler.run_stages`.
+
+    Shared outputs count as written when this process's shard of them exists, since
+    queue workers append to shards that are only merged once the stage is done.
+    """
+    shard = os.environ.get(family_store.SHARD_ENV)
+    missing = [path for path in stage.outputs(*args) if not os.path.exists(path)]
+    missing += [path for path in stage.shared_outputs(*args) if not os.path.exists(path)
+                and not (shard and os.path.exists(family_store.shard_path(path, shard)))]
+    return missing
+
+
+class Leases:
+    """
+    Claim files held by one worker, renewed by a heartbeat thread every `lease_seconds / 4`.
+
+    Parameters:
+    - worker (str): Name written into the claim files.
+    - lease_seconds (float): Age of the last heartbeat after which other workers may take a claim over.
+    """
+
+    def __init__(self, worker, lease_seconds=LEASE_SECONDS):
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+        self.held = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._heartbeat, daemon=True)
+        self._thread.start()
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.lease_seconds / 4):
+            with self._lock:
+                held = list(self.held)
+            for path in held:
+                try:
+                    os.utime(path)
+                except FileNotFoundError:
+                    pass
+
+    def _create(self, path, attempt):
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'worker': self.worker, 'attempt': attempt, 'claimed': time.time()}, f)
+        with self._lock:
+            self.held.add(path)
+        return True
+
+    def claim(self, path):
+        """
+        Claim `path`, taking it over if its lease has expired.
+
+        Returns:
+        - int: The attempt number of the claim (1 for a fresh one), or 0 if another worker holds it.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if self._create(path, 1):
+            return 1
+        try:
+            if time.time() - os.stat(path).st_mtime < self.lease_seconds:
+                return 0
+            # Only one worker can rename the expired claim away
+            expired = f"{path}.expired.{self.worker}"
+            os.rename(path, expired)
+        except FileNotFoundError:
+            return 0
+        try:
+            # Another worker may have replaced the expired claim just before the rename
+            if time.time() - os.stat(expired).st_mtime < self.lease_seconds:
+                try:
+                    os.link(expired, path)
+                except FileExistsError:
+                    pass
+                return 0
+            try:
+                previous = _read_json(expired)
+            except (OSError, ValueError):
+                previous = {}
+        finally:
+            os.remove(expired)
+        attempt = previous.get('attempt', 1) + 1
+        print(f"Taking over {path} from {previous.get('worker', 'an unknown worker')} (attempt {attempt})")
+        return attempt if self._create(path, attempt) else 0
+
+    def release(self, path):
+        with self._lock:
+            self.held.discard(path)
+        try:
+            # After a lost lease the claim belongs to the worker that took it over
+            if _read_json(path).get('worker') == self.worker:
+                os.remove(path)
+        except (OSError, ValueError):
+            pass
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class WorkQueue:
+    """
+    One worker's view of a queue directory.
+
+    Parameters:
+    - queue_dir (str): Shared queue directory.
+    - build_stages (callable): Returns the `scheduler.Stage` list of a family from its
+      configuration. It is called again whenever the worker turns to a family, so it may
+      also set per-family process state.
+    """
+
+    def __init__(self, queue_dir, build_stages, worker=None, lease_seconds=LEASE_SECONDS):
+        self.queue_dir = queue_dir
+        self.build_stages = build_stages
+        self.worker = worker or worker_name()
+        self.leases = Leases(self.worker, lease_seconds)
+
+    def _path(self, kind, family, *parts):
+        return os.path.join(self.queue_dir, kind, family, *parts)
+
+    def finished(self, family, stage):
+        return os.path.exists(self._path("finished", family, f"{stage}.json"))
+
+    def task_count(self, family, stage):
+        path = self._path("stages", family, f"{stage}.json")
+        return _read_json(path)['tasks'] if os.path.exists(path) else None
+
+    def done_tasks(self, family, stage):
+        directory = self._path("done", family, stage)
+        if not os.path.isdir(directory):
+            return set()
+        return {int(name[:-5]) for name in os.listdir(directory) if name.endswith('.json')}
+
+    def task_args(self, family, stage, index):
+        return _as_args(_read_json(self._path("tasks", family, stage, f"{index}.json"))['args'])
+
+    def _expand(self, family, stage):
+        claim = self._path("claims", family, stage.name, "expand")
+        if not self.leases.claim(claim):
+            return False
+        try:
+            if self.task_count(family, stage.name) is None:
+                items = list(stage.items())
+                for index, args in enumerate(items):
+                    _write_json(self._path("tasks", family, stage.name, f"{index}.json"), {'args': list(args)})
+                # Written last: the tasks are complete once the stage counts as expanded
+                _write_json(self._path("stages", family, f"{stage.name}.json"), {'tasks': len(items)})
+                print(f"[{family}/{stage.name}] Queued {len(items)} task(s)")
+        finally:
+            self.leases.release(claim)
+        return True
+
+    def _run_task(self, family, stage, index):
+        claim = self._path("claims", family, stage.name, str(index))
+        attempt = self.leases.claim(claim)
+        if not attempt:
+            return False
+        done = self._path("done", family, stage.name, f"{index}.json")
+        try:
+            # The task may have finished between the scan and the claim
+            if os.path.exists(done):
+                return False
+            record = {'worker': self.worker, 'attempt': attempt, 'status': 'ok', 'error': None}
+            start = time.perf_counter()
+            if attempt > MAX_ATTEMPTS:
+                record.update(status='failed', error=f"lease expired {attempt - 1} time(s)")
+            else:
+                args = self.task_args(family, stage.name, index)
+                try:
+                    stage.func(*args)
+                except Exception as e:
+                    traceback.print_exc()
+                    record.update(status='failed', error=repr(e))
+                else:
+                    missing = missing_outputs(stage, args)
+                    if missing:
+                        record.update(status='failed', error=f"task did not write {', '.join(missing)}")
+            record['seconds'] = time.perf_counter() - start
+            if record['status'] != 'ok':
+                print(f"[{family}/{stage.name}] Task {index} failed: {record['error']}")
+            _write_json(done, record)
+        finally:
+            self.leases.release(claim)
+        return True
+
+    def _merge(self, family, stage, n_tasks):
+        claim = self._path("claims", family, stage.name, "merge")
+        if not self.leases.claim(claim):
+            return False
+        try:
+            if not self.finished(family, stage.name):
+                # Shard outputs of the stage's items go into the family tables
+                shared = dict.fromkeys(path for index in range(n_tasks)
+                                       for path in stage.shared_outputs(*self.task_args(family, stage.name, index)))
+                for path in shared:
+                    family_store.merge_shards(path)
+                failed = sum(_read_json(self._path("done", family, stage.name, f"{index}.json"))['status'] != 'ok'
+                             for index in range(n_tasks))
+                _write_json(self._path("finished", family, f"{stage.name}.json"),
+                            {'tasks': n_tasks, 'failed': failed, 'worker': self.worker, 'time': time.time()})
+                print(f"[{family}/{stage.name}] Completed ({failed} failed)")
+        finally:
+            self.leases.release(claim)
+        return True
+
+    def step(self, family, stages):
+        """
+        Do one unit of work for a family: expand a ready stage, run one task or merge a stage.
+
+        Returns:
+        - str: 'worked', 'waiting' if work is left that others hold or that is not ready, or
+          'finished' if every stage of the family is finished.
+        """
+        by_name = {stage.name: stage for stage in stages}
+        waiting = False
+        for name in topological_order(stages):
+            if self.finished(family, name):
+                continue
+            stage = by_name[name]
+            if not all(self.finished(family, dep) for dep in stage.deps):
+                waiting = True
+                continue
+            n_tasks = self.task_count(family, name)
+            if n_tasks is None:
+                if self._expand(family, stage):
+                    return 'worked'
+                waiting = True
+                continue
+            pending = sorted(set(range(n_tasks)) - self.done_tasks(family, name))
+            if not pending:
+                if self._merge(family, stage, n_tasks):
+                    return 'worked'
+                waiting = True
+                continue
+            # Workers start at different tasks so they rarely race for the same claim
+            random.shuffle(pending)
+            for index in pending:
+                if self._run_task(family, stage, index):
+                    return 'worked'
+            waiting = True
+        return 'waiting' if waiting else 'finished'
+
+    def work(self, poll_seconds=POLL_SECONDS, max_tasks=None, exit_when_idle=False):
+        """
+        Pull work until every stage of every family is finished.
+
+        Parameters:
+        - poll_seconds (float): Sleep between scans when there is nothing to claim.
+        - max_tasks (int): Stop after this many units of work.
+        - exit_when_idle (bool): Stop as soon as nothing can be claimed, instead of
+          waiting for the work held by other workers.
+
+        Returns:
+        - int: Units of work done by this worker.
+        """
+        done = 0
+        print(f"Worker {self.worker} pulling from {self.queue_dir}")
+        try:
+            while max_tasks is None or done < max_tasks:
+                done_before = done
+                entries = families(self.queue_dir)
+                # Workers start at different families so they spread out over the queue
+                offset = random.randrange(len(entries)) if entries else 0
+                states = []
+                for entry in entries[offset:] + entries[:offset]:
+                    stages = self.build_stages(entry['config'])
+                    state = self.step(entry['family'], stages)
+                    while state == 'worked':
+                        done += 1
+                        if max_tasks is not None and done >= max_tasks:
+                            break
+                        state = self.step(entry['family'], stages)
+                    states.append(state)
+                    if max_tasks is not None and done >= max_tasks:
+                        break
+                if all(state == 'finished' for state in states):
+                    break
+                if exit_when_idle and done == done_before:
+                    break
+                time.sleep(poll_seconds)
+        finally:
+            self.leases.close()
+        print(f"Worker {self.worker} finished after {done} unit(s) of work")
+        return done
+
+
+def status(queue_dir):
+    """
+    Progress of every stage of every family in the queue.
+
+    Returns:
+    - list: Dicts with family, stage, tasks (None before expansion), done, claimed and finished.
+    """
+    rows = []
+    for entry in families(queue_dir):
+        family = entry['family']
+        stages_dir = os.path.join(queue_dir, "stages", family)
+        names = sorted(name[:-5] for name in os.listdir(stages_dir) if name.endswith('.json')) \
+            if os.path.isdir(stages_dir) else []
+        for name in names:
+            tasks = _read_json(os.path.join(stages_dir, f"{name}.json"))['tasks']
+            done_dir = os.path.join(queue_dir, "done", family, name)
+            claims_dir = os.path.join(queue_dir, "claims", family, name)
+            rows.append({
+                'family': family, 'stage': name, 'tasks': tasks,
+                'done': len([d for d in os.listdir(done_dir) if d.endswith('.json')]) if os.path.isdir(done_dir) else 0,
+                'claimed': len([c for c in os.listdir(claims_dir) if c.isdigit()]) if os.path.isdir(claims_dir) else 0,
+                'finished': os.path.exists(os.path.join(queue_dir, "finished", family, f"{name}.json")),
+            })
+    return rows
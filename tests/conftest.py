@@ -0,0 +1,20 @@
+import os
+import sys
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, "src"))
+sys.path.insert(0, REPO_DIR)
+
+
+@pytest.fixture
+def pipeline_env(monkeypatch):
+    """Undo the environment and module state that a pipeline run in the test process sets up."""
+    import family_store
+    import structure_store
+    import tool_executor
+    for name in (family_store.SHARD_ENV, structure_store.STRUCTURE_CACHE_ENV, tool_executor.SLOT_DIR_ENV,
+                 tool_executor.BUDGET_ENV, tool_executor.TOOL_LIMITS_ENV):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setattr(structure_store, '_default_store', None)
+    monkeypatch.setattr(tool_executor, '_executor', None)
@@ -0,0 +1,71 @@
+import os
+import numpy as np
+import pytest
+import main_pipeline
+from all_vs_all import (prefilter_pairs, select_medoid, run_all_vs_all, load_pair_matrix, matrix_file_name,
+                        write_pair_candidates, pair_candidates, align_matrix_pair, merge_matrix_records)
+from benchmarks.synthetic_family import generate_family
+TOOLS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "tools")
+
+
+def test_prefilter_matches_pairwise_filters():
+    rng = np.random.default_rng(0)
+    n = 30
+    lengths = rng.integers(50, 100, n)
+    kmers = (rng.random((n, 40)) < 0.3).astype(float)
+    fingerprints = rng.dirichlet(np.ones(8), n)
+    i, j, candidates = prefilter_pairs(lengths, kmers, fingerprints, block_size=7)
+
+    expected = set()
+    for a in range(n):
+        for b in range(a + 1, n):
+            ratio = min(lengths[a], lengths[b]) / max(lengths[a], lengths[b])
+            similarity = kmers[a] @ kmers[b] / max(min(kmers[a].sum(), kmers[b].sum()), 1)
+            distance = np.abs(fingerprints[a] - fingerprints[b]).sum()
+            if ratio >= 0.7 and similarity >= 0.2 and distance <= 0.6:
+                expected.add((a, b))
+    assert candidates == n * (n - 1) // 2
+    assert set(zip(i.tolist(), j.tolist())) == expected
+
+
+def test_select_medoid_counts_pruned_pairs_as_zero():
+    tm_score = np.array([[1.0, 0.9, np.nan], [0.9, 1.0, 0.8], [np.nan, 0.8, 1.0]])
+    assert select_medoid(tm_score) == 1
+
+
+def test_run_all_vs_all_writes_medoid(tmp_path):
+    pdb_dir = str(tmp_path / 'fam')
+    generate_family(pdb_dir, n_members=4, length=40, seed=2)
+    run_all_vs_all(pdb_dir, str(tmp_path / 'tm'), 'fam', os.path.join(TOOLS_DIR, "TMalign"), workers=2)
+    matrix = load_pair_matrix(str(tmp_path / 'tm' / matrix_file_name('fam')))
+    assert list(matrix['names']) == sorted(os.listdir(pdb_dir))
+    assert str(matrix['medoid']) in matrix['names']
+    assert np.allclose(np.diag(matrix['tm_score']), 1.0)
+
+
+@pytest.mark.parametrize("reference, all_vs_all", [(None, False), ("a_ChainA.pdb", True)])
+def test_reference_selection_is_explicit(tmp_path, reference, all_vs_all):
+    with pytest.raises(ValueError):
+        main_pipeline.build_stages(str(tmp_path / 'in'), str(tmp_path / 'out'), reference, "mkdssp", "TMalign",
+                                   all_vs_all=all_vs_all)
+
+
+def test_pair_tasks_give_the_same_matrix(tmp_path):
+    pdb_dir = str(tmp_path / 'fam')
+    generate_family(pdb_dir, n_members=5, length=40, seed=3)
+    tm_align = os.path.join(TOOLS_DIR, "TMalign")
+    run_all_vs_all(pdb_dir, str(tmp_path / 'whole'), 'fam', tm_align, workers=2)
+
+    out = str(tmp_path / 'split')
+    candidates = pair_candidates(write_pair_candidates(pdb_dir, out, 'fam'))
+    for name1, name2 in candidates:
+        align_matrix_pair(pdb_dir, str(tmp_path / 'records'), name1, name2, tm_align)
+    merge_matrix_records(pdb_dir, str(tmp_path / 'records'), out, 'fam', tm_align)
+
+    whole = load_pair_matrix(str(tmp_path / 'whole' / matrix_file_name('fam')))
+    split = load_pair_matrix(os.path.join(out, matrix_file_name('fam')))
+    assert len(candidates) == (whole['evaluated'].sum() - 5) // 2
+    assert str(split['medoid']) == str(whole['medoid'])
+    for key in ('evaluated', 'aligned_length'):
+        assert (split[key] == whole[key]).all()
+    assert np.allclose(split['tm_score'], whole['tm_score'], equal_nan=True)
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from asa_extraction import parse_dssp, extract_asa_from_dssp, MAX_ASA
+
+HEADER = ("  #  RESIDUE AA STRUCTURE BP1 BP2  ACC     N-H-->O    O-->H-N    N-H-->O    O-->H-N"
+          "    TCO  KAPPA ALPHA  PHI   PSI    X-CA   Y-CA   Z-CA")
+
+# (resnum, insertion code, chain, amino acid, SS, ACC, four H-bonds, phi, psi)
+RESIDUES = [
+    (1, ' ', 'A', 'M', ' ', 182, ((0, 0.0), (2, -0.3), (0, 0.0), (45, -0.2)), 360.0, 152.4),
+    (2, ' ', 'A', 'K', 'E', 97, ((-1, -0.5), (3, -2.1), (12, -0.4), (-2, -0.1)), -120.5, 135.0),
+    (2, 'A', 'A', 'a', 'E', 12, ((-3, -1.8), (1, -0.2), (0, 0.0), (0, 0.0)), -98.3, 110.7),
+    (3, ' ', 'A', 'G', 'T', 55, ((0, 0.0), (0, 0.0), (0, 0.0), (0, 0.0)), 75.1, 20.9),
+    None,
+    (10, ' ', 'B', 'W', 'H', 4, ((-4, -2.6), (4, -2.4), (-3, -0.3), (3, -0.6)), -63.2, -41.8),
+    (11, ' ', 'B', 'L', 'H', 130, ((-4, -1.1), (0, 0.0), (0, 0.0), (0, 0.0)), -60.0, 360.0),
+]
+
+
+def dssp_line(index, residue):
+    if residue is None:
+        return f"{index:5d}        !              0   0    0      0, 0.0     0, 0.0     0, 0.0     0, 0.0" \
+               "   0.000 360.0 360.0 360.0 360.0    0.0    0.0    0.0"
+    resnum, icode, chain, aa, ss, acc, bonds, phi, psi = residue
+    hbonds = ''.join(f"{offset:6d},{energy:4.1f}" for offset, energy in bonds)
+    return (f"{index:5d}{resnum:5d}{icode}{chain} {aa}  {ss}{'':17}{acc:4d} {hbonds}"
+            f"  {0.1:6.3f}{20.0:6.1f}{-150.0:6.1f}{phi:6.1f}{psi:6.1f} {1.0:6.1f} {2.0:6.1f} {3.0:6.1f}")
+
+
+@pytest.fixture
+def dssp_file(tmp_path):
+    path = tmp_path / 'chain.dssp'
+    lines = ["==== Secondary Structure Definition by the program DSSP ====", "  2 CHAINS", HEADER]
+    lines += [dssp_line(index, residue) for index, residue in enumerate(RESIDUES, start=1)]
+    path.write_text('\n'.join(lines) + '\n')
+    return str(path)
+
+
+def test_parse_dssp_matches_biopython(dssp_file):
+    from Bio.PDB.DSSP import make_dssp_dict
+    expected, keys = make_dssp_dict(dssp_file)[:2]
+    table = parse_dssp(dssp_file)
+    assert len(table) == len(keys) == 6
+
+    for row, key in zip(table.itertuples(index=False), keys):
+        chain, (_, resnum, icode) = key
+        aa, ss, acc, phi, psi = expected[key][:5]
+        energies = expected[key][7:14:2]
+        assert (row.Chain, row.ResidueNumber, row.InsertionCode or ' ') == (chain, resnum, icode)
+        assert (row.AminoAcid, row.SecondaryStructure, row.ASA) == (aa, ss, acc)
+        assert (row.Phi, row.Psi) == (phi, psi)
+        assert [row.NH_O_1_Energy, row.O_HN_1_Energy, row.NH_O_2_Energy, row.O_HN_2_Energy] == list(energies)
+
+
+def test_relative_asa(dssp_file):
+    table = parse_dssp(dssp_file)
+    # The disulfide-bonded cysteine ('a') is scaled by the cysteine maximum
+    assert np.isclose(table['RelativeASA'][2], 12 / MAX_ASA['C'])
+    chain_b = extract_asa_from_dssp(dssp_file, 'B')
+    assert chain_b['Residue_Number'].tolist() == [10, 11]
+    assert np.allclose(chain_b['Relative_ASA'], [4 / MAX_ASA['W'], 130 / MAX_ASA['L']])
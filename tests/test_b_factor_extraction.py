@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+from Bio.PDB import PDBParser
+import family_store
+from b_factor_extraction import chain_z_scores, extract_b_factors, extract_ensemble_b_factors, store_pdb_file
+
+
+def atom(serial, name, resname, chain, resnum, xyz, altloc=' ', occupancy=1.0, bfactor=10.0, record='ATOM'):
+    x, y, z = xyz
+    return (f"{record:<6}{serial:5d} {name:<4}{altloc}{resname:>3} {chain}{resnum:>4}    "
+            f"{x:8.3f}{y:8.3f}{z:8.3f}{occupancy:6.2f}{bfactor:6.2f}          {name[0]:>2}")
+
+
+def write_pdb(path, rng):
+    lines, serial = [], 1
+    for chain in 'AB':
+        for resnum in range(1, 7):
+            for name in ('N', 'CA', 'C', 'O'):
+                xyz = rng.uniform(-20, 20, 3)
+                if chain == 'A' and resnum == 3 and name == 'CA':
+                    # The B altloc has the higher occupancy and is the one kept
+                    lines.append(atom(serial, name, 'GLY', chain, resnum, xyz, 'A', 0.4, 80.0))
+                    lines.append(atom(serial + 1, name, 'GLY', chain, resnum, xyz + 0.5, 'B', 0.6, 20.0))
+                    serial += 2
+                    continue
+                lines.append(atom(serial, name, 'GLY', chain, resnum, xyz, bfactor=rng.uniform(5, 60)))
+                serial += 1
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines + ['END']) + '\n')
+    return path
+
+
+def biopython_b_factors(path):
+    rows = []
+    for chain in PDBParser(QUIET=True).get_structure('s', path)[0]:
+        for residue in chain:
+            bfactors = [a.get_bfactor() for a in residue]
+            rows.append((chain.id, residue.id[1], np.mean(bfactors), np.max(bfactors), residue['CA'].get_bfactor()))
+    return pd.DataFrame(rows, columns=['Chain', 'ResidueNumber', 'AverageBFactor', 'MaxBFactor', 'CABFactor'])
+
+
+def test_residue_b_factors_match_biopython(tmp_path):
+    path = write_pdb(str(tmp_path / 'two_chains.pdb'), np.random.default_rng(0))
+    table = extract_b_factors(path)
+    expected = biopython_b_factors(path)
+    columns = list(expected.columns)
+    pd.testing.assert_frame_equal(table[columns], expected, check_dtype=False)
+    assert table.loc[(table['Chain'] == 'A') & (table['ResidueNumber'] == 3), 'CABFactor'].item() == 20.0
+
+    for _, chain in table.groupby('Chain'):
+        average = chain['AverageBFactor']
+        assert np.allclose(chain['NormalizedBFactor'], (average - average.mean()) / average.std(ddof=0))
+
+
+def test_chain_z_scores_skip_missing_values():
+    values = np.array([1.0, 3.0, np.nan, 5.0, 5.0, np.nan])
+    groups = np.array([0, 0, 0, 1, 1, 2])
+    z = chain_z_scores(values, groups)
+    assert np.allclose(z[:2], [-1, 1]) and np.isnan(z[2])
+    # Constant groups give 0, groups without values stay NaN
+    assert z[3:5].tolist() == [0.0, 0.0] and np.isnan(z[5])
+
+
+def test_stored_rows_are_replaced_per_structure(tmp_path):
+    path = write_pdb(str(tmp_path / 'two_chains.pdb'), np.random.default_rng(1))
+    store = str(tmp_path / 'fam_b_factors.fstore')
+    assert store_pdb_file(path, store) == store
+    assert store_pdb_file(path, store, ensemble=True) == store
+    stored = family_store.read_table(store)
+    assert (stored['Structure'] == 'two_chains').all()
+    pd.testing.assert_frame_equal(stored.drop(columns='Structure'), extract_ensemble_b_factors(path),
+                                  check_dtype=False)
+
+    with open(path, 'w') as f:
+        f.write('END\n')
+    assert store_pdb_file(path, store) is None
+    assert family_store.read_table(store).empty
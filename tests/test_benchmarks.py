@@ -0,0 +1,51 @@
+import os
+import gzip
+import json
+import numpy as np
+from structure_store import Structure
+from benchmarks.synthetic_family import generate_family
+from benchmarks import run_benchmarks
+
+
+def read_pdb(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt') as f:
+        return f.read()
+
+
+def test_family_members_are_trimmed_copies(tmp_path):
+    paths = generate_family(str(tmp_path / 'fam'), n_members=12, length=40, max_trim=3, seed=1)
+    assert [os.path.basename(path) for path in paths] == [f"member_{i:02d}.pdb" for i in range(12)]
+    residues = set()
+    for path in paths:
+        structure = Structure.from_pdb(path)
+        numbers = structure.res_resnum.tolist()
+        # Trimmed termini keep the family numbering
+        assert numbers == list(range(numbers[0], numbers[-1] + 1))
+        assert numbers[0] <= 4 and numbers[-1] >= 37
+        assert structure.atom_name.tolist()[:4] == ['N', 'CA', 'C', 'O']
+        residues.add((numbers[0], numbers[-1]))
+    assert len(residues) > 1
+
+
+def test_seed_fixes_the_family(tmp_path):
+    first = generate_family(str(tmp_path / 'a'), n_members=3, length=25, seed=4)
+    again = generate_family(str(tmp_path / 'b'), n_members=3, length=25, seed=4, compress=True)
+    other = generate_family(str(tmp_path / 'c'), n_members=3, length=25, seed=5)
+    assert all(path.endswith('.pdb.gz') for path in again)
+    assert [read_pdb(path) for path in first] == [read_pdb(path) for path in again]
+    assert read_pdb(first[0]) != read_pdb(other[0])
+
+
+def test_benchmark_report_covers_every_stage(tmp_path, pipeline_env):
+    output = str(tmp_path / 'results.json')
+    run_benchmarks.main(['--sizes', '4', '--length', '30', '--workers', '2', '--output', output])
+    with open(output) as f:
+        report = json.load(f)
+    stages = [record['stage'] for record in report['results']]
+    assert {'extract_chainA', 'tm_align', 'phi_psi', 'residue_mapping', 'delta_phi_psi', 'entropy', 'dssp',
+            'b_factors', 'rmsd', 'asa', 'correlation'} <= set(stages)
+    for record in report['results']:
+        assert record['error'] is None and record['failed'] == 0, record
+        assert record['family_size'] == 4 and record['seconds'] >= 0
+        assert np.isfinite(record['peak_rss_mb'])
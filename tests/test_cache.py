@@ -0,0 +1,80 @@
+import os
+from cache import Manifest
+from scheduler import Stage, run_stages
+
+
+def copy_upper(source, target, suffix):
+    with open(source) as f:
+        text = f.read()
+    with open(target, 'w') as f:
+        f.write(text.upper() + suffix)
+
+
+def write_nothing(source, target, suffix):
+    pass
+
+
+def run(tmp_path, source, target, suffix='', func=copy_upper):
+    manifest = Manifest(str(tmp_path))
+    stage = Stage('upper', func, items=lambda: [(source, target, suffix)],
+                  inputs=lambda source, target, suffix: [source],
+                  outputs=lambda source, target, suffix: [target], params={'suffix': suffix})
+    return run_stages([stage], workers=1, manifest=manifest)['upper']
+
+
+def test_unchanged_items_are_cached(tmp_path):
+    source, target = str(tmp_path / 'in.txt'), str(tmp_path / 'out.txt')
+    with open(source, 'w') as f:
+        f.write('abc')
+    assert run(tmp_path, source, target)['cached'] == 0
+    assert run(tmp_path, source, target)['cached'] == 1
+    with open(target) as f:
+        assert f.read() == 'ABC'
+
+
+def test_changed_input_param_or_output_invalidates(tmp_path):
+    source, target = str(tmp_path / 'in.txt'), str(tmp_path / 'out.txt')
+    with open(source, 'w') as f:
+        f.write('abc')
+    run(tmp_path, source, target)
+
+    with open(source, 'w') as f:
+        f.write('xyz')
+    assert run(tmp_path, source, target)['cached'] == 0
+    with open(target) as f:
+        assert f.read() == 'XYZ'
+
+    assert run(tmp_path, source, target, suffix='!')['cached'] == 0
+    with open(target) as f:
+        assert f.read() == 'XYZ!'
+
+    os.remove(target)
+    assert run(tmp_path, source, target, suffix='!')['cached'] == 0
+    assert os.path.exists(target)
+    assert run(tmp_path, source, target, suffix='!')['cached'] == 1
+
+
+def test_item_without_outputs_is_not_recorded(tmp_path):
+    source, target = str(tmp_path / 'in.txt'), str(tmp_path / 'out.txt')
+    with open(source, 'w') as f:
+        f.write('abc')
+    assert run(tmp_path, source, target, func=write_nothing)['failed'] == 1
+    assert Manifest(str(tmp_path)).items.get('upper', {}) == {}
+    assert run(tmp_path, source, target, func=write_nothing)['cached'] == 0
+
+
+def test_item_key_depends_on_stage_code(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    first = manifest.item_key(copy_upper, ('a',), [])
+    assert first == manifest.item_key(copy_upper, ('a',), [])
+    assert first != manifest.item_key(write_nothing, ('a',), [])
+    # Editing the module that defines the stage function changes its code digest
+    module = tmp_path / 'stage_module.py'
+    module.write_text('def stage():\n    return 1\n')
+    namespace = {}
+    exec(compile(module.read_text(), str(module), 'exec'), namespace)
+    stage = namespace['stage']
+    stage.__module__ = 'stage_module'
+    before = manifest.item_key(stage, (), [])
+    module.write_text('def stage():\n    return 2\n')
+    assert manifest.item_key(stage, (), []) != before
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+from calculate_phi_psi import standard_angles, dihedral_angles, ensemble_angles
+from benchmarks.synthetic_family import generate_family
+
+
+def biopython_angles(pdb_path):
+    # The per-residue Bio.PDB loop the pipeline used before the batched implementation
+    from Bio.PDB import PDBParser, calc_dihedral
+    from Bio.PDB.Polypeptide import is_aa, protein_letters_3to1
+    rows = []
+    for model in PDBParser(QUIET=True).get_structure('s', pdb_path):
+        for chain in model:
+            residues = list(chain)
+            for i, residue in enumerate(residues):
+                if not is_aa(residue, standard=True) or i == 0 or i == len(residues) - 1:
+                    continue
+                try:
+                    phi = calc_dihedral(residues[i - 1]['C'].get_vector(), residue['N'].get_vector(),
+                                        residue['CA'].get_vector(), residue['C'].get_vector())
+                    psi = calc_dihedral(residue['N'].get_vector(), residue['CA'].get_vector(),
+                                        residue['C'].get_vector(), residues[i + 1]['N'].get_vector())
+                except KeyError:
+                    continue
+                rows.append((residue.get_id()[1], protein_letters_3to1[residue.get_resname()],
+                             np.degrees(phi), np.degrees(psi)))
+    return rows
+
+
+def test_standard_angles_match_biopython(tmp_path):
+    path = generate_family(str(tmp_path), n_members=1, length=60, noise=0.05, loop_noise=0.05, seed=3)[0]
+    # A water after the chain has no N atom, so the last residue keeps an undefined psi
+    with open(path) as f:
+        lines = [line for line in f if line != "END\n"]
+    lines.append("HETATM  999  O   HOH A 100      10.000  10.000  10.000  1.00 20.00           O\nEND\n")
+    with open(path, 'w') as f:
+        f.writelines(lines)
+
+    angles = standard_angles(path)
+    expected = biopython_angles(path)
+    assert len(angles) == len(expected) > 40
+    assert angles['ResidueNumber'].tolist() == [row[0] for row in expected]
+    assert angles['ResidueName'].tolist() == [row[1] for row in expected]
+    assert np.allclose(angles['Phi'], [row[2] for row in expected], atol=1e-3)
+    assert np.allclose(angles['Psi'], [row[3] for row in expected], atol=1e-3)
+
+
+def test_alternate_locations_follow_biopython(tmp_path):
+    path = generate_family(str(tmp_path), n_members=1, length=30, noise=0.05, loop_noise=0.05, max_trim=0, seed=4)[0]
+    with open(path) as f:
+        lines = f.readlines()
+    disordered = []
+    for line in lines:
+        if line.startswith('ATOM') and int(line[22:26]) == 10:
+            # A weaker altloc A listed first, moved by 0.8 Angstrom, then the original as altloc B
+            moved = f"{float(line[30:38]) + 0.8:8.3f}"
+            disordered.append(line[:16] + 'A' + line[17:30] + moved + line[38:54] + '  0.30' + line[60:])
+            disordered.append(line[:16] + 'B' + line[17:54] + '  0.70' + line[60:])
+        else:
+            disordered.append(line)
+    with open(path, 'w') as f:
+        f.writelines(disordered)
+
+    angles = standard_angles(path)
+    expected = biopython_angles(path)
+    assert angles['ResidueNumber'].tolist() == [row[0] for row in expected]
+    assert np.allclose(angles['Phi'], [row[2] for row in expected], atol=1e-3)
+    assert np.allclose(angles['Psi'], [row[3] for row in expected], atol=1e-3)
+
+
+def test_dihedral_sign_and_missing_atoms():
+    p0, p1, p2 = np.array([[1.0, 0, 0]]), np.array([[0.0, 0, 0]]), np.array([[0.0, 1, 0]])
+    assert np.allclose(dihedral_angles(p0, p1, p2, np.array([[0.0, 1, 1]])), -90.0)
+    assert np.allclose(dihedral_angles(p0, p1, p2, np.array([[0.0, 1, -1]])), 90.0)
+    assert np.isnan(dihedral_angles(p0, p1, p2, np.array([[np.nan, 1, 1]]))).all()
+
+
+def test_ensemble_angles_are_keyed_by_model(tmp_path):
+    members = generate_family(str(tmp_path / 'fam'), n_members=3, length=30, seed=5)
+    path = str(tmp_path / 'ensemble.pdb')
+    with open(path, 'w') as out:
+        for model, member in enumerate(members):
+            out.write(f"MODEL     {model + 1:4d}\n")
+            with open(member) as f:
+                out.writelines(line for line in f if line.startswith('ATOM'))
+            out.write("ENDMDL\n")
+        out.write("END\n")
+
+    streamed = ensemble_angles(path)
+    pd.testing.assert_frame_equal(streamed, standard_angles(path, ensemble=True))
+    assert streamed['Model'].unique().tolist() == [0, 1, 2]
+    for model, member in enumerate(members):
+        single = streamed[streamed['Model'] == model].drop(columns='Model').reset_index(drop=True)
+        pd.testing.assert_frame_equal(single, standard_angles(member))
@@ -0,0 +1,40 @@
+import os
+import sys
+import json
+import subprocess
+import pytest
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ('scipy', 'Bio', 'pymol', 'matplotlib', 'seaborn')
+
+
+def loaded_modules(code, cwd):
+    """Top-level modules loaded by `code`, run in a fresh interpreter that prints them as JSON."""
+    script = (f"import sys; sys.path[:0] = [{REPO_DIR!r}, {os.path.join(REPO_DIR, 'src')!r}]\n{code}\n"
+              "import json; print(json.dumps(sorted({name.split('.')[0] for name in sys.modules})))")
+    result = subprocess.run([sys.executable, '-c', script], cwd=cwd, capture_output=True, text=True, check=True)
+    return set(json.loads(result.stdout.splitlines()[-1]))
+
+
+def test_help_does_not_import_stages(tmp_path):
+    result = subprocess.run([sys.executable, os.path.join(REPO_DIR, 'cli.py'), '--help'], cwd=tmp_path,
+                            capture_output=True, text=True)
+    assert result.returncode == 0 and 'queue-work' in result.stdout
+    modules = loaded_modules("import cli; cli.build_parser()", tmp_path)
+    assert not modules & {'numpy', 'pandas', 'main_pipeline', 'entropy_calculation', *HEAVY_MODULES}
+
+
+def test_single_stage_imports_only_its_module(tmp_path):
+    os.makedirs(tmp_path / 'agg')
+    modules = loaded_modules(f"import cli; cli.main(['entropy', {str(tmp_path / 'agg')!r}, "
+                             f"{str(tmp_path / 'out')!r}])", tmp_path)
+    assert 'entropy_calculation' in modules
+    assert not modules & {'main_pipeline', 'calculate_phi_psi', 'run_dssp', *HEAVY_MODULES}
+
+
+@pytest.mark.parametrize('module', ['main_pipeline'] + sorted(
+    name[:-3] for name in os.listdir(os.path.join(REPO_DIR, 'src')) if name.endswith('.py')))
+def test_stage_modules_import_without_side_effects(tmp_path, module):
+    modules = loaded_modules(f"import {module}", tmp_path)
+    assert module in modules and not modules & set(HEAVY_MODULES)
+    assert os.listdir(tmp_path) == []
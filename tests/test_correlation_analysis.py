@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
+import correlation_analysis
+from correlation_analysis import correlate, correlation_summary, process_families
+
+
+def metrics_table(rng, families=('fam_a', 'fam_b'), n=40):
+    tables = []
+    for family in families:
+        entropy = rng.uniform(0, 4, n)
+        tables.append(pd.DataFrame({'Family': family, 'RefResidueNumber': np.arange(n), 'PhiEntropy': entropy,
+                                    'PsiEntropy': rng.uniform(0, 4, n), 'Mean_RMSD': entropy + rng.normal(0, 1, n),
+                                    'NormalizedBFactor': rng.normal(size=n), 'Relative_ASA': rng.uniform(0, 1, n)}))
+    return pd.concat(tables, ignore_index=True)
+
+
+def test_coefficients_match_scipy():
+    rng = np.random.default_rng(0)
+    x, y = rng.normal(size=50), rng.normal(size=50)
+    y[:10] = x[:10]
+    pearson, pearson_p, spearman, spearman_p = correlate(x, y, np.zeros(50), n_permutations=2000)
+    assert np.isclose(pearson, stats.pearsonr(x, y)[0])
+    assert np.isclose(spearman, stats.spearmanr(x, y)[0])
+    # Permutation p-values are close to the analytic ones
+    assert abs(pearson_p - stats.pearsonr(x, y)[1]) < 0.05
+    assert 1 / 2001 <= spearman_p <= 1
+
+
+def test_summary_is_reproducible_for_a_seed(tmp_path):
+    metrics = metrics_table(np.random.default_rng(1))
+    first = correlation_summary(metrics, n_permutations=300, workers=1, seed=3)
+    pd.testing.assert_frame_equal(first, correlation_summary(metrics, n_permutations=300, workers=2, seed=3))
+    assert not first['PearsonP'].equals(correlation_summary(metrics, n_permutations=300, workers=1, seed=4)['PearsonP'])
+    assert sorted(first['Family'].unique()) == ['all', 'fam_a', 'fam_b']
+
+    metrics.to_csv(tmp_path / 'fam_metrics.csv', index=False)
+    summary = pd.read_csv(process_families(str(tmp_path), str(tmp_path / 'summary.csv'), 300, 1, seed=3))
+    assert np.allclose(summary['PearsonP'], first['PearsonP'], equal_nan=True)
+    without = correlation_summary(metrics, n_permutations=0, workers=1)
+    assert without['PearsonP'].isna().all() and np.allclose(without['Pearson'], first['Pearson'], equal_nan=True)
+
+
+def test_store_variant_passes_permutation_options(tmp_path, monkeypatch):
+    metrics = metrics_table(np.random.default_rng(2), families=('fam',))
+    calls = []
+
+    def recording_summary(table, *options):
+        calls.append(options)
+        return correlation_summary(table, *options)
+
+    monkeypatch.setattr(correlation_analysis, 'family_metrics', lambda *args: metrics)
+    monkeypatch.setattr(correlation_analysis, 'correlation_summary', recording_summary)
+    correlation_analysis.process_family_store('fam', 'ref_ChainA.pdb', None, None, None, str(tmp_path),
+                                              n_permutations=50, workers=1, seed=7)
+    assert calls == [(50, 1, 7)]
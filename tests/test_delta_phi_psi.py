@@ -0,0 +1,52 @@
+import os
+import numpy as np
+import pandas as pd
+import family_store
+from delta_phi_psi import calculate_deltas, join_deltas, model_angle_tables, process_family
+
+
+def angle_table(rng, residues):
+    return pd.DataFrame({'ResidueNumber': residues, 'Phi': rng.uniform(-180, 180, len(residues)),
+                         'Psi': rng.uniform(-180, 180, len(residues))})
+
+
+def test_join_matches_per_residue_lookup():
+    rng = np.random.default_rng(0)
+    ref = angle_table(rng, np.arange(1, 61))
+    target = angle_table(rng, np.arange(5, 70))
+    ref_resnums = np.arange(1, 61)
+    target_resnums = ref_resnums + 4
+    # Residues missing from either table are skipped
+    ref = ref[ref['ResidueNumber'] != 10]
+    target = target[target['ResidueNumber'] != 30]
+
+    expected = calculate_deltas(dict(zip(ref_resnums.tolist(), target_resnums.tolist())),
+                                ref.set_index('ResidueNumber'), target.set_index('ResidueNumber'))
+    joined = join_deltas(ref_resnums, target_resnums, model_angle_tables(ref)[0], model_angle_tables(target)[0])
+    pd.testing.assert_frame_equal(joined, expected, check_dtype=False)
+    assert joined['DeltaPhi'].between(0, 180).all()
+
+
+def test_family_table_from_csv_files_and_store(tmp_path):
+    rng = np.random.default_rng(1)
+    names = ['ref_ChainA', 't1_ChainA', 't2_ChainA']
+    tables = {name: angle_table(rng, np.arange(1, 31)) for name in names}
+    angles_dir, store = tmp_path / 'angles', str(tmp_path / 'fam_angles.fstore')
+    os.makedirs(angles_dir)
+    for name, table in tables.items():
+        table.to_csv(angles_dir / f'{name}_angles.csv', index=False)
+        family_store.append_table(store, table.assign(Structure=name, Model=0))
+
+    mapping_path = str(tmp_path / 'fam_mapping.npz')
+    np.savez(mapping_path, target=np.array(['t1_ChainA.pdb', 't2_ChainA.pdb']),
+             reference=np.array(['ref_ChainA.pdb', 'ref_ChainA.pdb']), offsets=np.array([0, 20, 45]),
+             ref_resnum=np.concatenate([np.arange(1, 21), np.arange(1, 26)]),
+             target_resnum=np.concatenate([np.arange(13, 33), np.arange(1, 26)]))
+
+    os.makedirs(tmp_path / 'csv')
+    from_csv = pd.read_csv(process_family(mapping_path, str(angles_dir), str(tmp_path / 'csv'), 'fam'))
+    from_store = pd.read_csv(process_family(mapping_path, None, str(tmp_path), 'fam', store))
+    pd.testing.assert_frame_equal(from_csv, from_store)
+    # Residues 31 and 32 of t1 have no angles, so their mapped pairs drop out
+    assert from_csv.groupby('Target').size().to_dict() == {'t1_ChainA': 18, 't2_ChainA': 25}
+    assert (from_csv['Reference'] == 'ref_ChainA').all()
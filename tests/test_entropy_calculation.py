@@ -0,0 +1,62 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from entropy_calculation import process_file, process_files, calculate_histogram_entropy
+
+
+@pytest.fixture
+def aggregated(tmp_path):
+    rng = np.random.default_rng(0)
+    n = 5000
+    table = pd.DataFrame({'Target': [f't{i}' for i in rng.integers(0, 40, n)],
+                          'RefResidueNumber': rng.integers(1, 60, n),
+                          'DeltaPhi': rng.uniform(0, 180, n),
+                          'DeltaPsi': rng.choice([0.0, 90.0, 180.0, 360.0, np.nan, 10.5, 400.0], n)})
+    table.loc[table['RefResidueNumber'] == 5, 'DeltaPhi'] = np.nan
+    path = tmp_path / 'agg_fam.csv'
+    table.to_csv(path, index=False)
+    return table, str(path)
+
+
+def test_entropies_match_per_residue_histograms(aggregated, tmp_path):
+    table, path = aggregated
+    output = str(tmp_path / 'entropy_fam.csv')
+    process_file(path, output, 50, 60, sweep=(12, 36))
+    result = pd.read_csv(output)
+
+    # The per-residue groupby the pipeline used before the batched implementation
+    kept = table[table['RefResidueNumber'] <= 50]
+    assert result['RefResidueNumber'].tolist() == sorted(kept['RefResidueNumber'].unique())
+    for column, angle in (('PhiEntropy', 'DeltaPhi'), ('PsiEntropy', 'DeltaPsi')):
+        for bins, suffix in ((60, ''), (12, '_12'), (36, '_36')):
+            expected = kept.groupby('RefResidueNumber')[angle].apply(lambda x: calculate_histogram_entropy(x, bins))
+            assert np.allclose(result[column + suffix], expected.to_numpy(), equal_nan=True)
+    assert np.isnan(result.loc[result['RefResidueNumber'] == 5, 'PhiEntropy']).all()
+
+
+def test_bootstrap_columns(aggregated, tmp_path):
+    _, path = aggregated
+    output = str(tmp_path / 'entropy_fam.csv')
+    process_file(path, output, None, 60, n_boot=50)
+    result = pd.read_csv(output)
+    for angle in ('Phi', 'Psi'):
+        valid = result[f'{angle}Entropy'].notna()
+        assert (result.loc[valid, f'{angle}EntropyMM'] >= result.loc[valid, f'{angle}Entropy']).all()
+        assert (result.loc[valid, f'{angle}CILow'] <= result.loc[valid, f'{angle}CIHigh']).all()
+
+
+def test_errors_are_raised(tmp_path):
+    path = tmp_path / 'agg_bad.csv'
+    path.write_text('Something\n1\n')
+    with pytest.raises(KeyError):
+        process_file(str(path), str(tmp_path / 'out.csv'), None, 60)
+
+
+def test_batch_finishes_before_raising(aggregated, tmp_path):
+    _, path = aggregated
+    input_dir = tmp_path
+    (input_dir / 'agg_bad.csv').write_text('Something\n1\n')
+    with pytest.raises(RuntimeError, match='agg_bad.csv'):
+        process_files(str(input_dir), str(tmp_path / 'out'), {}, 60)
+    assert os.path.exists(tmp_path / 'out' / 'entropy_fam.csv')
@@ -0,0 +1,52 @@
+import gzip
+from extract_ChainA import extract_chain, select_chain, list_structure_files, structure_name
+
+
+def atom(serial, chain, resnum, name='CA', resname='ALA', record='ATOM'):
+    return (f"{record:<6}{serial:5d}  {name:<3} {resname} {chain}{resnum:4d}    "
+            f"{1.0:8.3f}{2.0:8.3f}{3.0:8.3f}{1.00:6.2f}{20.0:6.2f}           C\n")
+
+
+# A water chain listed first, then a short chain A and a longer chain B, in two models
+MODEL = ([atom(1, 'W', 1, 'O', 'HOH', 'HETATM')]
+         + [atom(2, 'A', 1), atom(3, 'A', 2), "TER       4      ALA A   2\n"]
+         + [atom(5, 'B', 1), atom(6, 'B', 2), atom(7, 'B', 3), "TER       8      ALA B   3\n"])
+LINES = ["HEADER    TEST\n", "MODEL        1\n", *MODEL, "ENDMDL\n", "MODEL        2\n", *MODEL, "ENDMDL\n", "END\n"]
+
+
+def write(path, lines, compress=False):
+    with (gzip.open(path, 'wt') if compress else open(path, 'w')) as f:
+        f.writelines(lines)
+    return str(path)
+
+
+def test_chain_policies(tmp_path):
+    path = write(tmp_path / '1abc.pdb', LINES)
+    assert select_chain(path, 'first') == 'A'
+    assert select_chain(path, 'longest') == 'B'
+    assert select_chain(path, 'B') == 'B'
+    assert select_chain(path, 'W') is None
+    assert select_chain(write(tmp_path / 'water.pdb', [MODEL[0]]), 'first') is None
+
+
+def test_extract_first_model_from_gzip(tmp_path):
+    path = write(tmp_path / '1abc.pdb.gz', LINES, compress=True)
+    output = extract_chain(path, str(tmp_path), 'first')
+    assert output == str(tmp_path / '1abc_ChainA.pdb')
+    with open(output) as f:
+        lines = f.readlines()
+    assert lines == [MODEL[1], MODEL[2], MODEL[3], "END\n"]
+
+
+def test_extract_all_models(tmp_path):
+    path = write(tmp_path / '1abc.pdb', LINES)
+    with open(extract_chain(path, str(tmp_path), 'longest', all_models=True)) as f:
+        lines = f.readlines()
+    assert lines == (["MODEL        1\n", *MODEL[4:], "ENDMDL\n", "MODEL        2\n", *MODEL[4:], "ENDMDL\n", "END\n"])
+    assert extract_chain(path, str(tmp_path), 'Z') is None
+
+
+def test_structure_files(tmp_path):
+    for name in ('b.pdb', 'a.ent.gz', 'c.cif', '.hidden.pdb'):
+        (tmp_path / name).write_text('')
+    assert [structure_name(path) for path in list_structure_files(str(tmp_path))] == ['a', 'b']
@@ -0,0 +1,90 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import family_store
+
+
+def angles(structure, residues, value):
+    return pd.DataFrame({'Structure': structure, 'ResidueNumber': residues,
+                         'ResidueName': ['A'] * len(residues), 'Phi': np.full(len(residues), value)})
+
+
+def test_append_supersede_and_compact(tmp_path):
+    path = str(tmp_path / 'fam_angles.fstore')
+    family_store.append_table(path, angles('s1', [1, 2, 3], 10.0))
+    family_store.append_table(path, angles('s2', [1, 2], 20.0))
+    # A re-run of s1 replaces its rows
+    family_store.append_table(path, angles('s1', [1, 2], 30.0))
+
+    table = family_store.read_table(path)
+    assert table['Structure'].tolist() == ['s2', 's2', 's1', 's1']
+    assert table['Phi'].tolist() == [20.0, 20.0, 30.0, 30.0]
+    assert family_store.read_table(path, filters={'ResidueNumber': (2, None)})['Structure'].tolist() == ['s2', 's1']
+
+    family_store.remove_source(path, 's2')
+    assert family_store.read_table(path)['Structure'].tolist() == ['s1', 's1']
+    before = family_store.read_table(path)
+    family_store.compact(path)
+    headers, _ = family_store.chunk_headers(path)
+    assert len(headers) == 1
+    pd.testing.assert_frame_equal(family_store.read_table(path), before)
+
+
+def test_truncated_tail_is_ignored_and_dropped(tmp_path):
+    path = str(tmp_path / 'fam_angles.fstore')
+    family_store.append_table(path, angles('s1', [1, 2], 10.0))
+    complete = os.path.getsize(path)
+    family_store.append_table(path, angles('s2', [1, 2], 20.0))
+    # An interrupted writer leaves part of its chunk behind
+    with open(path, 'r+b') as f:
+        f.truncate(complete + (os.path.getsize(path) - complete) // 2)
+
+    assert family_store.read_table(path)['Structure'].tolist() == ['s1', 's1']
+    family_store.append_table(path, angles('s3', [5], 50.0))
+    table = family_store.read_table(path)
+    assert table['Structure'].tolist() == ['s1', 's1', 's3']
+    assert table['Phi'].tolist() == [10.0, 10.0, 50.0]
+
+
+def test_shards_merge_into_the_table(tmp_path):
+    path = str(tmp_path / 'fam_angles.fstore')
+    family_store.append_table(path, angles('s1', [1], 10.0))
+    try:
+        family_store.set_shard('worker-1')
+        family_store.append_table(path, angles('s1', [1], 11.0))
+        family_store.append_table(path, angles('s2', [1], 20.0))
+    finally:
+        family_store.set_shard(None)
+    assert family_store.read_table(path)['Phi'].tolist() == [10.0]
+    assert family_store.merge_shards(path) == 2
+    assert family_store.read_table(path)['Phi'].tolist() == [11.0, 20.0]
+    assert not os.path.exists(os.path.join(str(tmp_path), family_store.SHARD_DIR))
+
+
+def test_appends_only_read_chunks_after_the_recorded_tail(tmp_path, monkeypatch):
+    path = str(tmp_path / 'fam_angles.fstore')
+    family_store.append_table(path, angles('s1', [1, 2], 10.0))
+    scanned = []
+    scan = family_store._scan_chunks
+
+    def counting_scan(f, position, size):
+        headers, end = scan(f, position, size)
+        scanned.append(headers)
+        return headers, end
+
+    monkeypatch.setattr(family_store, '_scan_chunks', counting_scan)
+    for i in range(2, 6):
+        family_store.append_table(path, angles(f's{i}', [1], float(i)))
+    assert [len(headers) for headers in scanned] == [0, 0, 0, 0]
+
+    # A chunk whose writer died before recording the tail is still checked and kept
+    chunk = family_store._encode_chunk(dict(angles('s6', [1], 6.0)), ['s6'])
+    with open(path, 'ab') as f:
+        f.write(chunk)
+    family_store.append_table(path, angles('s7', [1], 7.0))
+    assert len(scanned[-1]) == 1
+    assert family_store.read_table(path)['Structure'].tolist() == ['s1', 's1', 's2', 's3', 's4', 's5', 's6', 's7']
+
+    with pytest.raises(ValueError):
+        family_store.append_table(path, pd.DataFrame({'Structure': ['s8'], 'Psi': [1.0]}))
@@ -0,0 +1,67 @@
+import os
+import numpy as np
+import pandas as pd
+import cli
+import family_store
+from calculate_phi_psi import standard_angles
+from benchmarks.synthetic_family import generate_family
+TOOLS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "tools")
+
+
+def write_ensembles(input_dir, members, n_models):
+    """Group consecutive members into multi-model files ens_<i>.pdb, one MODEL block per member."""
+    os.makedirs(input_dir)
+    for start in range(0, len(members), n_models):
+        with open(os.path.join(input_dir, f"ens_{start // n_models}.pdb"), 'w') as out:
+            for model, member in enumerate(members[start:start + n_models]):
+                out.write(f"MODEL     {model + 1:4d}\n")
+                with open(member) as f:
+                    out.writelines(line for line in f if line.startswith(('ATOM', 'TER')))
+                out.write("ENDMDL\n")
+            out.write("END\n")
+
+
+def run(tmp_path, *options):
+    generate_family(str(tmp_path / 'fam'), n_members=4, length=40, seed=4)
+    return run_family(tmp_path, "member_0_ChainA.pdb", *options)
+
+
+def run_family(tmp_path, reference, *options):
+    output_dir = str(tmp_path / 'out')
+    cli.main(["run", str(tmp_path / 'fam'), output_dir, "--reference", reference, "--workers", "2",
+              "--tm-align-path", os.path.join(TOOLS_DIR, "TMalign"),
+              "--dssp-executable", os.path.join(TOOLS_DIR, "mkdssp"), *options])
+    return output_dir
+
+
+def test_run_passes_entropy_options(tmp_path, pipeline_env):
+    output_dir = run(tmp_path, "--entropy-bins", "36", "--entropy-sweep", "12", "--entropy-bootstrap", "20")
+    entropy = pd.read_csv(os.path.join(output_dir, "entropy", "entropy_fam.csv"))
+    assert {'PhiEntropy_12', 'PsiEntropy_12', 'PhiCILow', 'PsiCIHigh'} <= set(entropy.columns)
+    assert 'PhiEntropy_120' not in entropy.columns
+
+
+def test_run_passes_rmsd_trim_cutoff(tmp_path, pipeline_env):
+    output_dir = run(tmp_path, "--rmsd-trim-cutoff", "0.2")
+    summary = pd.read_csv(os.path.join(output_dir, "rmsd", "fam_superposition_rmsd.csv"))
+    assert (summary['FittedResidues'] < summary['AlignedResidues']).any()
+
+
+def test_ensembles_are_analysed_per_model(tmp_path, pipeline_env):
+    members = generate_family(str(tmp_path / 'members'), n_members=6, length=40, seed=5)
+    write_ensembles(str(tmp_path / 'fam'), members, 3)
+    output_dir = run_family(tmp_path, "ens_0_ChainA.pdb", "--ensemble")
+
+    store_dir = os.path.join(output_dir, "family_store")
+    for table in ('angles', 'dssp', 'b_factors', 'asa', 'ss_composition'):
+        stored = family_store.read_table(os.path.join(store_dir, f"fam_{table}.fstore"), ['Structure', 'Model'])
+        assert sorted(set(zip(stored['Structure'], stored['Model']))) == [
+            (f"ens_{i}_ChainA", model) for i in range(2) for model in range(3)], table
+    angles = family_store.read_table(os.path.join(store_dir, "fam_angles.fstore"))
+    model = angles[(angles['Structure'] == 'ens_1_ChainA') & (angles['Model'] == 2)]
+    assert np.allclose(model['Phi'], standard_angles(members[5])['Phi'], equal_nan=True)
+
+    # Every model is a conformer compared with the first model of the reference
+    deltas = pd.read_csv(os.path.join(output_dir, "delta", "agg_fam.csv"))
+    assert sorted(set(zip(deltas['Target'], deltas['TargetModel']))) == [
+        ('ens_0_ChainA', 1), ('ens_0_ChainA', 2), ('ens_1_ChainA', 0), ('ens_1_ChainA', 1), ('ens_1_ChainA', 2)]
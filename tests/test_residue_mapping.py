@@ -0,0 +1,62 @@
+import os
+import numpy as np
+from residue_mapping import (alignment_indices, build_mapping, build_family_mappings, load_family_mappings,
+                             map_tm_record, record_alignment_name, mapping_output_name, residue_index,
+                             get_residue_numbers)
+from delta_phi_psi import parse_alignment_file
+from run_tm_align import run_tm_align, results_file_name
+from tm_align_results import passed_records
+from benchmarks.synthetic_family import generate_family
+TM_ALIGN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "tools", "TMalign")
+
+
+def random_alignment(rng, length):
+    seq1, markers, seq2 = [], [], []
+    for _ in range(length):
+        gap = rng.integers(0, 5)
+        seq1.append('-' if gap == 1 else 'A')
+        seq2.append('-' if gap == 2 else 'G')
+        markers.append(' ' if gap in (1, 2) else rng.choice([' ', '.', ':']))
+    return ''.join(seq1), ''.join(markers), ''.join(seq2)
+
+
+def test_indices_match_the_text_mapping():
+    rng = np.random.default_rng(0)
+    seq1, markers, seq2 = random_alignment(rng, 80)
+    numbers_1 = [(number, 'A') for number in range(10, 10 + seq1.count('A'))]
+    numbers_2 = [(number, 'G') for number in range(-3, -3 + seq2.count('G'))]
+    lines = build_mapping(seq1, markers, seq2, numbers_1, numbers_2)
+
+    first, second, marker_class = alignment_indices(seq1, markers, seq2, [n for n, _ in numbers_1],
+                                                    [n for n, _ in numbers_2])
+    expected = [tuple(int(part.strip()[:-1]) for part in line.split(' - ')) for line in lines]
+    assert list(zip(first.tolist(), second.tolist())) == expected
+    assert marker_class.tolist() == [2 if m == ':' else 1 for m in markers if m != ' ']
+
+
+def test_family_mappings_match_the_per_pair_files(tmp_path):
+    pdb_dir = str(tmp_path / 'fam')
+    # Chain file names, as extract_ChainA writes them
+    for i, path in enumerate(generate_family(pdb_dir, n_members=4, length=40, noise=0.1, loop_noise=0.1, seed=6)):
+        os.rename(path, os.path.join(pdb_dir, f"m{i}_ChainA.pdb"))
+    reference = "m0_ChainA.pdb"
+    run_tm_align(pdb_dir, str(tmp_path / 'tm'), reference, TM_ALIGN, 'fam', workers=2)
+    results_path = str(tmp_path / 'tm' / results_file_name('fam'))
+    mappings = load_family_mappings(build_family_mappings(results_path, pdb_dir, str(tmp_path / 'map'), 'fam'))
+
+    records = passed_records(results_path)
+    assert mappings['target'].tolist() == [record['Mobile'] for record in records] and records
+    for pair, record in enumerate(records):
+        map_tm_record(record, pdb_dir, str(tmp_path / 'text'))
+        text = parse_alignment_file(str(tmp_path / 'text' / mapping_output_name(record_alignment_name(record))))
+        start, end = mappings['offsets'][pair], mappings['offsets'][pair + 1]
+        # The text mapping goes from the mobile structure (Chain_1) to the reference
+        assert dict(zip(mappings['target_resnum'][start:end].tolist(),
+                        mappings['ref_resnum'][start:end].tolist())) == text
+
+
+def test_residue_index_is_cached_per_file_version(tmp_path):
+    path = generate_family(str(tmp_path / 'fam'), n_members=1, length=20, seed=7)[0]
+    first = residue_index(path, 'A')
+    assert first.tolist() == [number for number, _ in get_residue_numbers(path, 'A')]
+    assert residue_index(path, 'A') is first
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+from rmsd_calculation import rmsd_table, sort_residues
+
+
+def coordinate_table(seed=1, n_models=5, n_residues=30):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for model in range(n_models):
+        for residue in range(1, n_residues + 1):
+            # Some residues are missing from some models
+            if model and rng.random() < 0.1:
+                continue
+            resi = '7A' if residue == 7 else str(residue)
+            for name in ('N', 'CA', 'C'):
+                rows.append((f'mod{model}', resi, 'ALA' if residue % 2 else 'GLY', name, *rng.normal(size=3)))
+    return pd.DataFrame(rows, columns=['model', 'resi', 'resn', 'name', 'x', 'y', 'z'])
+
+
+def reference_table(df):
+    # The per-model, per-residue loop the pipeline used before the vectorized implementation
+    reference_model = df['model'].iloc[0]
+    reference = df[(df['model'] == reference_model) & (df['name'] == 'CA')]
+    models = [model for model in df['model'].unique() if model != reference_model]
+    rows = []
+    for residue in reference['resi'].unique():
+        reference_xyz = reference.loc[reference['resi'] == residue, ['x', 'y', 'z']].to_numpy()[0]
+        row = {'Residue': str(residue), 'Amino_Acid': reference.loc[reference['resi'] == residue, 'resn'].iloc[0]}
+        for model in models:
+            atoms = df[(df['model'] == model) & (df['resi'] == residue) & (df['name'] == 'CA')]
+            row[f'RMSD:{model}'] = np.linalg.norm(atoms[['x', 'y', 'z']].to_numpy()[0] - reference_xyz) \
+                if len(atoms) else np.nan
+        rows.append(row)
+    table = pd.DataFrame(rows)
+    table['Residue'] = pd.Categorical(table['Residue'], categories=sort_residues(table['Residue']), ordered=True)
+    table = table.sort_values('Residue').reset_index(drop=True)
+    table['Mean_RMSD'] = table[[f'RMSD:{model}' for model in models]].mean(axis=1)
+    return table
+
+
+def test_rmsd_table_matches_reference_loop():
+    df = coordinate_table()
+    result = rmsd_table(df, 'CA', df['model'].iloc[0])
+    expected = reference_table(df)
+    assert result.columns.tolist() == expected.columns.tolist()
+    assert result['Residue'].astype(str).tolist() == expected['Residue'].astype(str).tolist()
+    assert result['Amino_Acid'].tolist() == expected['Amino_Acid'].tolist()
+    assert np.allclose(result.iloc[:, 2:].to_numpy(dtype=float), expected.iloc[:, 2:].to_numpy(dtype=float),
+                       equal_nan=True)
+
+
+def test_residue_order_is_natural():
+    assert sort_residues(['10', '7A', '2', '7']) == ['2', '7', '7A', '10']
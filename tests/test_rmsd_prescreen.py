@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+from rmsd_prescreen import (align_sequences, estimate_rmsd, screen_pair, audited, screen_summary, MATCH_SCORE,
+                            MISMATCH_SCORE, GAP_PENALTY)
+
+
+def alignment_score(sequence_1, sequence_2, index_1, index_2):
+    pairs = sum(MATCH_SCORE if sequence_1[i] == sequence_2[j] else MISMATCH_SCORE for i, j in zip(index_1, index_2))
+    # Gaps before the first and after the last aligned pair are free
+    gaps = (index_1[-1] - index_1[0] + 1 - len(index_1)) + (index_2[-1] - index_2[0] + 1 - len(index_2))
+    return pairs - GAP_PENALTY * gaps
+
+
+def test_alignment_scores_match_biopython():
+    from Bio.Align import PairwiseAligner
+    aligner = PairwiseAligner(mode='global', match_score=MATCH_SCORE, mismatch_score=MISMATCH_SCORE,
+                              open_gap_score=-GAP_PENALTY, extend_gap_score=-GAP_PENALTY)
+    aligner.end_gap_score = 0
+    rng = np.random.default_rng(0)
+    letters = np.array(list('ACDEFGHIKLMNPQRSTVWY'))
+    for _ in range(50):
+        base = ''.join(rng.choice(letters[:6], rng.integers(5, 40)))
+        other = ''.join(char if rng.random() > 0.3 else rng.choice(letters[:6]) for char in base
+                        if rng.random() > 0.1)
+        other = ''.join(rng.choice(letters[:6], rng.integers(0, 5))) + other
+        index_1, index_2 = align_sequences(base, other)
+        assert np.all(np.diff(index_1) > 0) and np.all(np.diff(index_2) > 0)
+        assert alignment_score(base, other, index_1, index_2) == aligner.score(base, other)
+
+
+def random_trace(rng, length=60):
+    steps = rng.normal(size=(length, 3))
+    steps *= 3.8 / np.linalg.norm(steps, axis=1, keepdims=True)
+    return ''.join(rng.choice(list('ACDEFGHIKLMNPQRSTVWY'), length)), np.cumsum(steps, axis=0)
+
+
+def test_estimate_is_invariant_to_rigid_motion():
+    rng = np.random.default_rng(1)
+    sequence, ca = random_trace(rng)
+    rotation, _ = np.linalg.qr(rng.normal(size=(3, 3)))
+    rotation *= np.sign(np.linalg.det(rotation))
+    # The mobile chain misses three N-terminal residues
+    mobile = (sequence[3:], ca[3:] @ rotation.T + 10.0)
+    estimate = estimate_rmsd(mobile, (sequence, ca))
+    assert estimate['AlignedLength'] == len(sequence) - 3
+    assert estimate['ScreenIdentity'] == 1.0
+    assert estimate['ScreenRMSD'] < 1e-6
+
+
+def test_screen_decisions():
+    rng = np.random.default_rng(2)
+    sequence, ca = random_trace(rng)
+    close = (sequence, ca + rng.normal(size=ca.shape) * 0.5)
+    far = (sequence, ca + rng.normal(size=ca.shape) * 4.0)
+    assert screen_pair(close, (sequence, ca), max_rmsd=3.0)['ScreenDecision'] == 'pass'
+    rejected = screen_pair(far, (sequence, ca), max_rmsd=3.0, margin=0.0)
+    assert rejected['ScreenDecision'] == 'reject' and rejected['ScreenRMSD'] > 3.0
+    unrelated = (''.join(rng.choice(list('WY'), len(sequence))), ca)
+    assert screen_pair(unrelated, (sequence, ca), max_rmsd=3.0)['ScreenDecision'] == 'unjudged'
+    assert screen_pair((sequence[:5], ca[:5]), (sequence, ca), max_rmsd=3.0)['ScreenDecision'] == 'unjudged'
+
+
+def test_audit_sample_is_stable():
+    names = [f'member_{i}.pdb' for i in range(2000)]
+    sample = [name for name in names if audited(name, 0.1)]
+    assert sample == [name for name in names if audited(name, 0.1)]
+    assert 150 < len(sample) < 250
+    assert not any(audited(name, 0.0) for name in names)
+    assert all(audited(name, 1.0) for name in names)
+
+
+def test_screen_summary_counts_false_rejects():
+    results = pd.DataFrame({'ScreenDecision': ['pass', 'reject', 'reject', 'reject', 'unjudged'],
+                            'Status': ['ok', 'screened', 'ok', 'ok', 'ok'],
+                            'RMSD': [1.0, np.nan, 2.5, 4.0, 2.0]})
+    assert screen_summary(results, 3.0) == {'judged': 4, 'rejected': 3, 'audited': 2, 'false_rejects': 1}
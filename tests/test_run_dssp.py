@@ -0,0 +1,33 @@
+import os
+import shutil
+import pandas as pd
+import family_store
+from run_dssp import process_pdb_files, store_pdb_file, dssp_output_name, residue_output_name
+from asa_extraction import parse_dssp
+from benchmarks.synthetic_family import generate_family
+MKDSSP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "tools", "mkdssp")
+
+
+def test_one_run_feeds_every_dssp_product(tmp_path, pipeline_env):
+    paths = generate_family(str(tmp_path / 'fam'), n_members=3, length=30, seed=8)
+    out = str(tmp_path / 'dssp')
+    process_pdb_files(str(tmp_path / 'fam'), out, MKDSSP, workers=2)
+    for path in paths:
+        residues = pd.read_csv(os.path.join(out, residue_output_name(path)))
+        parsed = parse_dssp(os.path.join(out, dssp_output_name(path)))
+        columns = ['ResidueNumber', 'AminoAcid', 'ASA', 'RelativeASA', 'NH_O_1_Energy', 'Phi', 'Psi']
+        pd.testing.assert_frame_equal(residues[columns], parsed[columns], check_dtype=False)
+        assert len(residues) > 20
+
+
+def test_failed_run_removes_stored_rows(tmp_path, pipeline_env):
+    path = generate_family(str(tmp_path / 'fam'), n_members=1, length=30, seed=9)[0]
+    residues, composition = str(tmp_path / 'fam_dssp.fstore'), str(tmp_path / 'fam_ss.fstore')
+    dssp_file = store_pdb_file(path, str(tmp_path), residues, composition, MKDSSP)
+    assert dssp_file == os.path.join(str(tmp_path), dssp_output_name(path))
+    stored = family_store.read_table(composition)
+    assert abs(stored['Percentage'].sum() - 100) < 1e-6
+    assert len(family_store.read_table(residues)) == len(parse_dssp(dssp_file))
+
+    assert store_pdb_file(path, str(tmp_path), residues, composition, shutil.which('false')) is None
+    assert family_store.read_table(residues).empty and family_store.read_table(composition).empty
@@ -0,0 +1,69 @@
+import os
+import stat
+import pandas as pd
+from run_tm_align import parse_tm_output, run_tm_align, results_file_name
+from tm_align_results import passed_records
+from benchmarks.synthetic_family import generate_family
+TM_ALIGN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "tools", "TMalign")
+
+OUTPUT = """
+ *  TM-align (Version 20190822): protein structure alignment
+
+Name of Chain_1: a.pdb (to be superimposed onto Chain_2)
+Name of Chain_2: b.pdb
+Length of Chain_1: 8 residues
+Length of Chain_2: 9 residues
+
+Aligned length=    7, RMSD=   1.23, Seq_ID=n_identical/n_aligned= 0.571
+TM-score= 0.41234 (if normalized by length of Chain_1, i.e., LN=8, d0=0.50)
+TM-score= 0.39876 (if normalized by length of Chain_2, i.e., LN=9, d0=0.50)
+(You should use TM-score normalized by length of the reference structure)
+
+(":" denotes residue pairs of d <  5.0 Angstrom, "." denotes other aligned residues)
+ MKV-LAAGE
+  ::.:::: 
+MMKVALAAG-
+"""
+
+
+def test_parse_tm_output():
+    record = parse_tm_output(OUTPUT)
+    assert (record['Length1'], record['Length2'], record['AlignedLength']) == (8, 9, 7)
+    assert (record['RMSD'], record['SeqID'], record['TMScore1'], record['TMScore2']) == (1.23, 0.571, 0.41234, 0.39876)
+    # Alignment lines keep their leading spaces
+    assert (record['Seq1'], record['Markers'], record['Seq2']) == (' MKV-LAAGE', '  ::.:::: ', 'MMKVALAAG-')
+    assert parse_tm_output("Warning: no output")['RMSD'] is None
+
+
+def test_records_pass_by_rmsd_and_are_reused(tmp_path, capsys):
+    pdb_dir = str(tmp_path / 'fam')
+    paths = generate_family(pdb_dir, n_members=4, length=40, noise=0.3, loop_noise=0.3, seed=5)
+    # A distorted member fails the 3 Angstrom cutoff
+    generate_family(pdb_dir, n_members=1, length=40, noise=4.0, loop_noise=4.0, seed=6, prefix='outlier')
+    reference = os.path.basename(paths[0])
+    results_path = run_tm_align(pdb_dir, str(tmp_path / 'out'), reference, TM_ALIGN, workers=2, screen_margin=None)
+    assert results_path == str(tmp_path / 'out' / results_file_name('fam'))
+
+    results = pd.read_csv(results_path)
+    assert results['Mobile'].tolist() == ['member_1.pdb', 'member_2.pdb', 'member_3.pdb', 'outlier_0.pdb']
+    assert (results['Status'] == 'ok').all() and (results['Reference'] == reference).all()
+    assert results['Passed'].tolist() == (results['RMSD'] <= 3.0).tolist() == [True, True, True, False]
+    assert [record['Mobile'] for record in passed_records(results_path)] == ['member_1.pdb', 'member_2.pdb',
+                                                                             'member_3.pdb']
+
+    capsys.readouterr()
+    run_tm_align(pdb_dir, str(tmp_path / 'out'), reference, TM_ALIGN, screen_margin=None)
+    assert "0 pair(s), 4 reused" in capsys.readouterr().out
+    pd.testing.assert_frame_equal(pd.read_csv(results_path), results)
+
+
+def test_failed_runs_are_recorded(tmp_path):
+    pdb_dir = str(tmp_path / 'fam')
+    paths = generate_family(pdb_dir, n_members=2, length=30, seed=7)
+    failing = tmp_path / 'TMalign'
+    failing.write_text("#!/bin/sh\necho 'no structure' >&2\nexit 1\n")
+    failing.chmod(failing.stat().st_mode | stat.S_IEXEC)
+    results_path = run_tm_align(pdb_dir, str(tmp_path / 'out'), os.path.basename(paths[0]), str(failing),
+                                retries=0, screen_margin=None)
+    record = pd.read_csv(results_path).iloc[0]
+    assert record['Status'] == 'error' and not record['Passed']
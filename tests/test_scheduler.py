@@ -0,0 +1,55 @@
+import os
+import pytest
+from scheduler import Stage, topological_order, run_stages
+
+
+def write_line(path, text):
+    with open(path, 'a') as f:
+        f.write(text + '\n')
+
+
+def write_nothing(path):
+    pass
+
+
+def fail(path):
+    raise RuntimeError(f"cannot process {path}")
+
+
+def test_topological_order_puts_dependencies_first():
+    stages = [Stage('c', write_line, deps=['a', 'b']), Stage('b', write_line, deps=['a']), Stage('a', write_line)]
+    order = topological_order(stages)
+    assert sorted(order) == ['a', 'b', 'c']
+    assert order.index('a') < order.index('b') < order.index('c')
+
+
+def test_topological_order_rejects_cycles_and_unknown_dependencies():
+    with pytest.raises(ValueError, match='cycle'):
+        topological_order([Stage('a', write_line, deps=['b']), Stage('b', write_line, deps=['a'])])
+    with pytest.raises(ValueError, match='unknown stage'):
+        topological_order([Stage('a', write_line, deps=['missing'])])
+
+
+def test_run_stages_runs_downstream_after_upstream(tmp_path):
+    log = str(tmp_path / 'log.txt')
+    stages = [Stage('second', write_line, deps=['first'], items=lambda: [(log, 'second')]),
+              Stage('first', write_line, items=lambda: [(log, 'first')] * 3)]
+    summary = run_stages(stages, workers=2)
+    assert summary == {'first': {'items': 3, 'cached': 0, 'failed': 0},
+                       'second': {'items': 1, 'cached': 0, 'failed': 0}}
+    with open(log) as f:
+        assert f.read().split() == ['first'] * 3 + ['second']
+
+
+def test_run_stages_counts_failures_and_missing_outputs(tmp_path):
+    paths = [str(tmp_path / f'{i}.txt') for i in range(4)]
+    stages = [Stage('raises', fail, items=lambda: [(paths[0],)]),
+              Stage('lazy', write_nothing, items=lambda: [(path,) for path in paths[1:]],
+                    outputs=lambda path: [path]),
+              Stage('after', write_line, deps=['raises', 'lazy'], items=lambda: [(paths[0], 'ran')])]
+    summary = run_stages(stages, workers=2)
+    assert summary['raises'] == {'items': 1, 'cached': 0, 'failed': 1}
+    assert summary['lazy'] == {'items': 3, 'cached': 0, 'failed': 3}
+    # Failures do not stop the downstream stages
+    assert summary['after']['failed'] == 0
+    assert os.path.exists(paths[0])
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from structure_store import Structure, iter_models
+
+
+def atom(serial, name, resname, chain, resnum, xyz, altloc=' ', occupancy=1.0, bfactor=10.0, record='ATOM'):
+    x, y, z = xyz
+    return (f"{record:<6}{serial:5d} {name:<4}{altloc}{resname:>3} {chain}{resnum:>4}    "
+            f"{x:8.3f}{y:8.3f}{z:8.3f}{occupancy:6.2f}{bfactor:6.2f}          {name[0]:>2}")
+
+
+def records(lines):
+    return [line.encode().ljust(80)[:80] for line in lines]
+
+
+def test_altloc_masks():
+    lines = [
+        atom(1, 'N', 'SER', 'A', 1, (0, 0, 0)),
+        atom(2, 'CA', 'SER', 'A', 1, (1, 0, 0), altloc='A', occupancy=0.3),
+        atom(3, 'CA', 'SER', 'A', 1, (2, 0, 0), altloc='B', occupancy=0.7),
+        atom(4, 'OG', 'SER', 'A', 1, (3, 0, 0), altloc='A', occupancy=0.5),
+        atom(5, 'OG', 'SER', 'A', 1, (4, 0, 0), altloc='B', occupancy=0.5),
+        atom(6, 'N', 'GLY', 'A', 2, (5, 0, 0)),
+        atom(7, 'O', 'HOH', 'W', 1, (6, 0, 0), record='HETATM'),
+    ]
+    structure = Structure.from_records(records(lines), [0] * len(lines))
+    assert list(structure.altloc) == ['', 'A', 'B', 'A', 'B', '', '']
+    assert list(structure.hetero) == [False] * 6 + [True]
+    assert list(structure.res_resname) == ['SER', 'GLY', 'HOH']
+    assert list(structure.res_standard) == [True, True, False]
+    # Highest occupancy, first listed on ties
+    assert list(np.flatnonzero(structure.occupancy_atom_mask())) == [0, 2, 3, 5, 6]
+
+
+def test_blank_occupancy_and_bad_residue_numbers():
+    line = atom(1, 'CA', 'ALA', 'A', 7, (1, 2, 3))
+    blank = line[:54] + ' ' * 6 + line[60:]
+    structure = Structure.from_records(records([blank]), [0])
+    assert np.isnan(structure.occupancy[0])
+    assert structure.resnum[0] == 7
+
+    hybrid = Structure.from_records(records([atom(1, 'CA', 'ALA', 'A', 'A000', (0, 0, 0))]), [0])
+    assert hybrid.resnum[0] == 10000
+    with pytest.raises(ValueError, match='bad.pdb.*1x'):
+        Structure.from_records(records([atom(1, 'CA', 'ALA', 'A', '1x', (0, 0, 0))]), [0], 'bad.pdb')
+
+
+def test_multi_model_file(tmp_path):
+    path = tmp_path / 'ensemble.pdb'
+    lines = []
+    for model in range(3):
+        lines.append(f"MODEL     {model + 1:4d}")
+        for resnum in (1, 2):
+            lines.append(atom(resnum, 'CA', 'ALA', 'A', resnum, (model, resnum, 0)))
+        lines.append("ENDMDL")
+    path.write_text('\n'.join(lines + ['END']) + '\n')
+
+    structure = Structure.from_pdb(str(path))
+    assert list(structure.models) == [0, 1, 2]
+    assert list(structure.res_model) == [0, 0, 1, 1, 2, 2]
+    assert list(structure.res_resnum) == [1, 2] * 3
+    assert structure.residue_mask(model=1).sum() == 2
+    assert structure.coords[structure.model == 2][:, 0].tolist() == [2.0, 2.0]
+
+    models = list(iter_models(str(path)))
+    assert [model_id for model_id, _ in models] == [0, 1, 2]
+    for model_id, part in models:
+        assert np.array_equal(part.coords, structure.coords[structure.model == model_id])
+        assert list(part.res_resnum) == [1, 2]
@@ -0,0 +1,57 @@
+import numpy as np
+from superposition import kabsch_superpose, superposition_deviations
+
+
+def random_rotations(n, rng):
+    q, r = np.linalg.qr(rng.normal(size=(n, 3, 3)))
+    q *= np.sign(np.diagonal(r, axis1=1, axis2=2))[:, None, :]
+    q[np.linalg.det(q) < 0, :, 0] *= -1
+    return q
+
+
+def test_kabsch_matches_biopython():
+    from Bio.SVDSuperimposer import SVDSuperimposer
+    rng = np.random.default_rng(0)
+    reference = rng.normal(size=(6, 25, 3)) * 10
+    mobile = reference + rng.normal(size=reference.shape)
+    mobile = np.einsum('bni,bji->bnj', mobile, random_rotations(6, rng)) + rng.normal(size=(6, 1, 3)) * 20
+    weights = np.ones((6, 25))
+    # Padded positions of a shorter set do not affect its fit
+    weights[0, 20:] = 0
+    mobile[0, 20:] = 1e3
+    fitted = kabsch_superpose(mobile, reference, weights)
+
+    for batch in range(6):
+        n = int(weights[batch].sum())
+        superimposer = SVDSuperimposer()
+        superimposer.set(reference[batch, :n], mobile[batch, :n])
+        superimposer.run()
+        assert np.allclose(fitted[batch, :n], superimposer.get_transformed(), atol=1e-6)
+
+
+def test_trimmed_fit_ignores_outliers():
+    rng = np.random.default_rng(1)
+    reference = rng.normal(size=(4, 40, 3)) * 10
+    mobile = np.einsum('bni,bji->bnj', reference, random_rotations(4, rng)) + rng.normal(size=(4, 1, 3)) * 5
+    mobile[:, :4] += 8.0
+    present = np.ones((4, 40), dtype=bool)
+    present[0, 30:] = False
+
+    deviations, fitted = superposition_deviations(mobile, reference, present)
+    assert np.nanmax(deviations[:, 4:]) > 0.1
+    deviations, fitted = superposition_deviations(mobile, reference, present, trim_cutoff=2.0)
+    assert np.nanmax(deviations[:, 4:]) < 1e-6
+    assert not fitted[:, :4].any()
+    assert np.isnan(deviations[0, 30:]).all() and not fitted[0, 30:].any()
+
+
+def test_deviations_belong_to_the_returned_mask():
+    rng = np.random.default_rng(2)
+    reference = rng.normal(size=(3, 30, 3)) * 10
+    mobile = reference + rng.normal(size=reference.shape) * np.linspace(0.1, 3.0, 30)[None, :, None]
+    present = np.ones((3, 30), dtype=bool)
+    for max_iterations in (1, 2, 5):
+        deviations, fitted = superposition_deviations(mobile, reference, present, trim_cutoff=1.5,
+                                                      max_iterations=max_iterations)
+        expected = np.linalg.norm(kabsch_superpose(mobile, reference, fitted.astype(float)) - reference, axis=2)
+        assert np.allclose(deviations, expected)
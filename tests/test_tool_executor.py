@@ -0,0 +1,79 @@
+import os
+import time
+import tool_executor
+from tool_executor import ToolExecutor, parse_tool_limits
+
+
+def counted_sleep(directory, seconds=0.2):
+    # Prints how many jobs, itself included, are running when it starts
+    return ['sh', '-c', f'mkdir {directory}/$$; ls {directory} | wc -l; sleep {seconds}; rmdir {directory}/$$']
+
+
+def has_tm_score(stdout):
+    return 'TM-score' in stdout
+
+
+def running_at_most(executors, tool, directory, jobs):
+    os.makedirs(directory, exist_ok=True)
+    futures = [executors[i % len(executors)].submit(tool, counted_sleep(directory)) for i in range(jobs)]
+    results = [future.result() for future in futures]
+    assert all(result['status'] == 'ok' for result in results)
+    return max(int(result['stdout']) for result in results)
+
+
+def test_timeout_kills_the_process_group(tmp_path):
+    pid_file = tmp_path / 'child.pid'
+    start = time.perf_counter()
+    result = ToolExecutor().run('sleeper', ['sh', '-c', f'sleep 30 & echo $! > {pid_file}; wait'], timeout=0.5)
+    assert result['status'] == 'timeout' and result['attempts'] == 1
+    assert time.perf_counter() - start < 5
+    # The background sleep was killed with its shell
+    pid = int(pid_file.read_text())
+    time.sleep(0.1)
+    if os.path.exists(f'/proc/{pid}/stat'):
+        with open(f'/proc/{pid}/stat') as f:
+            assert f.read().split(')')[-1].split()[0] == 'Z'
+
+
+def test_failures_are_retried(tmp_path):
+    counter = tmp_path / 'attempts'
+    # Fails on the first two attempts
+    command = ['sh', '-c', f'n=$(cat {counter} 2>/dev/null || echo 0); echo $((n + 1)) > {counter}; '
+                           f'echo failed $n >&2; [ $n -ge 2 ]']
+    executor = ToolExecutor()
+    result = executor.run('flaky', command, retries=1, backoff=0.01)
+    assert (result['status'], result['attempts'], result['error']) == ('error', 2, 'failed 1')
+    counter.unlink()
+    result = executor.run('flaky', command, retries=3, backoff=0.01)
+    assert (result['status'], result['attempts'], result['returncode']) == ('ok', 3, 0)
+
+    result = executor.run('echo', ['echo', 'no alignment'], retries=1, backoff=0.01, accept=has_tm_score)
+    assert (result['status'], result['attempts']) == ('error', 2)
+    assert executor.run('missing', [str(tmp_path / 'no_such_tool')])['status'] == 'error'
+
+
+def test_output_is_bounded():
+    executor = ToolExecutor()
+    command = ['head', '-c', '100000', '/dev/zero']
+    result = executor.run('head', command, max_output=1000)
+    assert result['status'] == 'error' and 'exceeded 1000 bytes' in result['error']
+    assert len(result['stdout']) == 1000
+    assert len(executor.run('head', command, max_output=200000)['stdout']) == 100000
+
+
+def test_budget_and_tool_limits(tmp_path):
+    executor = ToolExecutor(max_processes=3, tool_limits={'slow': 1})
+    assert running_at_most([executor], 'fast', str(tmp_path / 'fast'), 9) == 3
+    assert running_at_most([executor], 'slow', str(tmp_path / 'slow'), 3) == 1
+
+
+def test_slot_files_share_the_budget(tmp_path, pipeline_env):
+    slots = str(tmp_path / 'slots')
+    tool_executor.set_budget(slots, 2, {'TMalign': 1})
+    executor = tool_executor.get_executor()
+    assert (executor.max_processes, executor.tool_limits, executor.slot_dir) == (2, {'TMalign': 1}, slots)
+    assert tool_executor.get_executor() is executor
+    # A second executor on the same slot files, as in another worker process
+    other = ToolExecutor(2, parse_tool_limits(os.environ[tool_executor.TOOL_LIMITS_ENV]), slots)
+    assert running_at_most([executor, other], 'mkdssp', str(tmp_path / 'dssp'), 6) == 2
+    assert running_at_most([executor, other], 'TMalign', str(tmp_path / 'tm'), 4) == 1
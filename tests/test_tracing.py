@@ -0,0 +1,49 @@
+import json
+import pytest
+import tool_executor
+from scheduler import Stage, run_stages
+from tracing import Tracer, traced_call
+
+
+def sleep_tool(seconds):
+    result = tool_executor.run_tool('sleep', ['sleep', str(seconds)])
+    assert result['status'] == 'ok'
+
+
+def busy(n):
+    return sum(i * i for i in range(n))
+
+
+def fail(path):
+    raise RuntimeError(f"cannot process {path}")
+
+
+def test_tool_time_is_counted_as_external(pipeline_env):
+    trace = traced_call(sleep_tool, (0.2,))
+    assert trace['external_seconds']['sleep'] >= 0.2
+    assert trace['wall_seconds'] >= trace['external_seconds']['sleep']
+
+
+def test_failed_items_keep_their_measurements():
+    with pytest.raises(RuntimeError) as error:
+        traced_call(fail, ('x.pdb',))
+    assert error.value.trace['wall_seconds'] >= 0
+
+
+def test_tracer_writes_trace_and_profile(tmp_path):
+    tracer = Tracer(profile_stage='busy', interval=0.001)
+    stages = [Stage('busy', busy, items=lambda: [(300000,), (200000,)]),
+              Stage('fails', fail, deps=['busy'], items=lambda: [('a.pdb',)])]
+    run_stages(stages, workers=2, hooks=[tracer])
+
+    with open(tracer.write_trace(str(tmp_path / 'trace.json'))) as f:
+        trace = json.load(f)
+    items = [event for event in trace['traceEvents'] if event['ph'] == 'X']
+    assert sorted(event['cat'] for event in items) == ['busy', 'busy', 'fails']
+    summary = {row['stage']: row for row in trace['stageSummary']}
+    assert (summary['busy']['items'], summary['busy']['failed']) == (2, 0)
+    assert (summary['fails']['items'], summary['fails']['failed']) == (1, 1)
+
+    with open(tracer.write_folded(str(tmp_path / 'busy.folded'))) as f:
+        lines = f.read().splitlines()
+    assert any(line.startswith('busy (test_tracing.py') for line in lines)
@@ -0,0 +1,134 @@
+import os
+import time
+import json
+import pytest
+import main_pipeline
+from scheduler import Stage
+from work_queue import Leases, WorkQueue, add_family, status
+from benchmarks.synthetic_family import generate_family
+TOOLS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "tools")
+
+
+@pytest.fixture
+def leases():
+    held = []
+
+    def make(worker, lease_seconds=60):
+        lease = Leases(worker, lease_seconds)
+        held.append(lease)
+        return lease
+
+    yield make
+    for lease in held:
+        lease.close()
+
+
+def expire(path, lease_seconds):
+    old = time.time() - 2 * lease_seconds
+    os.utime(path, (old, old))
+
+
+def test_claim_is_exclusive_until_the_lease_expires(tmp_path, leases):
+    path = str(tmp_path / 'claims' / 'fam' / 'stage' / '0')
+    a, b = leases('A'), leases('B')
+    assert a.claim(path) == 1
+    assert b.claim(path) == 0
+
+    expire(path, a.lease_seconds)
+    assert b.claim(path) == 2
+    with open(path) as f:
+        assert json.load(f)['worker'] == 'B'
+    # The worker that lost its lease must not remove the new claim
+    a.release(path)
+    assert os.path.exists(path)
+    b.release(path)
+    assert not os.path.exists(path)
+
+
+def test_attempts_count_up_over_takeovers(tmp_path, leases):
+    path = str(tmp_path / 'claim')
+    assert leases('A').claim(path) == 1
+    for attempt, worker in ((2, 'B'), (3, 'C')):
+        expire(path, 60)
+        assert leases(worker).claim(path) == attempt
+
+
+def test_heartbeat_keeps_the_claim(tmp_path, leases):
+    path = str(tmp_path / 'claim')
+    a = leases('A', lease_seconds=1.0)
+    assert a.claim(path) == 1
+    expire(path, 1.0)
+    time.sleep(0.5)
+    assert leases('B', lease_seconds=1.0).claim(path) == 0
+
+
+def append_line(path, text):
+    with open(path, 'a') as f:
+        f.write(text + '\n')
+
+
+def family_stages(config):
+    log = config['log']
+    return [Stage('first', append_line, items=lambda: [(log, f'first {i}') for i in range(3)]),
+            Stage('second', append_line, deps=['first'], items=lambda: [(log, 'second')])]
+
+
+def test_workers_finish_every_stage_in_order(tmp_path):
+    queue_dir = str(tmp_path / 'queue')
+    for family in ('fam_a', 'fam_b'):
+        add_family(queue_dir, family, {'log': str(tmp_path / f'{family}.log')})
+    workers = [WorkQueue(queue_dir, family_stages, worker=name) for name in ('w1', 'w2')]
+    # Two workers take turns, as two hosts would interleave
+    while any(worker.work(poll_seconds=0, max_tasks=1, exit_when_idle=True) for worker in workers):
+        pass
+    for family in ('fam_a', 'fam_b'):
+        with open(tmp_path / f'{family}.log') as f:
+            lines = f.read().splitlines()
+        assert sorted(lines[:3]) == ['first 0', 'first 1', 'first 2'] and lines[3:] == ['second']
+        assert WorkQueue(queue_dir, family_stages).finished(family, 'second')
+    rows = status(queue_dir)
+    assert len(rows) == 4
+    assert all(row['finished'] and row['done'] == row['tasks'] and not row['claimed'] for row in rows)
+
+
+def write_nothing(path):
+    pass
+
+
+def test_task_without_declared_outputs_fails(tmp_path):
+    queue_dir = str(tmp_path / 'queue')
+    target = str(tmp_path / 'out.txt')
+    add_family(queue_dir, 'fam', {})
+    stages = lambda config: [Stage('lazy', write_nothing, items=lambda: [(target,)], outputs=lambda path: [path])]
+    WorkQueue(queue_dir, stages, worker='w1').work(poll_seconds=0, exit_when_idle=True)
+    with open(os.path.join(queue_dir, 'done', 'fam', 'lazy', '0.json')) as f:
+        record = json.load(f)
+    assert record['status'] == 'failed' and target in record['error']
+    with open(os.path.join(queue_dir, 'finished', 'fam', 'lazy.json')) as f:
+        assert json.load(f)['failed'] == 1
+
+
+def test_families_need_a_reference_or_all_vs_all(tmp_path):
+    input_dirs = [str(tmp_path / 'fam_a'), str(tmp_path / 'fam_b')]
+    with pytest.raises(ValueError, match='fam_b'):
+        main_pipeline.enqueue_families(str(tmp_path / 'queue'), input_dirs, str(tmp_path / 'out'),
+                                       references={'fam_a': 'a_ChainA.pdb'})
+    with pytest.raises(ValueError, match='fam_c'):
+        main_pipeline.enqueue_families(str(tmp_path / 'queue'), input_dirs, str(tmp_path / 'out'),
+                                       references={'fam_c': 'c_ChainA.pdb'}, all_vs_all=True)
+
+
+def test_queued_all_vs_all_runs_one_task_per_pair(tmp_path, pipeline_env):
+    # An underscore in the family name must not change the entropy output name
+    input_dir = str(tmp_path / 'in' / 'my_fam')
+    generate_family(input_dir, n_members=4, length=40, seed=1)
+    queue_dir = str(tmp_path / 'queue')
+    main_pipeline.enqueue_families(queue_dir, [input_dir], str(tmp_path / 'out'), os.path.join(TOOLS_DIR, "mkdssp"),
+                                   os.path.join(TOOLS_DIR, "TMalign"), all_vs_all=True)
+    main_pipeline.run_queue_worker(queue_dir, poll_seconds=0, exit_when_idle=True)
+    rows = {row['stage']: row for row in status(queue_dir)}
+    assert all(row['finished'] for row in rows.values())
+    assert rows['all_vs_all_pairs']['tasks'] == rows['all_vs_all_pairs']['done'] > 1
+    assert rows['tm_align_pairs']['tasks'] == 3
+    assert os.path.exists(tmp_path / 'out' / 'my_fam' / 'entropy' / 'entropy_my_fam.csv')
+    assert os.path.exists(tmp_path / 'out' / 'my_fam' / 'correlation' / 'my_fam_correlation.csv')